@@ -0,0 +1,143 @@
+"""
+外部APIの応答のキャッシュ（全ワーカーで共有）
+
+応答を api_cache テーブルに保存し、TTL内はどのワーカーもAPIを呼ばずに保存済みの値を返す。
+TTLを過ぎた後も API_CACHE_STALE_MAX 秒までは古い値をすぐに返し、更新の権利を取得できた
+1つのワーカーだけがバックグラウンドで取得し直す（stale-while-revalidate）。
+取得に失敗した場合は API_CACHE_NEGATIVE_TTL 秒の間は再試行せず、古い値があればそれを返す。
+"""
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from db import get_db, get_read_db
+import singleflight
+
+logger = logging.getLogger(__name__)
+
+# 保存した値をそのまま使う時間（秒）
+API_CACHE_TTL = float(os.environ.get("API_CACHE_TTL", 600))
+
+# TTLを過ぎた値をバックグラウンド更新中に返してよい時間（秒）
+API_CACHE_STALE_MAX = float(os.environ.get("API_CACHE_STALE_MAX", 3600))
+
+# 取得に失敗した後、再試行しない時間（秒）
+API_CACHE_NEGATIVE_TTL = float(os.environ.get("API_CACHE_NEGATIVE_TTL", 60))
+
+# 更新の権利の有効期間（この間に更新が終わらなければ他のワーカーが取り直す）
+API_CACHE_REFRESH_LEASE = float(os.environ.get("API_CACHE_REFRESH_LEASE", 30))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _load(key):
+    return get_read_db().execute(
+        "SELECT payload, ok, fetched_at, expires_at FROM api_cache WHERE key=?", (key,)
+    ).fetchone()
+
+
+def _store(key, value, ttl, negative_ttl):
+    """取得結果を保存（失敗の場合は前回の値を残したまま再試行を止める）"""
+    db = get_db()
+    now = time.time()
+    if value is not None:
+        db.execute(
+            """INSERT INTO api_cache (key, payload, ok, fetched_at, expires_at, refreshing_until)
+               VALUES (?, ?, 1, ?, ?, 0)
+               ON CONFLICT(key) DO UPDATE SET payload=excluded.payload, ok=1,
+                   fetched_at=excluded.fetched_at, expires_at=excluded.expires_at, refreshing_until=0""",
+            (key, json.dumps(value, ensure_ascii=False), now, now + ttl)
+        )
+    else:
+        db.execute(
+            """INSERT INTO api_cache (key, payload, ok, fetched_at, expires_at, refreshing_until)
+               VALUES (?, NULL, 0, ?, ?, 0)
+               ON CONFLICT(key) DO UPDATE SET ok=0, expires_at=excluded.expires_at, refreshing_until=0""",
+            (key, now, now + negative_ttl)
+        )
+    db.commit()
+
+
+def _claim_refresh(key):
+    """このワーカーがバックグラウンド更新を行う権利を取得"""
+    db = get_db()
+    now = time.time()
+    cur = db.execute(
+        "UPDATE api_cache SET refreshing_until=? WHERE key=? AND refreshing_until<?",
+        (now + API_CACHE_REFRESH_LEASE, key, now)
+    )
+    db.commit()
+    return cur.rowcount == 1
+
+
+def _fetch_and_store(key, fetch, ttl, negative_ttl):
+    try:
+        value = fetch()
+    except Exception as e:
+        logger.error(f"Fetch for {key} failed: {e}")
+        value = None
+    _store(key, value, ttl, negative_ttl)
+    return value
+
+
+def _get_executor():
+    """バックグラウンド更新用のスレッド（ワーカープロセスごと）"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="api-cache")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _refresh_in_background(app, key, fetch, ttl, negative_ttl):
+    try:
+        with app.app_context():
+            _fetch_and_store(key, fetch, ttl, negative_ttl)
+    except Exception as e:
+        logger.error(f"Background refresh for {key} failed: {e}")
+
+
+def get_cached(key, fetch, ttl=API_CACHE_TTL, stale_max=API_CACHE_STALE_MAX, negative_ttl=API_CACHE_NEGATIVE_TTL):
+    """
+    キャッシュ済みの値を返す（なければ fetch() で取得して保存）
+
+    fetch: 値を返す関数（失敗した場合はNoneを返すか例外を送出）
+
+    Returns:
+        値（取得できない場合はNone）
+    """
+    row = _load(key)
+    now = time.time()
+    cached = None
+    if row is not None and row["payload"] is not None and now < row["fetched_at"] + ttl + stale_max:
+        cached = json.loads(row["payload"])
+
+    if row is not None and now < row["expires_at"]:
+        # TTL内、または失敗後の再試行待ち（古い値があればそれを返す）
+        return cached
+
+    if cached is not None:
+        # 古い値を返し、1つのワーカーだけがバックグラウンドで更新する
+        if _claim_refresh(key):
+            app = current_app._get_current_object()
+            _get_executor().submit(_refresh_in_background, app, key, fetch, ttl, negative_ttl)
+        return cached
+
+    # 保存済みの値がない: 取得は1つのワーカーだけが行い、他はその結果を使う
+    def load():
+        row = _load(key)
+        if row is None or time.time() >= row["expires_at"]:
+            return singleflight.MISSING
+        return json.loads(row["payload"]) if row["payload"] is not None else None
+
+    return singleflight.run(
+        f"api_cache:{key}", lambda: _fetch_and_store(key, fetch, ttl, negative_ttl), load, name="api_cache"
+    )
@@ -1,9 +1,29 @@
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify, g
+from flask import Flask, render_template, request, session, redirect, url_for, jsonify, g, Response, stream_with_context
 import os
+import io
+import time
+import csv
+import json
+import hashlib
 from datetime import date, datetime, timedelta
-from db import init_db, get_db, log_action, close_db
-from forecast import compute_recs, backtest_model, BREADS, get_recent_records, update_record, delete_record
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from db import (
+    init_db, get_db, log_action, flush_logs, get_logs_page, close_db,
+    get_data_version, get_dashboard_version
+)
+from forecast import BREADS, get_recent_records, get_records_page, iter_records, update_record, delete_record
+from backtest import METRICS
+import backtest_jobs
 import weather_holiday
+import http_client
+import stock
+import recommendations
+import scheduler
+import ingest
+import metrics
+import singleflight
+import profiler
+import query_counter
 
 # 現在のディレクトリ
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -12,10 +32,85 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 app = Flask(__name__, template_folder=os.path.join(BASE_DIR, '../templates'))
 app.secret_key = "your_secure_random_secret_key_here_change_this_in_production"
 
+# /api/dashboard の応答時間の予算（秒）。天気情報が間に合わない場合は天気なしで返す
+DASHBOARD_BUDGET = float(os.environ.get("DASHBOARD_BUDGET", 2.0))
+
+# 管理者パスワード（ログの閲覧・プロファイルの取得）
+ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "047")
+
+# QUERY_COUNT=true の場合はリクエストごとのSQL文の数を X-Query-Count ヘッダーで返す
+if query_counter.QUERY_COUNT_ENABLED:
+    query_counter.install(app)
+
 # データベース初期化
 init_db(app)
 app.teardown_appcontext(close_db)
 
+@app.before_request
+def start_background_jobs():
+    """ワーカープロセスごとに日次ジョブのスレッドを起動"""
+    scheduler.ensure_started(app)
+    backtest_jobs.ensure_runner(app)
+
+@app.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+
+@app.before_request
+def start_profiler():
+    """管理者の指定またはサンプリングで選ばれたリクエストのプロファイルを開始"""
+    if profiler.requested(request, ADMIN_PASSWORD):
+        g._profiler = profiler.Sampler().start()
+
+def _save_profile():
+    sampler = g.pop("_profiler", None)
+    if sampler is None:
+        return None
+    sampler.stop()
+    return profiler.save(sampler, request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.after_request
+def finish_profiler(response):
+    name = _save_profile()
+    if name is not None:
+        response.headers["X-Profile-Id"] = name
+    return response
+
+@app.teardown_request
+def finish_profiler_on_error(error=None):
+    """例外で after_request が呼ばれなかった場合も保存する"""
+    _save_profile()
+
+@app.after_request
+def record_request_time(response):
+    """ルートごとの応答時間を記録"""
+    started = g.pop("_request_started", None)
+    if started is not None:
+        metrics.observe(
+            "http_request_duration_seconds", time.perf_counter() - started,
+            route=request.url_rule.rule if request.url_rule else "unmatched",
+            method=request.method, status=response.status_code
+        )
+    return response
+
+# ============================================
+# 条件付きGET（ETag）
+# ============================================
+def _etag(*parts):
+    """応答の内容を決める値（データバージョン・日付など）からETagを作る"""
+    return hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+def _with_etag(response, etag):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def _not_modified(etag):
+    """If-None-Match が一致すれば304の応答を返す（一致しなければNone）"""
+    if etag in request.if_none_match:
+        return _with_etag(Response(status=304), etag)
+    return None
+
 # ============================================
 # ページルート
 # ============================================
@@ -80,23 +175,69 @@ def api_dashboard():
         return jsonify({"error": "未ログイン"}), 401
 
     user = session["user"]
-    recommendations = compute_recs(user)
 
-    # 天気情報と祝日情報を取得
-    weather = weather_holiday.get_kobe_weather()
+    # 推奨量の計算・天気の取得の前に、データバージョンと天気のキャッシュ時刻だけで変更の有無を判定する
+    # （天気はTTLごとに一度は全体を返し、キャッシュの更新のきっかけにする）
+    version, weather_fetched_at = get_dashboard_version(user, weather_holiday.WEATHER_CACHE_KEY)
+    etag = _etag(
+        "dashboard", user, version, date.today(), weather_fetched_at,
+        int(time.time() // max(weather_holiday.WEATHER_CACHE_TTL, 1))
+    )
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    started = time.perf_counter()
+    timings = {}
+
+    def timed_weather():
+        t0 = time.perf_counter()
+        weather = weather_holiday.get_kobe_weather()
+        timings["weather_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return weather
+
+    # 天気情報の取得を推奨量の計算と並行して行う
+    weather_future = http_client.submit(app, timed_weather)
+
+    t0 = time.perf_counter()
+    recs = recommendations.get_recommendations(user)
+    timings["recommendations_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+    # 祝日情報を取得
+    t0 = time.perf_counter()
     events = weather_holiday.get_china_holidays_and_events()
+    timings["events_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+    # 全体の時間予算の残りだけ天気情報を待ち、間に合わなければ天気なしで返す
+    remaining = DASHBOARD_BUDGET - (time.perf_counter() - started)
+    try:
+        weather = weather_future.result(timeout=max(0.0, remaining))
+        partial = False
+    except FutureTimeoutError:
+        weather = None
+        partial = True
+    except Exception as e:
+        app.logger.error(f"Weather fetch failed: {e}")
+        weather = None
+        partial = True
+    timings.setdefault("weather_ms", None)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
 
     # 明日が中国の祝日かどうか
     tomorrow = (date.today() + timedelta(days=1)).isoformat()
     holiday_tomorrow = any(e.get("date") == tomorrow for e in events)
 
-    return jsonify({
+    response = jsonify({
         "success": True,
-        "recommendations": recommendations,
+        "recommendations": recs,
         "weather": weather if weather else {"error": "天気情報を取得できませんでした"},
         "holidayTomorrowChina": holiday_tomorrow,
-        "events": events
+        "events": events,
+        "partial": partial,
+        "timings": dict(timings)
     })
+    # 天気が間に合わなかった応答は次回も全体を返す
+    return response if partial else _with_etag(response, etag)
 
 @app.route("/api/input", methods=["POST"])
 def api_input():
@@ -116,58 +257,65 @@ def api_input():
     except ValueError:
         return jsonify({"error": "無効な日付形式です"}), 400
 
-    db = get_db()
-    cur = db.cursor()
-
-    # 同日の既存データをチェック
-    existing = {}
-    for bread in BREADS:
-        row = cur.execute(
-            "SELECT id FROM records WHERE user=? AND day=? AND bread=?",
-            (user, target_date, bread)
-        ).fetchone()
-        if row:
-            existing[bread] = row["id"]
-
+    rows = []
     for bread in BREADS:
         bread_data = data.get(bread, {})
-        purchased = int(bread_data.get("purchased", 0))
-        leftover = int(bread_data.get("leftover", 0))
-
-        if bread in existing:
-            # 既存データを更新（上書き）
-            cur.execute(
-                """UPDATE records SET sold=?, leftover=? WHERE id=?""",
-                (purchased, leftover, existing[bread])
-            )
-        else:
-            # 新規データを挿入
-            cur.execute(
-                """INSERT INTO records (user, day, bread, sold, leftover, created_at)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (user, target_date, bread, purchased, leftover, datetime.utcnow().isoformat())
-            )
-
-        # バッチとして在庫追加（余りがある場合）※今日のデータのみ
-        if target_date == date.today().isoformat():
-            if bread in existing:
-                cur.execute(
-                    "DELETE FROM batches WHERE user=? AND bread=? AND added_date=?",
-                    (user, bread, target_date)
-                )
-
-            if leftover > 0:
-                cur.execute(
-                    """INSERT INTO batches (user, bread, qty, added_date, remaining)
-                       VALUES (?, ?, ?, ?, ?)""",
-                    (user, bread, leftover, target_date, leftover)
-                )
+        rows.append((bread, int(bread_data.get("purchased", 0)), int(bread_data.get("leftover", 0))))
 
+    db = get_db()
+    now = datetime.utcnow().isoformat()
+
+    # 全種類のパンを1文で登録（同日のデータがあれば上書き）
+    db.executemany(
+        """INSERT INTO records (user, day, bread, sold, leftover, created_at)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT(user, day, bread) DO UPDATE SET sold=excluded.sold, leftover=excluded.leftover""",
+        [(user, target_date, bread, purchased, leftover, now) for bread, purchased, leftover in rows]
+    )
+
+    # 販売数を前日までの在庫から古い順に差し引き、余りをバッチとして在庫追加 ※今日のデータのみ
+    if target_date == date.today().isoformat():
+        stock.record_sales(user, target_date, {bread: purchased for bread, purchased, _ in rows})
+        db.executemany(
+            """INSERT INTO batches (user, bread, qty, added_date, remaining)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(user, bread, added_date) DO UPDATE SET qty=excluded.qty, remaining=excluded.remaining""",
+            [(user, bread, leftover, target_date, leftover) for bread, _, leftover in rows if leftover > 0]
+        )
+        db.executemany(
+            "DELETE FROM batches WHERE user=? AND bread=? AND added_date=?",
+            [(user, bread, target_date) for bread, _, leftover in rows if leftover <= 0]
+        )
+
+    recommendations.mark_stale(user, commit=False)
+    log_action(user, "input_data", f"データ入力 ({target_date}): {data}", commit=False)
     db.commit()
-    log_action(user, "input_data", f"データ入力 ({target_date}): {data}")
+    recommendations.schedule_refresh(user)
 
     return jsonify({"success": True})
 
+@app.route("/api/ingest", methods=["POST"])
+def api_ingest():
+    """販売データの一括取り込み（JSON配列またはCSV、ログイン中のユーザーのデータのみ）"""
+    if "user" not in session:
+        return jsonify({"error": "未ログイン"}), 401
+
+    user = session["user"]
+
+    try:
+        if request.mimetype == "text/csv":
+            rows = ingest.read_csv(request.stream)
+        else:
+            rows = ingest.read_json(request.get_json(silent=True))
+        result = ingest.ingest_rows(rows, default_user=user, allowed_user=user)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"無効なデータです: {e}"}), 400
+
+    recommendations.schedule_refresh(user)
+    log_action(user, "ingest", f"一括取り込み: 追加={result['inserted']}, 更新={result['updated']}, 除外={result['rejected']}")
+
+    return jsonify({"success": True, **result})
+
 @app.route("/api/records", methods=["GET"])
 def api_records():
     """最近のレコードを取得"""
@@ -176,9 +324,72 @@ def api_records():
 
     user = session["user"]
     days = int(request.args.get("days", 30))
+
+    etag = _etag("records", user, get_data_version(user), date.today(), request.query_string.decode())
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    # limit / cursor を指定した場合はページ単位で返す
+    if "limit" in request.args or "cursor" in request.args:
+        try:
+            limit = min(max(int(request.args.get("limit", 100)), 1), 1000)
+            records, next_cursor = get_records_page(user, days, request.args.get("cursor"), limit)
+        except ValueError:
+            return jsonify({"error": "無効なパラメータです"}), 400
+        return _with_etag(jsonify({"success": True, "records": records, "next_cursor": next_cursor}), etag)
+
     records = get_recent_records(user, days)
 
-    return jsonify({"success": True, "records": records})
+    return _with_etag(jsonify({"success": True, "records": records}), etag)
+
+EXPORT_COLUMNS = ("id", "day", "bread", "sold", "leftover", "created_at")
+
+@app.route("/api/records/export", methods=["GET"])
+def api_export_records():
+    """レコードをCSVまたはNDJSONで逐次出力（全期間でもメモリ使用量は一定）"""
+    if "user" not in session:
+        return jsonify({"error": "未ログイン"}), 401
+
+    user = session["user"]
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "無効な形式です"}), 400
+    since = request.args.get("since")
+    until = request.args.get("until")
+    try:
+        for value in (since, until):
+            if value:
+                date.fromisoformat(value)
+    except ValueError:
+        return jsonify({"error": "無効な日付形式です"}), 400
+
+    rows = iter_records(user, since, until)
+
+    def generate_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_COLUMNS)
+        for i, row in enumerate(rows, start=1):
+            writer.writerow([row[c] for c in EXPORT_COLUMNS])
+            if i % 1000 == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    def generate_ndjson():
+        for row in rows:
+            yield json.dumps(dict(row), ensure_ascii=False) + "\n"
+
+    if fmt == "csv":
+        body, mimetype = generate_csv(), "text/csv"
+    else:
+        body, mimetype = generate_ndjson(), "application/x-ndjson"
+    return Response(
+        stream_with_context(body), mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=records.{fmt}"}
+    )
 
 @app.route("/api/records/<int:record_id>", methods=["PUT"])
 def api_update_record(record_id):
@@ -191,7 +402,10 @@ def api_update_record(record_id):
     sold = int(data.get("sold", 0))
     leftover = int(data.get("leftover", 0))
 
+    stock.sync_record(record_id, sold)
     update_record(record_id, sold, leftover)
+    recommendations.mark_stale(user)
+    recommendations.schedule_refresh(user)
     log_action(user, "update_record", f"レコード更新: ID={record_id}, sold={sold}, leftover={leftover}")
 
     return jsonify({"success": True})
@@ -203,42 +417,132 @@ def api_delete_record(record_id):
         return jsonify({"error": "未ログイン"}), 401
 
     user = session["user"]
+    stock.sync_record(record_id)
     delete_record(record_id)
+    recommendations.mark_stale(user)
+    recommendations.schedule_refresh(user)
     log_action(user, "delete_record", f"レコード削除: ID={record_id}")
 
     return jsonify({"success": True})
 
+def _backtest_params(args):
+    """バックテストの条件を検証（不正な場合はValueError）"""
+    metrics = args.get("metrics", "mae,rmse,mape")
+    if isinstance(metrics, str):
+        metrics = metrics.split(",")
+    mode = args.get("mode")
+    if mode not in (None, "filter", "warm"):
+        raise ValueError("無効なモードです")
+    weather = args.get("weather", False)
+    if isinstance(weather, str):
+        weather = weather.lower() == "true"
+    return backtest_jobs.normalize_params(
+        days=int(args.get("days", 7)),
+        horizon=int(args.get("horizon", 1)),
+        metrics=[m for m in metrics if m in METRICS] or METRICS,
+        mode=mode,
+        weather=weather
+    )
+
 @app.route("/api/backtest", methods=["GET"])
 def api_backtest():
-    """バックテスト実行"""
+    """
+    バックテスト実行（同じデータバージョンの結果があればそれを返す）
+
+    リクエスト内で実行する。時間のかかる条件は POST /api/backtest でジョブとして登録し、
+    /api/backtest/<job_id> で進捗を確認する（dashboard.html・Debug.jsx はこちらを使う）。
+    """
     if "user" not in session:
         return jsonify({"error": "未ログイン"}), 401
 
     user = session["user"]
-    results = {}
 
-    for bread in BREADS:
-        results[bread] = backtest_model(user, bread)
+    try:
+        params = _backtest_params(request.args)
+    except ValueError:
+        return jsonify({"error": "無効なパラメータです"}), 400
+
+    results = backtest_jobs.run_cached(user, params)
 
     return jsonify({"success": True, "results": results})
 
+@app.route("/api/backtest", methods=["POST"])
+def api_backtest_submit():
+    """バックテストをジョブとして登録（結果は /api/backtest/<job_id> で取得）"""
+    if "user" not in session:
+        return jsonify({"error": "未ログイン"}), 401
+
+    user = session["user"]
+
+    try:
+        params = _backtest_params(request.get_json(silent=True) or {})
+    except (ValueError, TypeError):
+        return jsonify({"error": "無効なパラメータです"}), 400
+
+    job, created = backtest_jobs.submit(user, params)
+    return jsonify({"success": True, "job_id": job["id"], "job": job}), 202 if created else 200
+
+@app.route("/api/backtest/<job_id>", methods=["GET"])
+def api_backtest_job(job_id):
+    """バックテストのジョブの状態・パンごとの進捗・結果"""
+    if "user" not in session:
+        return jsonify({"error": "未ログイン"}), 401
+
+    job = backtest_jobs.get_job(job_id, session["user"])
+    if job is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    return jsonify({"success": True, "job": job})
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """計測値（全ワーカー分）をPrometheusのテキスト形式で返す"""
+    singleflight_counts = {
+        (("name", name), ("outcome", outcome)): count
+        for name, outcomes in singleflight.get_stats().items()
+        for outcome, count in outcomes.items()
+    }
+    counters = {"singleflight_total": ("同じ計算を実行した・他の結果を使った回数", singleflight_counts)}
+    return Response(metrics.render(counters), mimetype="text/plain; version=0.0.4")
+
+def _is_admin():
+    return request.headers.get("X-Admin-Password") == ADMIN_PASSWORD
+
+@app.route("/api/admin/profiles", methods=["GET"])
+def api_profiles():
+    """保存済みのプロファイルの一覧（管理者のみ）"""
+    if not _is_admin():
+        return jsonify({"error": "パスワードが正しくありません"}), 403
+    return jsonify({"success": True, "profiles": profiler.list_profiles()})
+
+@app.route("/api/admin/profiles/<name>", methods=["GET"])
+def api_profile(name):
+    """プロファイル（collapsed形式）の取得（管理者のみ）"""
+    if not _is_admin():
+        return jsonify({"error": "パスワードが正しくありません"}), 403
+    content = profiler.read_profile(name)
+    if content is None:
+        return jsonify({"error": "プロファイルが見つかりません"}), 404
+    return Response(content, mimetype="text/plain")
+
 @app.route("/api/logs", methods=["POST"])
 def api_logs():
     """ログ取得（パスワード保護）"""
     data = request.get_json()
     password = data.get("password", "")
 
-    if password != "047":
+    if password != ADMIN_PASSWORD:
         return jsonify({"error": "パスワードが正しくありません"}), 403
 
-    db = get_db()
-    rows = db.execute(
-        "SELECT * FROM logs ORDER BY created_at DESC LIMIT 200"
-    ).fetchall()
-
-    logs = [dict(row) for row in rows]
-
-    return jsonify({"success": True, "logs": logs})
+    try:
+        limit = min(max(int(data.get("limit", 200)), 1), 1000)
+        cursor = data.get("cursor")
+        if not cursor:
+            flush_logs()
+        logs, next_cursor = get_logs_page(cursor, limit)
+    except (TypeError, ValueError):
+        return jsonify({"error": "無効なパラメータです"}), 400
+
+    return jsonify({"success": True, "logs": logs, "next_cursor": next_cursor})
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080, debug=True)
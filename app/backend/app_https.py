@@ -10,7 +10,8 @@ from flask import Flask, render_template, request, session, redirect, url_for, j
 import os
 from datetime import date, datetime, timedelta
 from db import init_db, get_db, log_action, close_db
-from forecast import compute_recs, backtest_model, BREADS, get_recent_records, update_record, delete_record
+from forecast import compute_recs, BREADS, get_recent_records, update_record, delete_record
+from backtest import backtest_model
 import weather_holiday
 
 # 現在のディレクトリ
@@ -0,0 +1,164 @@
+"""
+操作ログの非同期書き込み
+
+log_action のたびにINSERTとコミットを行う代わりに、ログをメモリ上のキューに積み、
+バックグラウンドのスレッドが一定件数または一定時間ごとに executemany でまとめて書き込む。
+キューが一杯の場合は呼び出し側を少し待たせ（バックプレッシャー）、それでも空かなければ
+その場で同期的に書き込む。ワーカー終了時には残りを書き込む。
+書き込みに AUDIT_LOG_MAX_RETRIES 回続けて失敗したまとまりは、エラーをログに出して破棄する
+（再試行中は新しいログを受け取らないため、メモリ上のログは AUDIT_LOG_BATCH_SIZE 件までに抑えられる）。
+"""
+import os
+import queue
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 書き込みモード（async / sync）
+AUDIT_LOG_MODE = os.environ.get("AUDIT_LOG_MODE", "async")
+
+# 1回の書き込みの最大件数
+AUDIT_LOG_BATCH_SIZE = int(os.environ.get("AUDIT_LOG_BATCH_SIZE", 100))
+
+# 最初のログを受け取ってから書き込むまでの最大時間（秒）
+AUDIT_LOG_FLUSH_INTERVAL = float(os.environ.get("AUDIT_LOG_FLUSH_INTERVAL", 1.0))
+
+# キューの最大件数と、一杯のときに待つ時間（秒）
+AUDIT_LOG_QUEUE_SIZE = int(os.environ.get("AUDIT_LOG_QUEUE_SIZE", 10000))
+AUDIT_LOG_PUT_TIMEOUT = float(os.environ.get("AUDIT_LOG_PUT_TIMEOUT", 0.5))
+
+# 書き込みに失敗したまとまりを再試行する回数（超えたら破棄）
+AUDIT_LOG_MAX_RETRIES = int(os.environ.get("AUDIT_LOG_MAX_RETRIES", 3))
+
+INSERT_SQL = "INSERT INTO logs (user, action, detail, created_at) VALUES (?, ?, ?, ?)"
+
+
+class _Waiter:
+    """flush() の待ち合わせ（ok: それまでのログを書き込めたか）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.ok = True
+
+    def release(self, ok):
+        self.ok = ok
+        self.event.set()
+
+
+class LogSink:
+    """
+    ログをまとめて書き込むバックグラウンドのスレッド（ワーカープロセスごとに1つ）
+
+    connect: 書き込み用の接続を作成する関数（スレッド専用の接続を使う）
+    """
+
+    def __init__(self, connect, batch_size=AUDIT_LOG_BATCH_SIZE, interval=AUDIT_LOG_FLUSH_INTERVAL,
+                 maxsize=AUDIT_LOG_QUEUE_SIZE, put_timeout=AUDIT_LOG_PUT_TIMEOUT,
+                 max_retries=AUDIT_LOG_MAX_RETRIES):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.interval = interval
+        self.maxsize = maxsize
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        """このプロセスのキューと書き込みスレッドを用意（fork後は作り直す）"""
+        if self._pid == os.getpid():
+            return self._queue
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.maxsize)
+                thread = threading.Thread(
+                    target=self._run, args=(self._queue,), name="audit-log", daemon=True
+                )
+                thread.start()
+                self._pid = os.getpid()
+        return self._queue
+
+    def submit(self, entry):
+        """ログ (user, action, detail, created_at) をキューに追加"""
+        try:
+            self._ensure_started().put(entry, timeout=self.put_timeout)
+        except queue.Full:
+            logger.warning("Audit log queue is full, writing synchronously")
+            self._write([entry])
+
+    def flush(self, timeout=None):
+        """
+        キューに積まれたログをすべて書き込むまで待つ
+
+        Returns:
+            書き込めた場合はTrue（タイムアウト・書き込みの失敗はFalse）
+        """
+        if self._pid != os.getpid():
+            return True
+        waiter = _Waiter()
+        try:
+            self._queue.put(waiter, timeout=timeout)
+        except queue.Full:
+            return False
+        return waiter.event.wait(timeout) and waiter.ok
+
+    def _write(self, entries, db=None):
+        own = db is None
+        db = db or self.connect()
+        try:
+            with db:
+                db.executemany(INSERT_SQL, entries)
+        finally:
+            if own:
+                db.close()
+
+    def _run(self, q):
+        db = self.connect()
+        batch = []
+        waiters = []
+        deadline = None
+        failures = 0
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if failures and len(batch) >= self.batch_size:
+                # 再試行待ちの間は受け取らない（キューが一杯になれば submit が同期書き込みに切り替わる）
+                time.sleep(timeout)
+                item = None
+            else:
+                try:
+                    item = q.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+            if isinstance(item, _Waiter):
+                waiters.append(item)
+            elif item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+
+            ok = True
+            if batch and (len(batch) >= self.batch_size or waiters or time.monotonic() >= deadline):
+                try:
+                    self._write(batch, db)
+                    batch = []
+                    deadline = None
+                    failures = 0
+                except Exception as e:
+                    ok = False
+                    failures += 1
+                    if failures >= self.max_retries:
+                        logger.error(f"Audit log flush failed {failures} times, dropping {len(batch)} entries: {e}")
+                        batch = []
+                        deadline = None
+                        failures = 0
+                    else:
+                        # ロック待ちのタイムアウトなど: 次の周期で再試行する
+                        logger.error(f"Audit log flush failed ({len(batch)} entries), will retry: {e}")
+                        deadline = time.monotonic() + self.interval
+            for waiter in waiters:
+                waiter.release(ok)
+            waiters = []
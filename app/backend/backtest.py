@@ -0,0 +1,191 @@
+"""
+ローリングオリジン（ウォークフォワード）バックテストエンジン
+
+評価起点ごとにモデルを一から推定する代わりに、以下のどちらかで全起点の予測誤差を1回の走査で求める。
+- filter: 最初の起点までのデータで1回だけ推定し、固定パラメータのまま状態を1日ずつ進める（既定）
+- warm:   各起点で再推定するが、前の起点の推定値を初期値にする（ウォームスタート）
+"""
+import os
+
+import numpy as np
+
+from forecast import (
+    BREADS, LOOKBACK_DAYS, get_sales_series, load_sales_matrix, sales_column, sales_with_weather,
+    window_start, fit_hw_state, holt_forecast, weighted_ma, fit_weather_effect, weather_correction
+)
+import parallel
+import weather_store
+
+# 既定の実行モード（filter / warm）
+BACKTEST_MODE = os.environ.get("BACKTEST_MODE", "filter")
+
+# 利用可能な評価指標（forecast_comparison.py と同じ定義）
+METRICS = ("mae", "rmse", "mape")
+
+# Holt-Winters法の季節周期
+SEASONAL_PERIODS = 7
+
+
+def compute_metrics(actuals, predictions, metrics=METRICS):
+    """予測誤差から評価指標（MAE/RMSE/MAPE）を計算"""
+    actuals = np.asarray(actuals, dtype=float)
+    errors = actuals - np.asarray(predictions, dtype=float)
+
+    result = {}
+    if "mae" in metrics:
+        result["mae"] = round(float(np.mean(np.abs(errors))), 2)
+    if "rmse" in metrics:
+        result["rmse"] = round(float(np.sqrt(np.mean(errors ** 2))), 2)
+    if "mape" in metrics:
+        # MAPEは実績が0でない日のみで計算
+        nonzero = actuals > 0
+        result["mape"] = (
+            round(float(np.mean(np.abs(errors[nonzero] / actuals[nonzero])) * 100), 2)
+            if nonzero.any() else None
+        )
+    result["samples"] = len(errors)
+    return result
+
+
+def _simple_forecast(history, horizon=1):
+    """データ量に応じた手法で horizon 日先を予測（Holt-Winters以外、WMAは同じ値のまま）"""
+    if len(history) >= 3:
+        return holt_forecast(history, steps=horizon), "Holt"
+    return weighted_ma(history), "WMA"
+
+
+def _per_origin_predictions(series, origins, horizon):
+    """起点ごとに予測（Holt-Wintersに必要なデータがない場合）"""
+    predictions = []
+    method = "Unknown"
+    for i in origins:
+        predicted, method = _simple_forecast(series[:i], horizon)
+        predictions.append(predicted)
+    return predictions, method
+
+
+def _filter_predictions(series, values, origins, horizon):
+    """最初の起点で1回だけ推定し、固定パラメータで状態を進めながら予測"""
+    state = fit_hw_state(series[:origins[0]], SEASONAL_PERIODS)
+    if state is None:
+        return None
+
+    predictions = []
+    for i in origins:
+        predictions.append(state.forecast(horizon))
+        state.update(values[i])
+    return predictions
+
+
+def _warm_predictions(series, origins, horizon):
+    """起点ごとに前回の推定値を初期値として再推定しながら予測"""
+    predictions = []
+    start_params = None
+    for i in origins:
+        state = fit_hw_state(series[:i], SEASONAL_PERIODS, start_params=start_params)
+        if state is None:
+            return None
+        predictions.append(state.forecast(horizon))
+        start_params = state.start_params
+    return predictions
+
+
+def rolling_origin_backtest(series, windows=7, horizon=1, metrics=METRICS, mode=None, weather=None):
+    """
+    ローリングオリジン・バックテスト
+
+    Args:
+        series: 販売データ（日付順）
+        windows: 評価起点の数（直近windows個の起点で評価）
+        horizon: 何日先を予測するか
+        metrics: 計算する評価指標（"mae", "rmse", "mape"）
+        mode: "filter" または "warm"（省略時は BACKTEST_MODE）
+        weather: series と同じ並びの天気の配列（指定した場合は天気の補正を加えて評価）
+
+    Returns:
+        dict: 評価指標、サンプル数、使用した手法
+    """
+    mode = mode or BACKTEST_MODE
+    values = np.asarray(series, dtype=float)
+    first = len(values) - windows - horizon + 1
+
+    if windows < 1 or horizon < 1 or first < 7:
+        result = {m: None for m in metrics}
+        result.update({"error": "データ不足", "method": "N/A"})
+        return result
+
+    origins = list(range(first, len(values) - horizon + 1))
+    actuals = values[first + horizon - 1:]
+
+    predictions = None
+    method = "Holt-Winters"
+    if first >= 2 * SEASONAL_PERIODS:
+        if mode == "warm":
+            predictions = _warm_predictions(series, origins, horizon)
+        else:
+            predictions = _filter_predictions(series, values, origins, horizon)
+    if predictions is None:
+        predictions, method = _per_origin_predictions(series, origins, horizon)
+
+    if weather is not None:
+        # 天気の効果は最初の起点より前のデータだけで推定する（評価期間の情報は使わない）
+        effect = fit_weather_effect(values[:first], weather[:first])
+        if effect is not None:
+            predictions = np.asarray(predictions, dtype=float) + weather_correction(
+                effect, weather[first + horizon - 1:]
+            )
+            method += "+天気"
+
+    result = compute_metrics(actuals, predictions, metrics)
+    result.update({"method": method, "mode": mode, "horizon": horizon})
+    return result
+
+
+def _backtest_since(days, horizon):
+    """最初の評価起点で学習期間がそろうようにデータの取得開始日を決める"""
+    return window_start(LOOKBACK_DAYS["Holt-Winters"] + days + horizon)
+
+
+def backtest_model(user, bread, days=7, horizon=1, metrics=METRICS, mode=None):
+    """バックテスト（MAE/RMSE/MAPE計算）"""
+    sales = get_sales_series(user, bread, since=_backtest_since(days, horizon))
+    return rolling_origin_backtest(sales, windows=days, horizon=horizon, metrics=metrics, mode=mode)
+
+
+def backtest_tasks(user, days=7, horizon=1, metrics=METRICS, mode=None, weather=False):
+    """
+    パンごとの rolling_origin_backtest の引数を作る（DBの読み込みはここだけで行う）
+
+    weather: Trueの場合は weather_daily の天気を説明変数に加える（外部APIは呼ばない）
+    """
+    sale_days, matrix = load_sales_matrix(user, since=_backtest_since(days, horizon))
+    if weather:
+        observed = weather_store.lookup(sale_days)
+        tasks = []
+        for bread in BREADS:
+            sales, bread_weather = sales_with_weather(sale_days, matrix, bread, observed)
+            tasks.append((sales, days, horizon, metrics, mode, bread_weather))
+    else:
+        tasks = [
+            (sales_column(matrix, bread), days, horizon, metrics, mode)
+            for bread in BREADS
+        ]
+    return tasks
+
+
+def timed_out_result(metrics=METRICS):
+    """時間内に終わらなかったパンの結果（データ不足の場合と同じ形）"""
+    result = {m: None for m in metrics}
+    result.update({"error": "タイムアウト", "method": "N/A"})
+    return result
+
+
+def _timed_out_task(series, windows=7, horizon=1, metrics=METRICS, *rest):
+    return timed_out_result(metrics)
+
+
+def backtest_all(user, days=7, horizon=1, metrics=METRICS, mode=None, weather=False):
+    """全種類のパンのバックテスト（FORECAST_EXECUTION=process の場合は並列実行）"""
+    tasks = backtest_tasks(user, days, horizon, metrics, mode, weather)
+    results = parallel.run_tasks(rolling_origin_backtest, tasks, fallback=_timed_out_task)
+    return dict(zip(BREADS, results))
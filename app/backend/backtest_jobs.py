@@ -0,0 +1,318 @@
+"""
+バックテストのジョブキュー
+
+POST /api/backtest はジョブを backtest_jobs テーブルに登録してIDを返すだけにし、
+各ワーカープロセスのジョブ実行スレッドが登録済みのジョブを1件ずつ取り出して実行する。
+進捗を確認しないクライアント向けの GET /api/backtest はリクエスト内で実行する（run_cached）。
+パンごとのバックテストはプロセスプールで並列に実行し、終わったパンから進捗を書き込む。
+
+完了したジョブはそのままキャッシュを兼ねる。同じユーザー・同じ条件・同じデータバージョンの
+ジョブが完了済み（または実行中）であれば、新しく実行せずにそのジョブを返す。
+実行中のワーカーが落ちた場合は、BACKTEST_JOB_STALE 秒以上進捗のないジョブを別のワーカーが取り直す。
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import as_completed, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from db import get_db, get_read_db, get_data_version
+from forecast import BREADS
+from backtest import BACKTEST_MODE, METRICS, backtest_all, backtest_tasks, rolling_origin_backtest, timed_out_result
+import parallel
+import scheduler
+
+logger = logging.getLogger(__name__)
+
+# パンごとのバックテストの実行方法（process: プロセスプール / serial: ジョブ実行スレッド内）
+BACKTEST_JOB_EXECUTION = os.environ.get("BACKTEST_JOB_EXECUTION", "process")
+
+# 登録済みのジョブを確認する間隔（秒）
+BACKTEST_JOB_POLL = float(os.environ.get("BACKTEST_JOB_POLL", 2.0))
+
+# 進捗がこの時間（秒）更新されない実行中のジョブは、ワーカーが落ちたとみなして取り直す
+BACKTEST_JOB_STALE = float(os.environ.get("BACKTEST_JOB_STALE", 600))
+
+# 完了したジョブ（キャッシュ）を残す日数
+BACKTEST_JOB_RETENTION_DAYS = int(os.environ.get("BACKTEST_JOB_RETENTION_DAYS", 7))
+
+_runner_pid = None
+_runner_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def normalize_params(days=7, horizon=1, metrics=METRICS, mode=None, weather=False):
+    """ジョブの条件（キャッシュのキーになるため既定値を埋めて並びをそろえる）"""
+    return {
+        "days": int(days),
+        "horizon": int(horizon),
+        "metrics": [m for m in METRICS if m in metrics],
+        "mode": mode or BACKTEST_MODE,
+        "weather": bool(weather)
+    }
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def _job_dict(row):
+    """ジョブの行を応答用の辞書に変換"""
+    progress = json.loads(row["progress"])
+    job = {
+        "id": row["id"],
+        "status": row["status"],
+        "params": json.loads(row["params"]),
+        "data_version": row["data_version"],
+        "progress": progress,
+        "completed": sum(1 for p in progress.values() if p["status"] in ("done", "failed")),
+        "total": len(BREADS),
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"]
+    }
+    if row["result"] is not None:
+        job["results"] = json.loads(row["result"])
+    if row["error"]:
+        job["error"] = row["error"]
+    return job
+
+
+def _find_job(user, key, data_version):
+    """同じ条件・同じデータバージョンの完了済み・実行待ち・実行中のジョブ"""
+    return get_read_db().execute(
+        """SELECT * FROM backtest_jobs
+           WHERE user=? AND params=? AND data_version=? AND status IN ('queued', 'running', 'done')
+           ORDER BY created_at DESC LIMIT 1""",
+        (user, key, data_version)
+    ).fetchone()
+
+
+def _insert_job(user, key, data_version, status, progress, result=None):
+    db = get_db()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    finished = now if status == "done" else None
+    db.execute(
+        """INSERT INTO backtest_jobs
+           (id, user, params, data_version, status, progress, result, created_at, started_at, finished_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (job_id, user, key, data_version, status, json.dumps(progress, ensure_ascii=False),
+         json.dumps(result, ensure_ascii=False) if result is not None else None, now, finished, finished)
+    )
+    db.commit()
+    return job_id
+
+
+def _enqueue(user, key, data_version):
+    job_id = _insert_job(
+        user, key, data_version, "queued", {bread: {"status": "queued"} for bread in BREADS}
+    )
+    _wakeup.set()
+    return get_job(job_id, user)
+
+
+def submit(user, params):
+    """
+    バックテストのジョブを登録（同じ条件のジョブがあればそれを返す）
+
+    Returns:
+        (ジョブの辞書, 新しく登録したか)
+    """
+    key = _params_key(params)
+    data_version = get_data_version(user)
+    row = _find_job(user, key, data_version)
+    if row is not None:
+        return _job_dict(row), False
+    return _enqueue(user, key, data_version), True
+
+
+def get_job(job_id, user):
+    """ジョブの状態・進捗（他のユーザーのジョブはNone）"""
+    row = get_read_db().execute(
+        "SELECT * FROM backtest_jobs WHERE id=? AND user=?", (job_id, user)
+    ).fetchone()
+    return _job_dict(row) if row is not None else None
+
+
+def run_cached(user, params):
+    """
+    バックテストをリクエスト内で実行（同じデータバージョンの完了済みの結果があればそれを返す）
+
+    ジョブの進捗を確認しないクライアント（GET /api/backtest）用。時間内に終わらなかったパンがある
+    結果はキャッシュにしない。
+
+    Returns:
+        {bread: 評価指標}
+    """
+    key = _params_key(params)
+    data_version = get_data_version(user)
+    row = _find_job(user, key, data_version)
+    if row is not None and row["status"] == "done":
+        return json.loads(row["result"])
+
+    results = backtest_all(user, **params)
+    timed_out = timed_out_result(params["metrics"])
+    if all(result != timed_out for result in results.values()):
+        progress = {bread: {"status": "done", "result": results[bread]} for bread in BREADS}
+        _insert_job(user, key, data_version, "done", progress, results)
+    return results
+
+
+def _claim_next():
+    """実行待ち（または放置された実行中）のジョブを1件取り出して実行中にする"""
+    now = time.time()
+    waiting = get_read_db().execute(
+        """SELECT 1 FROM backtest_jobs
+           WHERE status='queued' OR (status='running' AND heartbeat_at<?) LIMIT 1""",
+        (now - BACKTEST_JOB_STALE,)
+    ).fetchone()
+    if waiting is None:
+        return None
+
+    db = get_db()
+    db.execute(
+        "UPDATE backtest_jobs SET status='queued' WHERE status='running' AND heartbeat_at<?",
+        (now - BACKTEST_JOB_STALE,)
+    )
+    row = db.execute(
+        """UPDATE backtest_jobs SET status='running', started_at=?, heartbeat_at=?
+           WHERE id=(SELECT id FROM backtest_jobs WHERE status='queued' ORDER BY created_at ASC LIMIT 1)
+           RETURNING id, user, params""",
+        (now, now)
+    ).fetchone()
+    db.commit()
+    return row
+
+
+def _save_progress(job_id, progress, status="running", result=None, error=None):
+    db = get_db()
+    now = time.time()
+    db.execute(
+        """UPDATE backtest_jobs SET status=?, progress=?, result=?, error=?, heartbeat_at=?,
+               finished_at=CASE WHEN ? IN ('done', 'failed') THEN ? ELSE finished_at END
+           WHERE id=?""",
+        (status, json.dumps(progress, ensure_ascii=False),
+         json.dumps(result, ensure_ascii=False) if result is not None else None,
+         error, now, status, now, job_id)
+    )
+    db.commit()
+
+
+def _run_breads(tasks, on_done, on_timeout):
+    """
+    パンごとのバックテストを実行し、終わった順に on_done(パン, 結果) を呼ぶ
+
+    プロセスプールで時間内に終わらなかったパンは on_timeout(パン) を呼んで打ち切る。
+    """
+    pending = dict(zip(BREADS, tasks))
+    if BACKTEST_JOB_EXECUTION == "process":
+        try:
+            pool = parallel.get_pool()
+            futures = {pool.submit(rolling_origin_backtest, *args): bread for bread, args in pending.items()}
+            try:
+                for future in as_completed(futures, timeout=parallel.FORECAST_TASK_TIMEOUT * len(futures)):
+                    bread = futures[future]
+                    on_done(bread, future.result())
+                    del pending[bread]
+            except FutureTimeoutError:
+                for future, bread in futures.items():
+                    if bread in pending:
+                        future.cancel()
+                        logger.error(f"Backtest for {bread} timed out")
+                        on_timeout(bread)
+            return
+        except (BrokenProcessPool, RuntimeError) as e:
+            # 終わっていないパンだけを直接実行する
+            logger.error(f"Process pool unavailable, running backtest serially: {e}")
+            parallel.shutdown_pool()
+    for bread, args in pending.items():
+        on_done(bread, rolling_origin_backtest(*args))
+
+
+def run_next_job():
+    """ジョブを1件実行（実行するジョブがなければFalse）"""
+    row = _claim_next()
+    if row is None:
+        return False
+
+    job_id, user, params = row["id"], row["user"], json.loads(row["params"])
+    progress = {bread: {"status": "running"} for bread in BREADS}
+    try:
+        # 読み込むデータのバージョンを記録する（キャッシュのキー）。データの読み込み中に
+        # 書き込みのロックを持ち続けないよう、先にコミットする
+        db = get_db()
+        db.execute("UPDATE backtest_jobs SET data_version=? WHERE id=?", (get_data_version(user), job_id))
+        db.commit()
+        tasks = backtest_tasks(user, **params)
+        _save_progress(job_id, progress)
+
+        results = {}
+
+        def on_done(bread, result):
+            results[bread] = result
+            progress[bread] = {"status": "done", "result": result}
+            _save_progress(job_id, progress)
+
+        def on_timeout(bread):
+            results[bread] = timed_out_result(params["metrics"])
+            progress[bread] = {"status": "failed", "result": results[bread]}
+            _save_progress(job_id, progress)
+
+        _run_breads(tasks, on_done, on_timeout)
+        result = {bread: results[bread] for bread in BREADS}
+        timed_out = [bread for bread in BREADS if progress[bread]["status"] == "failed"]
+        if timed_out:
+            # 一部のパンが欠けた結果はキャッシュにしない（failed のジョブは次の要求で再実行される）
+            _save_progress(job_id, progress, "failed", result, error=f"タイムアウト: {', '.join(timed_out)}")
+        else:
+            _save_progress(job_id, progress, "done", result)
+    except Exception as e:
+        logger.error(f"Backtest job {job_id} failed: {e}")
+        for bread in BREADS:
+            if progress[bread]["status"] != "done":
+                progress[bread] = {"status": "failed"}
+        _save_progress(job_id, progress, "failed", error=str(e))
+    return True
+
+
+def _loop(app):
+    while True:
+        try:
+            with app.app_context():
+                ran = run_next_job()
+        except Exception as e:
+            logger.error(f"Backtest job runner failed: {e}")
+            ran = False
+        if not ran:
+            _wakeup.wait(BACKTEST_JOB_POLL)
+            _wakeup.clear()
+
+
+def ensure_runner(app):
+    """このワーカープロセスでジョブ実行スレッドを起動（fork後の最初のリクエストで呼ぶ）"""
+    global _runner_pid
+    if _runner_pid == os.getpid():
+        return
+    with _runner_lock:
+        if _runner_pid == os.getpid():
+            return
+        _runner_pid = os.getpid()
+        thread = threading.Thread(target=_loop, args=(app,), name="backtest-jobs", daemon=True)
+        thread.start()
+
+
+def purge_jobs():
+    """保存期間を過ぎた完了・失敗ジョブを削除（日次ジョブ）"""
+    db = get_db()
+    db.execute(
+        "DELETE FROM backtest_jobs WHERE status IN ('done', 'failed') AND finished_at<?",
+        (time.time() - BACKTEST_JOB_RETENTION_DAYS * 86400,)
+    )
+    db.commit()
+
+
+scheduler.register_daily_job("purge_backtest_jobs", purge_jobs)
@@ -1,23 +1,129 @@
 import sqlite3
 import os
+import queue
+import atexit
+import threading
 from flask import g
 from datetime import datetime
+from migrations import run_migrations
+import audit_log
+import metrics
 
 # データベースパスを設定（backendフォルダから2階層上）
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-DB_PATH = os.path.join(BASE_DIR, "breads_full.db")
+DB_PATH = os.environ.get("DB_PATH", os.path.join(BASE_DIR, "breads_full.db"))
+
+# ワーカープロセスごとに保持する接続数（読み書き用・読み取り専用それぞれ）
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 4))
+
+# 接続ごとに設定するPRAGMA
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")   # WALではNORMALでもコミット済みデータは壊れない
+DB_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", -16000))  # 負の値はKiB単位（16MB）
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
+DB_BUSY_TIMEOUT = int(os.environ.get("DB_BUSY_TIMEOUT", 5000))  # ミリ秒
+DB_TEMP_STORE = os.environ.get("DB_TEMP_STORE", "MEMORY")
+
+def connect(readonly=False):
+    """チューニング済みの接続を作成（readonly=Trueの場合は書き込み不可）"""
+    if readonly:
+        db = sqlite3.connect(
+            f"file:{DB_PATH}?mode=ro", uri=True, timeout=DB_BUSY_TIMEOUT / 1000,
+            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+            factory=metrics.connection_factory()
+        )
+        db.execute("PRAGMA query_only=ON")
+    else:
+        db = sqlite3.connect(
+            DB_PATH, timeout=DB_BUSY_TIMEOUT / 1000,
+            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+            factory=metrics.connection_factory()
+        )
+        # WALはデータベースファイルに記録されるため、読み取り専用接続にも適用される
+        db.execute("PRAGMA journal_mode=WAL")
+    db.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    db.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+    db.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    db.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+    db.execute(f"PRAGMA temp_store={DB_TEMP_STORE}")
+    db.row_factory = sqlite3.Row
+    return db
+
+class ConnectionPool:
+    """
+    ワーカープロセス内で接続を使い回すプール
+
+    空きがなければ新しく接続し、返却時にプールが一杯なら閉じる。
+    """
+
+    def __init__(self, readonly=False, size=DB_POOL_SIZE):
+        self.readonly = readonly
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return connect(self.readonly)
+
+    def release(self, db):
+        # 未コミットの変更を次の利用者に持ち越さない
+        if db.in_transaction:
+            db.rollback()
+        try:
+            self.idle.put_nowait(db)
+        except queue.Full:
+            db.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+def get_pool(readonly=False):
+    """このプロセス用の接続プールを取得（fork後は作り直す）"""
+    global _pools, _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # 親プロセスの接続は子プロセスで使わない
+            _pools = {}
+            _pools_pid = os.getpid()
+        if readonly not in _pools:
+            _pools[readonly] = ConnectionPool(readonly)
+        return _pools[readonly]
 
 def get_db():
+    """読み書き用の接続（アプリケーションコンテキストごと）"""
     db = getattr(g, "_db", None)
     if db is None:
-        db = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
-        db.row_factory = sqlite3.Row
+        db = get_pool().acquire()
         g._db = db
     return db
 
+def get_read_db():
+    """
+    読み取り専用の接続（GETルートや集計処理用）
+
+    同じコンテキストで書き込み中の場合は、未コミットの変更が見えるよう読み書き用の接続を返す。
+    """
+    db = getattr(g, "_db", None)
+    if db is not None and db.in_transaction:
+        return db
+    read_db = getattr(g, "_read_db", None)
+    if read_db is None:
+        read_db = get_pool(readonly=True).acquire()
+        g._read_db = read_db
+    return read_db
+
 def init_db(app):
-    with app.app_context():
-        db = get_db()
+    # gunicornのpreloadではマスターで実行されるため、プールを使わず専用の接続で行う
+    db = connect()
+    try:
         cur = db.cursor()
         cur.execute("""
         CREATE TABLE IF NOT EXISTS records (
@@ -49,20 +155,153 @@ def init_db(app):
             created_at TEXT NOT NULL
         )
         """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS recommendations (
+            user TEXT NOT NULL,
+            bread TEXT NOT NULL,
+            target_date TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            data_version INTEGER NOT NULL,
+            stale INTEGER NOT NULL DEFAULT 0,
+            computed_at TEXT NOT NULL,
+            PRIMARY KEY (user, bread, target_date)
+        )
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS job_runs (
+            name TEXT NOT NULL,
+            day TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            PRIMARY KEY (name, day)
+        )
+        """)
+        db.commit()
+        # インデックス・制約の追加などはバージョン管理されたマイグレーションで行う
+        run_migrations(db)
+    finally:
+        db.close()
+
+_log_sink = audit_log.LogSink(connect)
+
+def log_action(user, action, detail="", commit=True):
+    """
+    操作ログを記録（AUDIT_LOG_MODE=async の場合はバックグラウンドでまとめて書き込む）
+
+    commit=False の場合、同期モードでは呼び出し側のトランザクションに含めてコミットしない。
+    """
+    entry = (user, action, detail, datetime.utcnow().isoformat())
+    if audit_log.AUDIT_LOG_MODE == "async":
+        _log_sink.submit(entry)
+        return
+    db = get_db()
+    db.execute(audit_log.INSERT_SQL, entry)
+    if commit:
+        db.commit()
+
+def flush_logs(timeout=5):
+    """キューに残っている操作ログを書き込む（ログ一覧の表示前・ワーカー終了時）"""
+    return _log_sink.flush(timeout)
+
+atexit.register(flush_logs)
+
+def encode_cursor(key, row_id):
+    """キーセットページングのカーソル（"キー:id"）を作成"""
+    return f"{key}:{row_id}"
+
+def parse_cursor(cursor):
+    """カーソルを (キー, id) に変換（不正な場合はValueError）"""
+    key, sep, row_id = cursor.rpartition(":")
+    if not sep or not key:
+        raise ValueError("無効なカーソルです")
+    return key, int(row_id)
+
+def iter_rows(cursor, size=1000):
+    """fetchmanyで少しずつ行を取り出す（全件をメモリに載せない）"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield from rows
+
+def get_logs_page(cursor=None, limit=200):
+    """
+    操作ログを新しい順に1ページ取得（(created_at, id) のキーセットページング）
+
+    Returns:
+        (ログのリスト, 次のページのカーソル（最後のページならNone）)
+    """
+    db = get_read_db()
+    if cursor:
+        rows = db.execute(
+            """SELECT id, user, action, detail, created_at FROM logs
+               WHERE (created_at, id) < (?, ?)
+               ORDER BY created_at DESC, id DESC LIMIT ?""",
+            (*parse_cursor(cursor), limit + 1)
+        ).fetchall()
+    else:
+        rows = db.execute(
+            """SELECT id, user, action, detail, created_at FROM logs
+               ORDER BY created_at DESC, id DESC LIMIT ?""",
+            (limit + 1,)
+        ).fetchall()
+
+    logs = [dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(logs[-1]["created_at"], logs[-1]["id"]) if len(rows) > limit else None
+    return logs, next_cursor
+
+def get_data_version(user):
+    """ユーザーのデータバージョンを取得（書き込みのたびに増える）"""
+    db = get_read_db()
+    row = db.execute("SELECT version FROM data_versions WHERE user=?", (user,)).fetchone()
+    return row["version"] if row else 0
+
+def bump_data_version(user, commit=True):
+    """ユーザーのデータバージョンを1つ進める"""
+    db = get_db()
+    db.execute(
+        """INSERT INTO data_versions (user, version, updated_at) VALUES (?, 1, ?)
+           ON CONFLICT(user) DO UPDATE SET version=version+1, updated_at=excluded.updated_at""",
+        (user, datetime.utcnow().isoformat())
+    )
+    if commit:
         db.commit()
 
-def log_action(user, action, detail=""):
-    """操作ログを記録"""
+def bump_all_data_versions():
+    """全ユーザーのデータバージョンを1つ進める（日付が変わったときの日次ジョブ）"""
     db = get_db()
-    cur = db.cursor()
-    cur.execute(
-        "INSERT INTO logs (user, action, detail, created_at) VALUES (?, ?, ?, ?)",
-        (user, action, detail, datetime.utcnow().isoformat())
+    db.execute(
+        "UPDATE data_versions SET version=version+1, updated_at=?",
+        (datetime.utcnow().isoformat(),)
     )
     db.commit()
 
+def get_dashboard_version(user, cache_key):
+    """
+    ダッシュボードの内容が変わったかを判定する値を1回のクエリで取得
+
+    Returns:
+        (データバージョン, キャッシュ済みの外部API応答の取得時刻)
+    """
+    db = get_read_db()
+    row = db.execute(
+        """SELECT (SELECT version FROM data_versions WHERE user=?) AS version,
+                  (SELECT fetched_at FROM api_cache WHERE key=?) AS fetched_at""",
+        (user, cache_key)
+    ).fetchone()
+    return row["version"] or 0, row["fetched_at"] or 0
+
 def close_db(error):
-    """データベース接続を閉じる"""
-    db = getattr(g, "_db", None)
+    """データベース接続をプールに返却"""
+    db = g.pop("_db", None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
+    read_db = g.pop("_read_db", None)
+    if read_db is not None:
+        get_pool(readonly=True).release(read_db)
@@ -1,16 +1,39 @@
-import pandas as pd
+import os
 import numpy as np
 import math
-from statsmodels.tsa.holtwinters import ExponentialSmoothing
-from db import get_db
+from db import get_db, get_read_db, encode_cursor, parse_cursor, iter_rows
 from datetime import date, timedelta, datetime
 import weather_holiday
+import weather_store
+from model_cache import MODEL_CACHE, HW_REOPTIMIZE_EVERY, HWState, fingerprint
+import parallel
+import hw_numpy
+from metrics import timed_stage
 
 BREADS = ["細パン", "太パン", "サンドパン", "バゲット"]
 SHELF_DAYS = 3
 HISTORY_DAYS = 30
 SERVICE_LEVEL = 0.9
 
+# Holt / Holt-Winters法の推定エンジン（statsmodels / numpy）
+FORECAST_ENGINE = os.environ.get("FORECAST_ENGINE", "statsmodels")
+
+# 手法ごとの学習期間（日数）。この期間のデータだけをSQLで読み込んで推定する
+LOOKBACK_DAYS = {
+    "Holt-Winters": int(os.environ.get("HW_LOOKBACK_DAYS", 112)),  # 16週
+    "Holt": int(os.environ.get("HOLT_LOOKBACK_DAYS", 56)),
+    "WMA": int(os.environ.get("WMA_LOOKBACK_DAYS", 28))
+}
+
+# 長期の販売データを週次集計して予測に使うか（データ量に関係なく推定コストが一定）
+WEEKLY_AGGREGATE = os.environ.get("WEEKLY_AGGREGATE", "false").lower() == "true"
+WEEKLY_LOOKBACK_WEEKS = int(os.environ.get("WEEKLY_LOOKBACK_WEEKS", 52))
+WEEKLY_MIN_WEEKS = 8
+
+# 天気（weather_daily）を説明変数にして予測を補正するか。翌日の天気の記録がない場合は補正しない
+WEATHER_REGRESSORS = os.environ.get("WEATHER_REGRESSORS", "false").lower() == "true"
+WEATHER_MIN_DAYS = 28  # 天気の効果の推定に必要な日数
+
 # 曜日の重み付け（月曜日=0, 日曜日=6）
 WEEKDAY_WEIGHTS = {
     0: 0.9,   # 月曜日
@@ -22,18 +45,46 @@ WEEKDAY_WEIGHTS = {
     6: 1.15   # 日曜日
 }
 
+def _exponential_smoothing(*args, **kwargs):
+    """statsmodelsのExponentialSmoothing（読み込みが重いため初回使用時にimportする）"""
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+    return ExponentialSmoothing(*args, **kwargs)
+
+def preload_heavy_modules():
+    """
+    pandas / statsmodels を読み込む
+
+    gunicornのマスタープロセスでfork前に呼ぶと、各ワーカーは読み込み済みのモジュールを
+    copy-on-writeで共有する。
+    """
+    import pandas
+    import statsmodels.tsa.holtwinters
+
 def compute_z(sl):
     """サービスレベルからZ値を計算"""
     mapping = {0.5: 0.0, 0.8: 0.84, 0.9: 1.28, 0.95: 1.645}
     k = min(mapping.keys(), key=lambda x: abs(x - sl))
     return mapping[k]
 
-def get_sales_series(user, bread, with_dates=False):
-    """過去の販売データを取得"""
-    db = get_db()
+def window_start(lookback_days, today=None):
+    """
+    学習期間の開始日
+
+    開始日は週単位でしか動かないため、その間は新しい日が末尾に追加されるだけになり、
+    モデルキャッシュは再推定せずに状態を進められる。
+    """
+    start = (today or date.today()) - timedelta(days=lookback_days)
+    return start - timedelta(days=start.toordinal() % 7)
+
+@timed_stage("get_sales_series")
+def get_sales_series(user, bread, with_dates=False, since=None):
+    """過去の販売データを取得（sinceを指定した場合はその日以降）"""
+    import pandas as pd
+
+    db = get_read_db()
     rows = db.execute(
-        "SELECT day, sold FROM records WHERE user=? AND bread=? ORDER BY day ASC",
-        (user, bread)
+        "SELECT day, sold FROM records WHERE user=? AND bread=? AND day>=? ORDER BY day ASC",
+        (user, bread, since.isoformat() if since else "")
     ).fetchall()
 
     if not rows:
@@ -50,67 +101,223 @@ def get_sales_series(user, bread, with_dates=False):
         return df["sold"], df["day"]
     return df["sold"]
 
-def remove_outliers(series, threshold=2.5):
-    """外れ値を除外（IQR法の改良版）"""
+@timed_stage("load_sales_matrix")
+def load_sales_matrix(user, since=None):
+    """
+    全種類のパンの販売データを1クエリで取得し、日付 × パンの配列に変換
+
+    since: この日以降のデータのみ取得（(user, day) インデックスの範囲検索）
+
+    Returns:
+        (days, matrix) - days: 日付の配列 (datetime64[D])、
+        matrix: (日数, len(BREADS)) の販売数（記録のない日はNaN）
+    """
+    db = get_read_db()
+    rows = db.execute(
+        "SELECT day, bread, sold FROM records WHERE user=? AND day>=? ORDER BY day ASC",
+        (user, since.isoformat() if since else "")
+    ).fetchall()
+
+    bread_index = {bread: j for j, bread in enumerate(BREADS)}
+    rows = [row for row in rows if row["bread"] in bread_index]
+    if not rows:
+        return np.array([], dtype="datetime64[D]"), np.empty((0, len(BREADS)))
+
+    days, day_idx = np.unique(
+        np.array([row["day"] for row in rows], dtype="datetime64[D]"), return_inverse=True
+    )
+    bread_idx = np.array([bread_index[row["bread"]] for row in rows])
+
+    matrix = np.full((len(days), len(BREADS)), np.nan)
+    matrix[day_idx, bread_idx] = [row["sold"] for row in rows]
+    return days, matrix
+
+def sales_column(matrix, bread, days=None, since=None):
+    """販売データ配列から1種類のパンの販売数（記録のある日のみ・日付順）を取り出す"""
+    col = matrix[:, BREADS.index(bread)]
+    mask = ~np.isnan(col)
+    if since is not None:
+        mask &= days >= np.datetime64(since, "D")
+    return col[mask]
+
+def training_window(days, matrix, bread, today=None):
+    """
+    手法ごとの学習期間でデータを切り出す
+
+    Holt-Winters法の期間に14日以上あればその期間、なければHolt法、加重移動平均の期間を使う。
+    """
+    for method, min_points in (("Holt-Winters", 14), ("Holt", 3)):
+        sales = sales_column(matrix, bread, days, window_start(LOOKBACK_DAYS[method], today))
+        if len(sales) >= min_points:
+            return sales
+    return sales_column(matrix, bread, days, window_start(LOOKBACK_DAYS["WMA"], today))
+
+def sales_with_weather(days, matrix, bread, weather, since=None):
+    """
+    販売データ配列から1種類のパンの販売数と、同じ日の天気を取り出す
+
+    weather: weather_store.lookup(days) の結果（days と同じ並び）
+
+    Returns:
+        (販売数の配列, (日数, 説明変数の数) の天気の配列)
+    """
+    col = matrix[:, BREADS.index(bread)]
+    mask = ~np.isnan(col)
+    if since is not None:
+        mask &= days >= np.datetime64(since, "D")
+    return col[mask], weather[mask]
+
+def fit_weather_effect(sales, weather, min_days=WEATHER_MIN_DAYS):
+    """
+    天気の効果を最小二乗法で推定（販売数 = 定数 + 天気の偏差 × 係数）
+
+    Returns:
+        (係数, 天気の平均) - 天気の記録がある日が min_days 未満の場合はNone
+    """
+    sales = np.asarray(sales, dtype=float)
+    weather = np.asarray(weather, dtype=float)
+    if weather.ndim != 2 or weather.shape[1] == 0:
+        return None
+    observed = np.isfinite(weather).all(axis=1) & np.isfinite(sales)
+    if observed.sum() < max(min_days, weather.shape[1] + 2):
+        return None
+
+    mean = weather[observed].mean(axis=0)
+    X = np.column_stack([np.ones(observed.sum()), weather[observed] - mean])
+    coef, *_ = np.linalg.lstsq(X, sales[observed], rcond=None)
+    return coef[1:], mean
+
+def weather_correction(effect, weather):
+    """推定した天気の効果から予測の補正量を計算（天気の記録がない日は0）"""
+    if effect is None:
+        return np.zeros(len(weather))
+    coef, mean = effect
+    correction = (np.asarray(weather, dtype=float) - mean) @ coef
+    return np.where(np.isfinite(correction), correction, 0.0)
+
+@timed_stage("load_weekly_sales")
+def load_weekly_sales(user, until, weeks=WEEKLY_LOOKBACK_WEEKS):
+    """
+    直近weeks週の販売数をSQL側で週次集計して取得
+
+    Returns:
+        {bread: (週ごとの1日平均販売数の配列, 曜日(0=月曜)ごとの係数の配列)}
+    """
+    db = get_read_db()
+    since = until - timedelta(weeks=weeks)
+    rows = db.execute(
+        """SELECT bread,
+                  CAST((julianday(day) - julianday(?)) / 7 AS INTEGER) AS week,
+                  (CAST(strftime('%w', day) AS INTEGER) + 6) % 7 AS weekday,
+                  SUM(sold) AS sold, COUNT(*) AS n
+           FROM records
+           WHERE user=? AND day>=? AND day<?
+           GROUP BY bread, week, weekday""",
+        (since.isoformat(), user, since.isoformat(), until.isoformat())
+    ).fetchall()
+
+    sums = {bread: np.zeros((weeks, 7)) for bread in BREADS}
+    counts = {bread: np.zeros((weeks, 7)) for bread in BREADS}
+    for row in rows:
+        if row["bread"] in sums and 0 <= row["week"] < weeks:
+            sums[row["bread"]][row["week"], row["weekday"]] = row["sold"]
+            counts[row["bread"]][row["week"], row["weekday"]] = row["n"]
+
+    weekly = {}
+    for bread in BREADS:
+        n_week = counts[bread].sum(axis=1)
+        observed = n_week > 0
+        if observed.sum() < WEEKLY_MIN_WEEKS:
+            continue
+        daily_mean = sums[bread].sum(axis=1)[observed] / n_week[observed]
+        n_weekday = counts[bread].sum(axis=0)
+        weekday_mean = np.divide(
+            sums[bread].sum(axis=0), n_weekday, out=np.zeros(7), where=n_weekday > 0
+        )
+        overall = sums[bread].sum() / counts[bread].sum()
+        factors = np.where(n_weekday > 0, weekday_mean / overall, 1.0) if overall > 0 else np.ones(7)
+        weekly[bread] = (daily_mean, factors)
+    return weekly
+
+def weekly_forecast(daily_mean, factors, target):
+    """週次集計データから対象日の販売数を予測（週平均のHolt予測 × 曜日係数）"""
+    return max(0.0, holt_forecast(daily_mean)) * factors[target.weekday()]
+
+def outlier_bounds(series, threshold=2.5):
+    """外れ値判定の下限・上限を計算（除外しない場合はNone）"""
     if len(series) < 4:
-        return series
+        return None
 
-    q1 = series.quantile(0.25)
-    q3 = series.quantile(0.75)
+    q1, q3 = np.quantile(np.asarray(series, dtype=float), [0.25, 0.75])
     iqr = q3 - q1
 
     if iqr == 0:  # すべての値が同じ場合
-        return series
+        return None
 
-    lower_bound = q1 - threshold * iqr
-    upper_bound = q3 + threshold * iqr
+    return q1 - threshold * iqr, q3 + threshold * iqr
 
+@timed_stage("remove_outliers")
+def remove_outliers(series, threshold=2.5):
+    """外れ値を除外（IQR法の改良版）"""
+    bounds = outlier_bounds(series, threshold)
+    if bounds is None:
+        return series
+
+    lower_bound, upper_bound = bounds
     return series[(series >= lower_bound) & (series <= upper_bound)]
 
 def weighted_ma(series, alpha=0.7):
     """加重移動平均を計算（外れ値除外付き）"""
-    if series.empty:
+    if len(series) == 0:
         return 0.0
 
     # 外れ値を除外
     cleaned = remove_outliers(series)
-    if cleaned.empty:
+    if len(cleaned) == 0:
         cleaned = series
 
-    s = cleaned.tolist()
+    s = list(cleaned)
     weights = [alpha ** (len(s) - 1 - i) for i in range(len(s))]
     wsum = sum(weights)
     return sum(v * w for v, w in zip(s, weights)) / wsum
 
-def holt_forecast(series):
-    """Holt法による予測（フォールバック用）"""
+@timed_stage("holt_forecast")
+def holt_forecast(series, steps=1):
+    """Holt法による予測（フォールバック用、steps日先）"""
     if len(series) < 3:
         return weighted_ma(series)
+    if FORECAST_ENGINE == "numpy":
+        return float(hw_numpy.forecast_batch([series], seasonal_periods=None, steps=steps)[0])
     try:
-        model = ExponentialSmoothing(
+        model = _exponential_smoothing(
             series,
             trend="add",
             seasonal=None,
             initialization_method="estimated"
         )
         fit = model.fit(optimized=True)
-        return float(fit.forecast(1))
+        return float(np.asarray(fit.forecast(steps))[steps - 1])
     except:
         return weighted_ma(series)
 
+@timed_stage("holt_winters_forecast")
 def holt_winters_forecast(series, seasonal_periods=7):
     """Holt-Winters法による予測（最も精度が高い）"""
     # データが十分でない場合はHolt法にフォールバック
     if len(series) < 2 * seasonal_periods:
         return holt_forecast(series)
 
+    if FORECAST_ENGINE == "numpy":
+        state = fit_hw_state(series, seasonal_periods)
+        return state.forecast(1) if state is not None else holt_forecast(series)
+
     try:
         # 外れ値を除外してからモデルを構築
         cleaned = remove_outliers(series)
         if len(cleaned) < 2 * seasonal_periods:
             cleaned = series
 
-        model = ExponentialSmoothing(
+        model = _exponential_smoothing(
             cleaned,
             trend='add',
             seasonal='add',
@@ -118,14 +325,168 @@ def holt_winters_forecast(series, seasonal_periods=7):
             initialization_method='estimated'
         )
         fit = model.fit(optimized=True)
-        return float(fit.forecast(1)[0])
+        return float(np.asarray(fit.forecast(1))[0])
     except:
         # エラーが発生した場合はHolt法にフォールバック
         return holt_forecast(series)
 
+def _clean_for_hw(series, seasonal_periods):
+    """Holt-Winters推定用に外れ値を除外（除外後のデータと外れ値境界を返す）"""
+    bounds = outlier_bounds(series)
+    cleaned = remove_outliers(series)
+    if len(cleaned) < 2 * seasonal_periods:
+        return series, None
+    return cleaned, bounds
+
+@timed_stage("fit_hw_states")
+def fit_hw_states(series_list, seasonal_periods=7):
+    """複数系列をまとめて推定（numpyエンジンでは1回のベクトル化計算で行う）"""
+    if FORECAST_ENGINE != "numpy":
+        return [fit_hw_state(series, seasonal_periods) for series in series_list]
+    if not series_list:
+        return []
+
+    prepared = [_clean_for_hw(series, seasonal_periods) for series in series_list]
+    fit = hw_numpy.fit_batch([cleaned for cleaned, _ in prepared], seasonal_periods)
+
+    states = []
+    for i, (series, (_, bounds)) in enumerate(zip(series_list, prepared)):
+        states.append(HWState(
+            alpha=fit["alpha"][i],
+            beta=fit["beta"][i],
+            gamma=fit["gamma"][i],
+            level=fit["level"][i],
+            trend=fit["trend"][i],
+            season=fit["season"][i],
+            n_obs=len(series),
+            fingerprint=fingerprint(series),
+            lower=bounds[0] if bounds else None,
+            upper=bounds[1] if bounds else None
+        ))
+    return states
+
+@timed_stage("fit_hw_state")
+def fit_hw_state(series, seasonal_periods=7, start_params=None):
+    """
+    Holt-Winters法でパラメータを推定し、最終状態を返す（失敗時はNone）
+
+    start_params: 前回推定の HWState.start_params（ウォームスタート用・statsmodelsのみ）
+    """
+    if FORECAST_ENGINE == "numpy":
+        return fit_hw_states([series], seasonal_periods)[0]
+
+    cleaned, bounds = _clean_for_hw(series, seasonal_periods)
+
+    try:
+        model = _exponential_smoothing(
+            cleaned,
+            trend='add',
+            seasonal='add',
+            seasonal_periods=seasonal_periods,
+            initialization_method='estimated'
+        )
+        if start_params is not None:
+            fit = model.fit(optimized=True, start_params=start_params, use_brute=False)
+        else:
+            fit = model.fit(optimized=True)
+    except:
+        return None
+
+    params = fit.params
+    state = HWState(
+        alpha=params["smoothing_level"],
+        beta=params["smoothing_trend"],
+        gamma=params["smoothing_seasonal"],
+        level=np.asarray(fit.level)[-1],
+        trend=np.asarray(fit.trend)[-1],
+        season=np.asarray(fit.season)[-seasonal_periods:],
+        n_obs=len(series),
+        fingerprint=fingerprint(series),
+        lower=bounds[0] if bounds else None,
+        upper=bounds[1] if bounds else None
+    )
+    state.start_params = np.r_[
+        params["smoothing_level"], params["smoothing_trend"], params["smoothing_seasonal"],
+        params["initial_level"], params["initial_trend"], params["initial_seasons"]
+    ]
+    return state
+
+def reuse_hw_state(series, state, seasonal_periods=7):
+    """推定済みの状態がそのまま（または状態を進めて）使える場合はその状態を返す"""
+    if state is None or state.seasonal_periods != seasonal_periods:
+        return None
+
+    values = np.asarray(series, dtype=float)
+
+    # データに変更なし
+    if state.n_obs == len(values) and state.fingerprint == fingerprint(values):
+        return state
+
+    # 新しい日が追加されただけなら状態を進める
+    if state.updates_since_fit + len(values) - state.n_obs < HW_REOPTIMIZE_EVERY:
+        return state.advance(values)
+    return None
+
+def holt_winters_state(series, seasonal_periods=7, state=None):
+    """
+    推定済みの状態を再利用してHolt-Winters予測を行う
+
+    Returns:
+        (予測値, 新しい状態) - 状態を作れなかった場合はNone
+    """
+    if len(series) < 2 * seasonal_periods:
+        return holt_forecast(series), None
+
+    reused = reuse_hw_state(series, state, seasonal_periods)
+    if reused is not None:
+        return reused.forecast(1), reused
+
+    # 再推定
+    state = fit_hw_state(series, seasonal_periods)
+    if state is None:
+        return holt_forecast(series), None
+    return state.forecast(1), state
+
+def cached_holt_winters_forecast(user, bread, series, seasonal_periods=7):
+    """モデルキャッシュを利用したHolt-Winters予測"""
+    key = (user, bread, seasonal_periods)
+    forecast, state = holt_winters_state(series, seasonal_periods, MODEL_CACHE.get(key))
+    if state is not None:
+        MODEL_CACHE.put(key, state)
+    return float(forecast)
+
+def expired_through(day):
+    """
+    day の時点で賞味期限切れになる最も新しい追加日
+
+    この日以前に追加したバッチは期限切れ（販売できず、在庫からも外す）。
+    在庫表示・販売の差し引き・期限切れの退役はすべてこの境界を使う。
+    """
+    return day - timedelta(days=SHELF_DAYS)
+
+def _batch_entry(row, today):
+    """バッチ1件の在庫状態（残り日数・緊急度）を計算"""
+    added = date.fromisoformat(row["added_date"])
+    days_old = (today - added).days
+    days_until_expiry = SHELF_DAYS - days_old
+
+    status = "expired" if added <= expired_through(today) else "valid"
+    urgency = "high" if days_until_expiry == 1 else "medium" if days_until_expiry == 2 else "low"
+
+    return {
+        "id": row["id"],
+        "qty": row["qty"],
+        "remaining": row["remaining"],
+        "added_date": row["added_date"],
+        "days_old": days_old,
+        "days_until_expiry": days_until_expiry,
+        "status": status,
+        "urgency": urgency
+    }
+
 def get_batch_status(user, bread):
     """バッチごとの在庫状態を取得（FIFO用）"""
-    db = get_db()
+    db = get_read_db()
     today = date.today()
 
     rows = db.execute(
@@ -136,77 +497,160 @@ def get_batch_status(user, bread):
         (user, bread)
     ).fetchall()
 
-    batches = []
+    return [_batch_entry(row, today) for row in rows]
+
+def get_all_batch_status(user):
+    """全種類のパンのバッチ在庫状態を1クエリで取得（パン → バッチのリスト）"""
+    db = get_read_db()
+    today = date.today()
+
+    rows = db.execute(
+        """SELECT id, bread, qty, added_date, remaining
+           FROM batches
+           WHERE user=? AND remaining > 0
+           ORDER BY added_date ASC""",
+        (user,)
+    ).fetchall()
+
+    status = {bread: [] for bread in BREADS}
     for row in rows:
-        added = date.fromisoformat(row["added_date"])
-        days_old = (today - added).days
-        days_until_expiry = SHELF_DAYS - days_old
-
-        status = "expired" if days_until_expiry <= 0 else "valid"
-        urgency = "high" if days_until_expiry == 1 else "medium" if days_until_expiry == 2 else "low"
-
-        batches.append({
-            "id": row["id"],
-            "qty": row["qty"],
-            "remaining": row["remaining"],
-            "added_date": row["added_date"],
-            "days_old": days_old,
-            "days_until_expiry": days_until_expiry,
-            "status": status,
-            "urgency": urgency
-        })
-
-    return batches
+        if row["bread"] in status:
+            status[row["bread"]].append(_batch_entry(row, today))
+    return status
+
+def get_stock_levels(user):
+    """全種類のパンの現在の在庫（バッチ合計）を在庫台帳 stock_levels から取得"""
+    db = get_read_db()
+    rows = db.execute(
+        "SELECT bread, qty FROM stock_levels WHERE user=?",
+        (user,)
+    ).fetchall()
 
+    stock = {bread: 0 for bread in BREADS}
+    for row in rows:
+        if row["bread"] in stock:
+            stock[row["bread"]] = row["qty"]
+    return stock
+
+def forecast_bread(sales, state=None):
+    """
+    1種類のパンの予測値と標準偏差を計算（DBアクセスなし・プロセスプールで実行可能）
+
+    Returns:
+        ({"forecast", "sigma", "method"}, 新しいHolt-Winters状態またはNone)
+    """
+    # 予測値計算 - Holt-Winters法を優先
+    if len(sales) >= 14:  # 十分なデータがある場合
+        forecast, state = holt_winters_state(sales, seasonal_periods=7, state=state)
+        method = "Holt-Winters"
+    elif len(sales) >= 3:  # 少ないデータの場合はHolt法
+        forecast, state = holt_forecast(sales), None
+        method = "Holt"
+    else:  # データが非常に少ない場合は加重移動平均
+        forecast, state = weighted_ma(sales), None
+        method = "WMA"
+
+    return {"forecast": float(forecast), "sigma": sales_sigma(sales), "method": method}, state
+
+def sales_sigma(sales):
+    """予測の標準偏差（外れ値を除外）"""
+    if len(sales) >= 4:
+        cleaned_sales = remove_outliers(sales[-HISTORY_DAYS:])
+        return float(cleaned_sales.std(ddof=0)) if len(cleaned_sales) >= 2 else 0.0
+    if len(sales) >= 2:
+        return float(sales[-HISTORY_DAYS:].std(ddof=0))
+    return 0.0
+
+def forecast_bread_fallback(sales, state=None):
+    """forecast_bread が時間内に終わらなかった場合の予測（加重移動平均、状態は更新しない）"""
+    return {"forecast": float(weighted_ma(sales)), "sigma": sales_sigma(sales), "method": "WMA"}, None
+
+@timed_stage("forecast_breads")
+def forecast_breads(tasks):
+    """
+    複数種類のパンをまとめて予測（tasks: (販売データ, キャッシュ済み状態) のリスト）
+
+    numpyエンジンでは再推定が必要なHolt-Winters系列を1回のバッチ推定にまとめ、
+    statsmodelsエンジンではパンごとのタスクを parallel.run_tasks で実行する。
+    """
+    if FORECAST_ENGINE != "numpy":
+        return parallel.run_tasks(forecast_bread, tasks, fallback=forecast_bread_fallback)
+
+    tasks = list(tasks)
+    refit = [
+        i for i, (sales, state) in enumerate(tasks)
+        if len(sales) >= 14 and reuse_hw_state(sales, state) is None
+    ]
+    for i, state in zip(refit, fit_hw_states([tasks[i][0] for i in refit])):
+        tasks[i] = (tasks[i][0], state)
+    return [forecast_bread(sales, state) for sales, state in tasks]
+
+@timed_stage("compute_recs")
 def compute_recs(user):
     """注文推奨量を計算（改善版：Holt-Winters法使用）"""
     rec = {}
     today = date.today()
     tomorrow = today + timedelta(days=1)
 
-    for bread in BREADS:
-        # 過去の販売データ取得
-        sales = get_sales_series(user, bread)
-
-        # 予測値計算 - Holt-Winters法を優先
-        if len(sales) >= 14:  # 十分なデータがある場合
-            forecast = holt_winters_forecast(sales, seasonal_periods=7)
-        elif len(sales) >= 3:  # 少ないデータの場合はHolt法
-            forecast = holt_forecast(sales)
-        else:  # データが非常に少ない場合は加重移動平均
-            forecast = weighted_ma(sales)
-
-        # 標準偏差計算（外れ値を除外）
-        if len(sales) >= 4:
-            cleaned_sales = remove_outliers(sales[-HISTORY_DAYS:])
-            sigma = float(cleaned_sales.std(ddof=0)) if len(cleaned_sales) >= 2 else 0.0
-        elif len(sales) >= 2:
-            sigma = float(sales[-HISTORY_DAYS:].std(ddof=0))
-        else:
-            sigma = 0.0
+    # 過去の販売データ（学習期間のみ）・在庫・バッチ状態をまとめて取得
+    days, matrix = load_sales_matrix(user, since=window_start(max(LOOKBACK_DAYS.values()), today))
+    stock = get_stock_levels(user)
+    batch_status = get_all_batch_status(user)
+
+    # 週次集計モード: 長期データを週単位で集計した予測を使う（対象のパンは日次モデルを推定しない）
+    weekly = load_weekly_sales(user, until=tomorrow) if WEEKLY_AGGREGATE else {}
+
+    # 予測（パンごとに独立しているため並列実行可能）
+    sales = {bread: training_window(days, matrix, bread, today) for bread in BREADS}
+    daily = [bread for bread in BREADS if bread not in weekly]
+    forecasts = dict(zip(daily, forecast_breads(
+        [(sales[bread], MODEL_CACHE.get((user, bread, 7))) for bread in daily]
+    )))
+    for bread in weekly:
+        forecasts[bread] = ({
+            "forecast": weekly_forecast(*weekly[bread], tomorrow),
+            "sigma": sales_sigma(sales[bread]),
+            "method": "Weekly-Holt"
+        }, None)
+    results = [forecasts[bread] for bread in BREADS]
+
+    # 天気の補正: 学習期間の天気の効果を推定し、翌日の天気の記録があれば予測に加える
+    if WEATHER_REGRESSORS:
+        weather = weather_store.lookup(days)
+        tomorrow_weather = weather_store.lookup(np.array([tomorrow], dtype="datetime64[D]"))
+        for i, bread in enumerate(BREADS):
+            effect = fit_weather_effect(*sales_with_weather(days, matrix, bread, weather))
+            correction = float(weather_correction(effect, tomorrow_weather)[0])
+            if correction:
+                result, state = results[i]
+                result = dict(result, forecast=max(0.0, result["forecast"] + correction),
+                              weather_adjustment=correction)
+                results[i] = (result, state)
+
+    # 中国祝日・イベントの影響を反映
+    impact_multiplier = weather_holiday.get_impact_multiplier(tomorrow)
+
+    for bread, (result, state) in zip(BREADS, results):
+        if state is not None:
+            MODEL_CACHE.put((user, bread, 7), state)
+
+        forecast = result["forecast"]
+        sigma = result["sigma"]
 
         # 安全在庫係数
-        z = compute_z(SERVICE_LEVEL)
-
-        # 中国祝日・イベントの影響を反映
-        impact_multiplier = weather_holiday.get_impact_multiplier(tomorrow)
-        z *= impact_multiplier
+        z = compute_z(SERVICE_LEVEL) * impact_multiplier
 
         # 目標在庫
         target = forecast + z * sigma
 
         # 現在の在庫（バッチ合計）
-        db = get_db()
-        rem = db.execute(
-            "SELECT SUM(remaining) as rem FROM batches WHERE user=? AND bread=?",
-            (user, bread)
-        ).fetchone()["rem"] or 0
+        rem = stock[bread]
 
         # 注文推奨量
         order_qty = max(0, math.ceil(target - rem))
 
-        # バッチ状態取得
-        batches = get_batch_status(user, bread)
+        # バッチ状態
+        batches = batch_status[bread]
 
         rec[bread] = {
             "forecast": round(forecast, 2),
@@ -216,52 +660,16 @@ def compute_recs(user):
             "order": int(order_qty),
             "impact_multiplier": round(impact_multiplier, 2),
             "batches": batches,
-            "method": "Holt-Winters" if len(sales) >= 14 else "Holt" if len(sales) >= 3 else "WMA"
+            "method": result["method"]
         }
+        if "weather_adjustment" in result:
+            rec[bread]["weather_adjustment"] = round(result["weather_adjustment"], 2)
 
     return rec
 
-def backtest_model(user, bread, days=7):
-    """バックテスト（MAE/RMSE計算）- 改善版Holt-Winters使用"""
-    sales = get_sales_series(user, bread)
-
-    if len(sales) < days + 7:
-        return {"error": "データ不足", "mae": None, "rmse": None, "method": "N/A"}
-
-    errors = []
-    method_used = "Unknown"
-
-    for i in range(len(sales) - days, len(sales)):
-        historical = sales[:i]
-        actual = sales.iloc[i]
-
-        # 最適な手法を選択
-        if len(historical) >= 14:
-            predicted = holt_winters_forecast(historical, seasonal_periods=7)
-            method_used = "Holt-Winters"
-        elif len(historical) >= 3:
-            predicted = holt_forecast(historical)
-            method_used = "Holt"
-        else:
-            predicted = weighted_ma(historical)
-            method_used = "WMA"
-
-        errors.append(actual - predicted)
-
-    errors = np.array(errors)
-    mae = np.mean(np.abs(errors))
-    rmse = np.sqrt(np.mean(errors ** 2))
-
-    return {
-        "mae": round(float(mae), 2),
-        "rmse": round(float(rmse), 2),
-        "samples": len(errors),
-        "method": method_used
-    }
-
 def get_recent_records(user, days=30):
     """最近のレコードを取得"""
-    db = get_db()
+    db = get_read_db()
     cutoff = (date.today() - timedelta(days=days)).isoformat()
 
     rows = db.execute(
@@ -274,6 +682,49 @@ def get_recent_records(user, days=30):
 
     return [dict(row) for row in rows]
 
+def get_records_page(user, days=30, cursor=None, limit=100):
+    """
+    最近のレコードを新しい順に1ページ取得（(day, id) のキーセットページング）
+
+    Returns:
+        (レコードのリスト, 次のページのカーソル（最後のページならNone）)
+    """
+    db = get_read_db()
+    cutoff = (date.today() - timedelta(days=days)).isoformat()
+
+    if cursor:
+        rows = db.execute(
+            """SELECT id, day, bread, sold, leftover, created_at
+               FROM records
+               WHERE user=? AND day>=? AND (day, id) < (?, ?)
+               ORDER BY day DESC, id DESC LIMIT ?""",
+            (user, cutoff, *parse_cursor(cursor), limit + 1)
+        ).fetchall()
+    else:
+        rows = db.execute(
+            """SELECT id, day, bread, sold, leftover, created_at
+               FROM records
+               WHERE user=? AND day>=?
+               ORDER BY day DESC, id DESC LIMIT ?""",
+            (user, cutoff, limit + 1)
+        ).fetchall()
+
+    records = [dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(records[-1]["day"], records[-1]["id"]) if len(rows) > limit else None
+    return records, next_cursor
+
+def iter_records(user, since=None, until=None, fetch_size=1000):
+    """全期間（またはsince〜until）のレコードを日付順に少しずつ取り出す（エクスポート用）"""
+    db = get_read_db()
+    cur = db.execute(
+        """SELECT id, day, bread, sold, leftover, created_at
+           FROM records
+           WHERE user=? AND day>=? AND day<=?
+           ORDER BY day ASC, id ASC""",
+        (user, since or "", until or "9999-12-31")
+    )
+    return iter_rows(cur, fetch_size)
+
 def update_record(record_id, sold, leftover):
     """レコードを更新"""
     db = get_db()
@@ -0,0 +1,83 @@
+"""
+祝日・イベントのカレンダー
+
+データファイル（data/china_holidays.json）から複数年分の祝日定義を読み込み、起動時に一度だけ
+日付 → イベント・影響係数の索引を作る。日付ごとの検索は辞書1回の参照で済み、
+任意の期間のイベントも索引を引くだけで求められる。
+
+データファイルの形式:
+    fixed:   毎年同じ日付の祝日（month, day）
+    movable: 旧暦・二十四節気などで年ごとに日付が変わる祝日（dates: {年: 日付}）
+    どちらも days に基準日からの offset ごとの名前・影響度・説明を持つ
+"""
+import os
+import json
+from datetime import date, timedelta
+
+HOLIDAY_CALENDAR_PATH = os.environ.get(
+    "HOLIDAY_CALENDAR_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "china_holidays.json")
+)
+
+# 影響度の強さの順（同じ日に複数のイベントがある場合は強い方の係数を使う）
+IMPACT_ORDER = ("low", "medium", "high", "very_high")
+
+
+class HolidayCalendar:
+    """日付 → イベントの索引"""
+
+    def __init__(self, definitions):
+        self.multipliers = definitions.get("impact_multipliers", {})
+        first, last = definitions.get("years", (date.today().year, date.today().year))
+        self.first_year, self.last_year = int(first), int(last)
+
+        index = {}
+
+        def add(base, days):
+            for day in days:
+                d = base + timedelta(days=day["offset"])
+                event = {"name": day["name"], "impact": day["impact"], "detail": day.get("detail", "")}
+                index.setdefault(d, []).append(event)
+
+        for holiday in definitions.get("fixed", []):
+            for year in range(self.first_year, self.last_year + 1):
+                add(date(year, holiday["month"], holiday["day"]), holiday["days"])
+        for holiday in definitions.get("movable", []):
+            for day in holiday["dates"].values():
+                add(date.fromisoformat(day), holiday["days"])
+
+        # 同じ日の複数イベントは影響度の強い順に並べ、係数は最も強いものを使う
+        self.events_by_date = {}
+        self.multiplier_by_date = {}
+        for d, events in index.items():
+            events.sort(key=lambda e: IMPACT_ORDER.index(e["impact"]), reverse=True)
+            self.events_by_date[d] = tuple(events)
+            self.multiplier_by_date[d] = self.multipliers.get(events[0]["impact"], 1.0)
+
+    @classmethod
+    def load(cls, path=HOLIDAY_CALENDAR_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def events_on(self, d):
+        """指定日のイベント（影響度の強い順）"""
+        return self.events_by_date.get(d, ())
+
+    def impact_multiplier(self, d):
+        """指定日のインバウンド影響係数"""
+        return self.multiplier_by_date.get(d, 1.0)
+
+    def is_holiday(self, d):
+        return d in self.events_by_date
+
+    def events_between(self, start, days):
+        """start から days 日間のイベント（date, days_until付き）"""
+        events = []
+        for i in range(days):
+            d = start + timedelta(days=i)
+            for event in self.events_on(d):
+                events.append(dict(event, date=d.isoformat(), days_until=i))
+        return events
+
+
+CALENDAR = HolidayCalendar.load()
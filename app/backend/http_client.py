@@ -0,0 +1,81 @@
+"""
+外部APIの呼び出し
+
+ワーカープロセスごとに1つの requests.Session を使い回し、接続をプールして再利用する
+（毎回のTCP・TLS接続を省く）。接続エラーや5xx・429は指数バックオフで再試行する。
+ダッシュボードで予測計算と並行して外部APIを呼ぶためのスレッドプールもここで管理する。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 再試行回数とバックオフ係数（待ち時間は backoff * 2^(n-1) 秒）
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.3))
+
+# (接続, 読み込み) のタイムアウト（秒）
+HTTP_TIMEOUT = (
+    float(os.environ.get("HTTP_CONNECT_TIMEOUT", 2)),
+    float(os.environ.get("HTTP_READ_TIMEOUT", 3))
+)
+
+# 接続プールの大きさ
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 4))
+
+_session = None
+_session_pid = None
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """このプロセス用のHTTPセッションを取得（fork後は作り直す）"""
+    global _session, _session_pid
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET",),
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                max_retries=retry, pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def get(url, **kwargs):
+    """プール済みのセッションでGETリクエストを送る"""
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    return get_session().get(url, **kwargs)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="external-io")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _run_in_app_context(app, func, args):
+    with app.app_context():
+        return func(*args)
+
+
+def submit(app, func, *args):
+    """func(*args) をアプリケーションコンテキスト付きでバックグラウンド実行し、Futureを返す"""
+    return _get_executor().submit(_run_in_app_context, app, func, args)
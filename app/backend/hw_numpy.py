@@ -0,0 +1,166 @@
+"""
+NumPyによる加法Holt-Winters法（加法トレンド・加法季節）
+
+複数の系列を左詰めの2次元配列（系列数 × 日数）にまとめ、パラメータ候補と系列の組み合わせを
+ベクトル化して一度に計算する。パラメータは粗いグリッド探索の後、系列ごとに近傍探索で絞り込む。
+statsmodelsを使わないため、数十〜数百点の短い系列では読み込み・推定ともに軽い。
+"""
+import itertools
+
+import numpy as np
+
+# 粗いグリッド探索の候補値
+ALPHA_GRID = (0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9)
+BETA_GRID = (0.0, 0.01, 0.05, 0.1, 0.2)
+GAMMA_GRID = (0.0, 0.05, 0.1, 0.2, 0.4)
+
+# 近傍探索の回数（1回ごとに刻み幅を半分にする）
+REFINE_STEPS = 4
+INITIAL_STEP = np.array([0.1, 0.05, 0.1])
+
+# Holt法の初期状態を求めるのに使う先頭の点数
+HOLT_INIT_POINTS = 7
+
+
+def stack_series(series_list):
+    """長さの異なる系列を左詰めの2次元配列に変換（不足分はNaN）"""
+    lengths = np.array([len(s) for s in series_list], dtype=int)
+    Y = np.full((len(series_list), int(lengths.max()) if len(lengths) else 0), np.nan)
+    for i, s in enumerate(series_list):
+        Y[i, :lengths[i]] = np.asarray(s, dtype=float)
+    return Y, lengths
+
+
+def _initial_states(Y, m):
+    """初期状態（水準・傾き・季節）を先頭のデータから求める（Holt法の水準は _run で補正する）"""
+    if m:
+        first = Y[:, :m]
+        level0 = first.mean(axis=1)
+        trend0 = (Y[:, m:2 * m].mean(axis=1) - level0) / m
+        season0 = first - level0[:, None]
+    else:
+        # 先頭の数点に直線を当てはめる（1点目・2点目の差だけでは不安定なため）
+        k = max(2, min(HOLT_INIT_POINTS, int(np.min(np.sum(~np.isnan(Y), axis=1)))))
+        x = np.arange(k) - (k - 1) / 2
+        head = Y[:, :k]
+        trend0 = (head * x).sum(axis=1) / (x ** 2).sum()
+        level0 = head.mean(axis=1) - trend0 * ((k - 1) / 2 + 1)
+        season0 = np.zeros((Y.shape[0], 0))
+    return level0, trend0, season0
+
+
+def _run(Y, lengths, alpha, beta, gamma, init):
+    """
+    パラメータ候補 (G, S) ごとに全系列を1パスで平滑化する
+
+    Holt法では初期水準を init を起点に、候補ごとに1期先予測の二乗誤差が最小になる値に補正する
+    （statsmodels の initialization_method="estimated" に相当）。平滑化は初期状態について線形なので、
+    初期水準を1だけ動かした場合の誤差（感度）を同じパスで計算すれば補正量は最小二乗で求まる。
+    Holt-Wintersは先頭2周期から求めた水準・季節をそのまま使う（水準だけ動かすと精度が落ちるため）。
+
+    Returns:
+        (SSE, 水準, 傾き, 季節) - 各系列の最終日時点の状態
+    """
+    level0, trend0, season0 = init
+    shape = alpha.shape
+    m = season0.shape[1]
+
+    # [基準, 初期水準の感度]（季節ありは基準のみ）
+    k = 1 if m else 2
+    level = np.stack([np.broadcast_to(level0, shape), np.ones(shape)][:k])
+    trend = np.stack([np.broadcast_to(trend0, shape), np.zeros(shape)][:k])
+    season = np.zeros((k,) + shape + (m,))
+    season[0] = np.broadcast_to(season0, shape + (m,))
+    y = np.zeros((k,) + shape)
+    sse, cross, sens = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+
+    for t in range(Y.shape[1]):
+        active = t < lengths
+        y[0] = Y[:, t]
+        s_old = season[..., t % m] if m else 0.0
+
+        err = np.where(active, y - (level + trend + s_old), 0.0)
+        sse += err[0] ** 2
+        if not m:
+            cross += err[0] * err[1]
+            sens += err[1] ** 2
+
+        new_level = alpha * (y - s_old) + (1 - alpha) * (level + trend)
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        if m:
+            new_season = gamma * (y - level - trend) + (1 - gamma) * s_old
+            season[..., t % m] = np.where(active, new_season, s_old)
+        level = np.where(active, new_level, level)
+        trend = np.where(active, new_trend, trend)
+
+    if m:
+        return sse, level[0], trend[0], season[0]
+
+    # 初期水準の補正量 d: 誤差は err + d * 感度 になる
+    d = -cross / np.where(sens > 0, sens, 1.0)
+    sse = sse + 2 * d * cross + d * d * sens
+    return sse, level[0] + d * level[1], trend[0] + d * trend[1], season[0]
+
+
+def fit_batch(series_list, seasonal_periods=7):
+    """
+    複数系列をまとめて推定する
+
+    Args:
+        series_list: 系列のリスト（季節ありは各2*seasonal_periods点以上、なしは2点以上）
+        seasonal_periods: 季節周期（Noneの場合はHolt法）
+
+    Returns:
+        dict: alpha, beta, gamma, level, trend (S,), season (S, m)（先頭が次の日の季節成分）, sse
+    """
+    Y, lengths = stack_series(series_list)
+    m = seasonal_periods or 0
+    S = Y.shape[0]
+    init = _initial_states(Y, m)
+
+    # 粗いグリッド探索（全候補 × 全系列を一度に計算）
+    gammas = GAMMA_GRID if m else (0.0,)
+    grid = np.array(list(itertools.product(ALPHA_GRID, BETA_GRID, gammas)))
+    tile = np.ones((1, S))
+    sse = _run(Y, lengths, grid[:, 0:1] * tile, grid[:, 1:2] * tile, grid[:, 2:3] * tile, init)[0]
+    best = grid[np.argmin(sse, axis=0)]  # (S, 3)
+
+    # 系列ごとの近傍探索
+    offsets = np.array(list(itertools.product((-1, 0, 1), repeat=3)), dtype=float)
+    if not m:
+        offsets = offsets[offsets[:, 2] == 0]
+    step = INITIAL_STEP.copy()
+    for _ in range(REFINE_STEPS):
+        cand = np.clip(best[None, :, :] + offsets[:, None, :] * step, 0.0, 1.0)  # (K, S, 3)
+        sse = _run(Y, lengths, cand[:, :, 0], cand[:, :, 1], cand[:, :, 2], init)[0]
+        best = cand[np.argmin(sse, axis=0), np.arange(S)]
+        step /= 2
+
+    sse, level, trend, season = _run(
+        Y, lengths, best[None, :, 0], best[None, :, 1], best[None, :, 2], init
+    )
+    season = season[0]
+    if m:
+        # 各系列の次の日に使う季節成分が先頭になるよう並べ替える
+        idx = (lengths[:, None] + np.arange(m)[None, :]) % m
+        season = np.take_along_axis(season, idx, axis=1)
+
+    return {
+        "alpha": best[:, 0],
+        "beta": best[:, 1],
+        "gamma": best[:, 2],
+        "level": level[0],
+        "trend": trend[0],
+        "season": season,
+        "sse": sse[0]
+    }
+
+
+def forecast_batch(series_list, seasonal_periods=7, steps=1):
+    """複数系列をまとめて推定し、steps日先の予測値を返す"""
+    fit = fit_batch(series_list, seasonal_periods)
+    forecast = fit["level"] + steps * fit["trend"]
+    m = seasonal_periods or 0
+    if m:
+        forecast = forecast + fit["season"][:, (steps - 1) % m]
+    return forecast
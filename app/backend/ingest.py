@@ -0,0 +1,204 @@
+"""
+販売データの一括取り込み
+
+JSON配列またはCSV（列: user, day, bread, sold, leftover）の行を検証し、
+INGEST_CHUNK_SIZE 行ごとのトランザクションで records に書き込む。
+各チャンクでは executemany の UPDATE で既存行を上書きし、残りを INSERT OR IGNORE で追加するため、
+更新・追加の件数をそのまま数えられる。在庫バッチは作成しない（当日の在庫は /api/input で入力する）。
+
+コマンドラインからも実行できる:
+    python ingest.py sales.csv [--user 店舗名] [--format csv|json] [--db breads_full.db]
+"""
+import os
+import io
+import csv
+import sys
+import json
+import argparse
+from datetime import date, datetime
+
+from db import get_db
+from forecast import BREADS
+import recommendations
+
+# 1トランザクションで書き込む行数
+INGEST_CHUNK_SIZE = int(os.environ.get("INGEST_CHUNK_SIZE", 5000))
+
+# 結果に含めるエラーの最大件数
+INGEST_MAX_ERRORS = 100
+
+
+def reject_row(result, row, error):
+    """検証に失敗した行を結果に数える（エラー内容は先頭の INGEST_MAX_ERRORS 件のみ残す）"""
+    result["rejected"] += 1
+    if len(result["errors"]) < INGEST_MAX_ERRORS:
+        result["errors"].append({"row": row, "error": str(error)})
+
+
+UPDATE_SQL = "UPDATE records SET sold=?, leftover=? WHERE user=? AND day=? AND bread=?"
+INSERT_SQL = """INSERT OR IGNORE INTO records (user, day, bread, sold, leftover, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)"""
+
+
+def _count(value, name):
+    """販売数・余りを0以上の整数に変換"""
+    if isinstance(value, bool):
+        raise ValueError(f"{name}が整数ではありません")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"{name}が整数ではありません")
+        value = int(value)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name}が整数ではありません")
+    if value < 0:
+        raise ValueError(f"{name}が負の値です")
+    return value
+
+
+def validate_row(row, default_user=None, allowed_user=None):
+    """
+    1行を検証して (user, day, bread, sold, leftover) に変換
+
+    allowed_user: 指定した場合、それ以外のユーザーの行はエラーにする（APIからの取り込み用）
+
+    Raises:
+        ValueError: 不正な行
+    """
+    if not isinstance(row, dict):
+        raise ValueError("行がオブジェクトではありません")
+    user = row.get("user") or default_user
+    if not user:
+        raise ValueError("userがありません")
+    if allowed_user is not None and user != allowed_user:
+        raise ValueError("他のユーザーのデータは取り込めません")
+    try:
+        day = date.fromisoformat(str(row.get("day", ""))).isoformat()
+    except ValueError:
+        raise ValueError("無効な日付形式です")
+    bread = row.get("bread")
+    if bread not in BREADS:
+        raise ValueError(f"不明なパンです: {bread}")
+    return user, day, bread, _count(row.get("sold"), "sold"), _count(row.get("leftover", 0), "leftover")
+
+
+def _write_chunk(chunk, now):
+    """
+    1チャンクを書き込み、(追加件数, 更新件数) を返す
+
+    チャンクに含まれるユーザーの推奨量も同じトランザクションでstaleにするため、
+    後のチャンクで失敗しても書き込み済みの行はデータバージョン・ETagに反映される。
+    """
+    # 同じ (user, day, bread) が複数ある場合は後の行で上書きする
+    latest = {}
+    for user, day, bread, sold, leftover in chunk:
+        latest[(user, day, bread)] = (sold, leftover)
+    superseded = len(chunk) - len(latest)
+
+    db = get_db()
+    updated = db.executemany(
+        UPDATE_SQL,
+        [(sold, leftover, user, day, bread) for (user, day, bread), (sold, leftover) in latest.items()]
+    ).rowcount
+    inserted = db.executemany(
+        INSERT_SQL,
+        [(user, day, bread, sold, leftover, now) for (user, day, bread), (sold, leftover) in latest.items()]
+    ).rowcount
+    for user in {user for user, _, _ in latest}:
+        recommendations.mark_stale(user, commit=False)
+    db.commit()
+    return inserted, updated + superseded
+
+
+def ingest_rows(rows, default_user=None, allowed_user=None, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    行を検証してチャンクごとに書き込む
+
+    Args:
+        rows: 行（辞書）のイテラブル（CSVの場合は逐次読み込み）
+        default_user: userがない行に使うユーザー
+        allowed_user: この値以外のユーザーの行はエラーにする
+
+    Returns:
+        dict: inserted, updated, rejected, errors（行番号とエラー内容、先頭のみ）, users
+    """
+    result = {"inserted": 0, "updated": 0, "rejected": 0, "errors": []}
+    users = set()
+    now = datetime.utcnow().isoformat()
+    chunk = []
+
+    for line, row in enumerate(rows, start=1):
+        try:
+            chunk.append(validate_row(row, default_user, allowed_user))
+        except ValueError as e:
+            reject_row(result, line, e)
+            continue
+        users.add(chunk[-1][0])
+        if len(chunk) >= chunk_size:
+            inserted, updated = _write_chunk(chunk, now)
+            result["inserted"] += inserted
+            result["updated"] += updated
+            chunk = []
+    if chunk:
+        inserted, updated = _write_chunk(chunk, now)
+        result["inserted"] += inserted
+        result["updated"] += updated
+
+    result["users"] = sorted(users)
+    return result
+
+
+def read_csv(stream):
+    """CSV（ヘッダー行あり）を1行ずつ辞書として読み込む"""
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.BytesIO(stream)
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    return csv.DictReader(stream)
+
+
+def read_json(data):
+    """JSON配列、または {"rows": [...]} の行を取り出す"""
+    if isinstance(data, dict):
+        data = data.get("rows")
+    if not isinstance(data, list):
+        raise ValueError("行の配列が必要です")
+    return data
+
+
+def main():
+    from flask import Flask
+    import db
+
+    parser = argparse.ArgumentParser(description="販売データの一括取り込み")
+    parser.add_argument("file", help="CSVまたはJSONファイル（-で標準入力）")
+    parser.add_argument("--user", help="userがない行に使うユーザー")
+    parser.add_argument("--format", choices=("csv", "json"), help="省略時は拡張子から判断")
+    parser.add_argument("--db", help="データベースファイル（省略時はDB_PATH）")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    if args.db:
+        db.DB_PATH = args.db
+    fmt = args.format or ("json" if args.file.endswith(".json") else "csv")
+
+    app = Flask(__name__)
+    db.init_db(app)
+    app.teardown_appcontext(db.close_db)
+    stream = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    try:
+        with app.app_context():
+            rows = read_csv(stream) if fmt == "csv" else read_json(json.load(stream))
+            result = ingest_rows(rows, default_user=args.user, chunk_size=args.chunk_size)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if result["rejected"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+処理時間の計測と /metrics（Prometheusのテキスト形式）
+
+各プロセスは計測値（ヒストグラム・カウンター）をメモリに集計し、METRICS_FLUSH_INTERVAL 秒ごとに
+METRICS_DIR の自分のファイル（metrics_<pid>.json）に書き出す。/metrics は全プロセスのファイルを
+足し合わせて返すため、どのgunicornワーカーが応答しても全ワーカー分の値になる
+（プロセスプールで実行した予測の計測値も含む）。
+
+計測の対象:
+    http_request_duration_seconds     ルートごとの応答時間
+    sql_statement_duration_seconds    SQL文ごとの実行時間（InstrumentedConnection 経由の接続）
+    forecast_stage_duration_seconds   予測の処理段階ごとの時間（@timed_stage）
+"""
+import os
+import re
+import json
+import time
+import atexit
+import sqlite3
+import tempfile
+import threading
+from functools import wraps
+
+# 計測するか（false の場合はSQLの計測も行わない）
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+
+# プロセスごとのファイルを置くディレクトリ（サーバー起動時に空にする）
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), "panzaiko-metrics"))
+
+# ファイルに書き出す間隔（秒）
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+
+# ヒストグラムの区切り（秒）
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PREFIX = "panzaiko_"
+
+HELP = {
+    "http_request_duration_seconds": "ルートごとの応答時間",
+    "sql_statement_duration_seconds": "SQL文ごとの実行時間",
+    "forecast_stage_duration_seconds": "予測の処理段階ごとの時間",
+}
+
+_lock = threading.Lock()
+_pid = None
+_histograms = {}
+_last_flush = 0.0
+
+
+def _reset_if_forked():
+    """fork後は親プロセスの集計を引き継がない（親の値は親のファイルに記録済み）"""
+    global _pid, _histograms, _last_flush
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _histograms = {}
+        _last_flush = time.monotonic()
+
+
+def _label_key(labels):
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+def observe(name, seconds, **labels):
+    """ヒストグラムに計測値を1つ追加"""
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _reset_if_forked()
+        series = _histograms.setdefault(name, {})
+        key = _label_key(labels)
+        entry = series.get(key)
+        if entry is None:
+            # [区切りごとの件数..., 合計, 件数]
+            entry = series[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry[i] += 1
+                break
+        entry[-2] += seconds
+        entry[-1] += 1
+        due = time.monotonic() - _last_flush >= METRICS_FLUSH_INTERVAL
+    if due:
+        flush()
+
+
+class timer:
+    """with metrics.timer(name, **labels): の間の時間を計測"""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def timed_stage(stage):
+    """予測の処理段階の時間を計測するデコレーター"""
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe("forecast_stage_duration_seconds", time.perf_counter() - started, stage=stage)
+        return wrapper
+    return decorator
+
+
+def flush():
+    """このプロセスの集計をファイルに書き出す"""
+    global _last_flush
+    with _lock:
+        _reset_if_forked()
+        _last_flush = time.monotonic()
+        if not _histograms:
+            return
+        data = json.dumps({"histograms": _histograms}, ensure_ascii=False)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def reset_dir():
+    """前回の起動時のファイルを削除（gunicornのマスタープロセスで起動時に呼ぶ）"""
+    if not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        if name.startswith("metrics_"):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+
+def _collect():
+    """全プロセスのファイルを足し合わせる"""
+    flush()
+    merged = {}
+    if not os.path.isdir(METRICS_DIR):
+        return merged
+    for name in os.listdir(METRICS_DIR):
+        if not (name.startswith("metrics_") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric, series in data.get("histograms", {}).items():
+            target = merged.setdefault(metric, {})
+            for key, entry in series.items():
+                if key in target:
+                    target[key] = [a + b for a, b in zip(target[key], entry)]
+                else:
+                    target[key] = list(entry)
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render(counters=None):
+    """
+    Prometheusのテキスト形式で出力
+
+    counters: 追加で出力するカウンター {名前: (説明, {ラベルのタプル: 値})}
+    """
+    lines = []
+    for metric, series in sorted(_collect().items()):
+        name = PREFIX + metric
+        lines.append(f"# HELP {name} {HELP.get(metric, metric)}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, entry in sorted(series.items()):
+            pairs = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, entry):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels_text(pairs, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels_text(pairs, [('le', '+Inf')])} {entry[-1]}")
+            lines.append(f"{name}_sum{_labels_text(pairs)} {entry[-2]:.6f}")
+            lines.append(f"{name}_count{_labels_text(pairs)} {entry[-1]}")
+
+    for metric, (help_text, values) in sorted((counters or {}).items()):
+        name = PREFIX + metric
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for pairs, value in sorted(values.items()):
+            lines.append(f"{name}{_labels_text(pairs)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ============================================
+# SQLの計測
+# ============================================
+_WHITESPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\(\s*\?(\s*,\s*\?)+\s*\)")
+
+
+def statement_shape(sql):
+    """SQL文をラベル用に正規化（空白をまとめ、長い文は切り詰める）"""
+    shape = _IN_LIST.sub("(?)", _WHITESPACE.sub(" ", sql).strip())
+    return shape if len(shape) <= 160 else shape[:157] + "..."
+
+
+_statement_hooks = []
+
+
+def add_statement_hook(hook):
+    """SQL文を実行するたびに hook(sql) を呼ぶ（METRICS_ENABLED=false でも計測用の接続を使うようになる）"""
+    if hook not in _statement_hooks:
+        _statement_hooks.append(hook)
+
+
+def _observe_sql(sql, started):
+    for hook in _statement_hooks:
+        hook(sql)
+    observe("sql_statement_duration_seconds", time.perf_counter() - started, statement=statement_shape(sql))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """execute / executemany の時間を計測するカーソル"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe_sql(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe_sql(sql, started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    SQL文ごとの時間を計測する接続（sqlite3.connect(factory=...) で使う）
+
+    計測するのは文の実行（最初の行まで）で、fetchall などの行の読み出しは含まない。
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    """sqlite3.connect に渡す接続クラス（計測もフックもなければ通常の接続）"""
+    return InstrumentedConnection if METRICS_ENABLED or _statement_hooks else sqlite3.Connection
+
+atexit.register(flush)
@@ -0,0 +1,330 @@
+"""
+スキーマのマイグレーション
+
+MIGRATIONS に (バージョン, 説明, SQL文のリスト) を追加していき、init_db から
+run_migrations で未適用のものだけを順番に適用する。適用済みのバージョンは
+schema_version テーブルに記録する。各マイグレーションは BEGIN IMMEDIATE の
+トランザクション内で実行するため、複数のワーカーが同時に起動しても二重に適用されない。
+
+よく使うクエリが全件走査になっていないかは check_query_plans で確認できる:
+    python migrations.py [DBファイル]
+"""
+import re
+import sys
+import sqlite3
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    (1, "records: (user, day, bread) の重複を削除して一意制約を追加、学習期間用のカバリングインデックス", [
+        # 同じ日・同じパンの記録が複数ある場合は最後に書き込まれたものを残す
+        """DELETE FROM records WHERE id NOT IN (
+               SELECT MAX(id) FROM records GROUP BY user, day, bread
+           )""",
+        # 以前の init_db が作成していた (user, bread, day) のインデックスは下のカバリングインデックスで置き換える
+        # （(user, day) のインデックスはバージョン5で定義する）
+        "DROP INDEX IF EXISTS idx_records_user_bread_day",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_records_user_day_bread ON records (user, day, bread)",
+        "CREATE INDEX IF NOT EXISTS idx_records_user_bread_day_sold ON records (user, bread, day, sold)",
+    ]),
+    (2, "batches: ユーザー・パンごとの在庫検索用インデックス", [
+        "CREATE INDEX IF NOT EXISTS idx_batches_user_bread_date ON batches (user, bread, added_date, remaining)",
+    ]),
+    (3, "logs: 新しい順の一覧用インデックス", [
+        "CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs (created_at)",
+    ]),
+    (4, "batches: (user, bread, added_date) の重複を削除して一意制約を追加", [
+        """DELETE FROM batches WHERE id NOT IN (
+               SELECT MAX(id) FROM batches GROUP BY user, bread, added_date
+           )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_batches_user_bread_date ON batches (user, bread, added_date)",
+    ]),
+    (5, "records: (day, id) のキーセットページング・エクスポート用インデックス", [
+        # インデックスの末尾には暗黙にrowid（id）が含まれるため (user, day, id) の順に並ぶ
+        "CREATE INDEX IF NOT EXISTS idx_records_user_day ON records (user, day)",
+    ]),
+    (6, "在庫台帳 stock_levels（batches のトリガーで更新）とFIFO消費の記録 batch_consumptions", [
+        """CREATE TABLE IF NOT EXISTS stock_levels (
+               user TEXT NOT NULL,
+               bread TEXT NOT NULL,
+               qty INTEGER NOT NULL,
+               PRIMARY KEY (user, bread)
+           )""",
+        """CREATE TABLE IF NOT EXISTS batch_consumptions (
+               user TEXT NOT NULL,
+               bread TEXT NOT NULL,
+               day TEXT NOT NULL,
+               batch_id INTEGER NOT NULL,
+               qty INTEGER NOT NULL,
+               PRIMARY KEY (user, bread, day, batch_id)
+           )""",
+        # 期限切れバッチを退役させる日次ジョブ用（残数のあるバッチだけを対象にする部分インデックス）
+        "CREATE INDEX IF NOT EXISTS idx_batches_open_date ON batches (added_date) WHERE remaining > 0",
+        "DELETE FROM stock_levels",
+        """INSERT INTO stock_levels (user, bread, qty)
+           SELECT user, bread, SUM(remaining) FROM batches GROUP BY user, bread""",
+        # batches の残数が変わるたびに同じトランザクション内で台帳を更新する
+        """CREATE TRIGGER IF NOT EXISTS trg_batches_stock_insert AFTER INSERT ON batches BEGIN
+               INSERT INTO stock_levels (user, bread, qty) VALUES (NEW.user, NEW.bread, NEW.remaining)
+               ON CONFLICT(user, bread) DO UPDATE SET qty=qty+excluded.qty;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_batches_stock_update AFTER UPDATE OF user, bread, remaining ON batches BEGIN
+               UPDATE stock_levels SET qty=qty-OLD.remaining WHERE user=OLD.user AND bread=OLD.bread;
+               INSERT INTO stock_levels (user, bread, qty) VALUES (NEW.user, NEW.bread, NEW.remaining)
+               ON CONFLICT(user, bread) DO UPDATE SET qty=qty+excluded.qty;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_batches_stock_delete AFTER DELETE ON batches BEGIN
+               UPDATE stock_levels SET qty=qty-OLD.remaining WHERE user=OLD.user AND bread=OLD.bread;
+           END""",
+    ]),
+    (7, "外部APIの応答をワーカー間で共有するキャッシュ api_cache", [
+        """CREATE TABLE IF NOT EXISTS api_cache (
+               key TEXT PRIMARY KEY,
+               payload TEXT,
+               ok INTEGER NOT NULL,
+               fetched_at REAL NOT NULL,
+               expires_at REAL NOT NULL,
+               refreshing_until REAL NOT NULL DEFAULT 0
+           )""",
+    ]),
+    (8, "日ごとの天気の記録 weather_daily（予測の説明変数・オフラインのバックテスト用）", [
+        """CREATE TABLE IF NOT EXISTS weather_daily (
+               location TEXT NOT NULL,
+               day TEXT NOT NULL,
+               temp_mean REAL,
+               temp_max REAL,
+               temp_min REAL,
+               precipitation REAL,
+               humidity REAL,
+               PRIMARY KEY (location, day)
+           )""",
+    ]),
+    (9, "バックテストのジョブキュー backtest_jobs（結果はデータバージョンごとのキャッシュを兼ねる）", [
+        """CREATE TABLE IF NOT EXISTS backtest_jobs (
+               id TEXT PRIMARY KEY,
+               user TEXT NOT NULL,
+               params TEXT NOT NULL,
+               data_version INTEGER NOT NULL,
+               status TEXT NOT NULL,
+               progress TEXT NOT NULL DEFAULT '{}',
+               result TEXT,
+               error TEXT,
+               created_at REAL NOT NULL,
+               started_at REAL,
+               finished_at REAL,
+               heartbeat_at REAL
+           )""",
+        """CREATE INDEX IF NOT EXISTS idx_backtest_jobs_key
+           ON backtest_jobs(user, params, data_version, status)""",
+        """CREATE INDEX IF NOT EXISTS idx_backtest_jobs_status
+           ON backtest_jobs(status, created_at)""",
+    ]),
+    (10, "同じ計算を1つのワーカーだけが行うためのロック singleflight_locks と集計 singleflight_stats", [
+        """CREATE TABLE IF NOT EXISTS singleflight_locks (
+               key TEXT PRIMARY KEY,
+               owner TEXT NOT NULL,
+               expires_at REAL NOT NULL
+           )""",
+        """CREATE TABLE IF NOT EXISTS singleflight_stats (
+               name TEXT NOT NULL,
+               outcome TEXT NOT NULL,
+               count INTEGER NOT NULL,
+               PRIMARY KEY (name, outcome)
+           )""",
+    ]),
+]
+
+# 全件走査になってはいけないクエリ（SQL, サンプルのパラメータ）。アプリが実行するSQL文と同じものを並べる
+HOT_QUERIES = [
+    # records: 予測の学習期間・週次集計（forecast.py）
+    ("SELECT day, sold FROM records WHERE user=? AND bread=? AND day>=? ORDER BY day ASC",
+     ("user", "bread", "")),
+    ("SELECT day, bread, sold FROM records WHERE user=? AND day>=? ORDER BY day ASC",
+     ("user", "")),
+    ("""SELECT bread,
+               CAST((julianday(day) - julianday(?)) / 7 AS INTEGER) AS week,
+               (CAST(strftime('%w', day) AS INTEGER) + 6) % 7 AS weekday,
+               SUM(sold) AS sold, COUNT(*) AS n
+        FROM records
+        WHERE user=? AND day>=? AND day<?
+        GROUP BY bread, week, weekday""",
+     ("", "user", "", "day")),
+    # records: 一覧・ページング・エクスポート・更新（forecast.py, stock.py）
+    ("""SELECT id, day, bread, sold, leftover, created_at FROM records
+        WHERE user=? AND day>=? ORDER BY day DESC, created_at DESC""",
+     ("user", "")),
+    ("""SELECT id, day, bread, sold, leftover, created_at FROM records
+        WHERE user=? AND day>=? AND (day, id) < (?, ?) ORDER BY day DESC, id DESC LIMIT ?""",
+     ("user", "", "day", 0, 100)),
+    ("""SELECT id, day, bread, sold, leftover, created_at FROM records
+        WHERE user=? AND day>=? ORDER BY day DESC, id DESC LIMIT ?""",
+     ("user", "", 100)),
+    ("""SELECT id, day, bread, sold, leftover, created_at FROM records
+        WHERE user=? AND day>=? AND day<=? ORDER BY day ASC, id ASC""",
+     ("user", "", "day")),
+    ("SELECT user, day, bread FROM records WHERE id=?",
+     (0,)),
+    ("UPDATE records SET sold=?, leftover=? WHERE id=?",
+     (0, 0, 0)),
+    ("DELETE FROM records WHERE id=?",
+     (0,)),
+    # batches・在庫台帳（forecast.py, stock.py, app.py）
+    ("""SELECT id, qty, added_date, remaining FROM batches
+        WHERE user=? AND bread=? AND remaining > 0 ORDER BY added_date ASC""",
+     ("user", "bread")),
+    ("""SELECT id, bread, qty, added_date, remaining FROM batches
+        WHERE user=? AND remaining > 0 ORDER BY added_date ASC""",
+     ("user",)),
+    ("SELECT bread, qty FROM stock_levels WHERE user=?",
+     ("user",)),
+    ("""SELECT bread, batch_id, qty FROM batch_consumptions
+        WHERE user=? AND day=? AND bread IN (?,?)""",
+     ("user", "day", "bread", "bread")),
+    ("""SELECT id, bread, remaining FROM batches
+        WHERE user=? AND bread IN (?,?) AND added_date>? AND added_date<?
+        ORDER BY added_date ASC, id ASC""",
+     ("user", "bread", "bread", "day", "day")),
+    ("UPDATE batches SET remaining=remaining+? WHERE id=?",
+     (0, 0)),
+    ("DELETE FROM batch_consumptions WHERE user=? AND bread=? AND day=?",
+     ("user", "bread", "day")),
+    ("UPDATE batches SET remaining=0 WHERE added_date<=? AND remaining > 0 RETURNING user",
+     ("day",)),
+    ("DELETE FROM batches WHERE user=? AND bread=? AND added_date=?",
+     ("user", "bread", "day")),
+    # logs（db.py）
+    ("""SELECT id, user, action, detail, created_at FROM logs
+        WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?""",
+     ("created_at", 0, 200)),
+    ("""SELECT id, user, action, detail, created_at FROM logs
+        ORDER BY created_at DESC, id DESC LIMIT ?""",
+     (200,)),
+    # 推奨量・データバージョン・外部APIのキャッシュ（recommendations.py, db.py, api_cache.py）
+    ("SELECT bread, payload, stale FROM recommendations WHERE user=? AND target_date=?",
+     ("user", "day")),
+    ("DELETE FROM recommendations WHERE user=? AND target_date<?",
+     ("user", "day")),
+    ("UPDATE recommendations SET stale=1 WHERE user=?",
+     ("user",)),
+    ("SELECT version FROM data_versions WHERE user=?",
+     ("user",)),
+    ("""SELECT (SELECT version FROM data_versions WHERE user=?) AS version,
+               (SELECT fetched_at FROM api_cache WHERE key=?) AS fetched_at""",
+     ("user", "key")),
+    ("SELECT payload, ok, fetched_at, expires_at FROM api_cache WHERE key=?",
+     ("key",)),
+    ("SELECT expires_at FROM singleflight_locks WHERE key=?",
+     ("key",)),
+    # バックテストのジョブ（backtest_jobs.py）
+    ("""SELECT * FROM backtest_jobs
+        WHERE user=? AND params=? AND data_version=? AND status IN ('queued', 'running', 'done')
+        ORDER BY created_at DESC LIMIT 1""",
+     ("user", "params", 0)),
+    ("SELECT * FROM backtest_jobs WHERE id=? AND user=?",
+     ("id", "user")),
+    ("""SELECT 1 FROM backtest_jobs
+        WHERE status='queued' OR (status='running' AND heartbeat_at<?) LIMIT 1""",
+     (0,)),
+    ("UPDATE backtest_jobs SET status='queued' WHERE status='running' AND heartbeat_at<?",
+     (0,)),
+    ("""UPDATE backtest_jobs SET status='running', started_at=?, heartbeat_at=?
+        WHERE id=(SELECT id FROM backtest_jobs WHERE status='queued' ORDER BY created_at ASC LIMIT 1)
+        RETURNING id, user, params""",
+     (0, 0)),
+    ("DELETE FROM backtest_jobs WHERE status IN ('done', 'failed') AND finished_at<?",
+     (0,)),
+    # 天気の記録（weather_store.py）
+    ("""SELECT day, temp_mean, precipitation FROM weather_daily
+        WHERE location=? AND day>=? AND day<=? ORDER BY day ASC""",
+     ("location", "day", "day")),
+]
+
+# インデックスを使わないテーブル走査（"SCAN records" など）
+_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def _ensure_version_table(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    """)
+
+
+def current_version(db):
+    """適用済みの最新バージョン（未適用なら0）"""
+    _ensure_version_table(db)
+    row = db.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def run_migrations(db):
+    """未適用のマイグレーションを順番に適用し、適用したバージョンのリストを返す"""
+    _ensure_version_table(db)
+    db.commit()
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current_version(db):
+            continue
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # ロック取得までの間に他のワーカーが適用していないか確認
+            if version <= current_version(db):
+                db.rollback()
+                continue
+            for sql in statements:
+                db.execute(sql)
+            db.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.utcnow().isoformat())
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+def check_query_plans(db, queries=HOT_QUERIES):
+    """
+    HOT_QUERIES の実行計画を確認
+
+    Returns:
+        全件走査になっているクエリの (SQL, 実行計画) のリスト（空なら問題なし）
+    """
+    problems = []
+    for sql, params in queries:
+        plan = [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+        if any(_FULL_SCAN.match(detail) for detail in plan):
+            problems.append((" ".join(sql.split()), plan))
+    return problems
+
+
+if __name__ == "__main__":
+    from flask import Flask
+    import db
+
+    if len(sys.argv) > 1:
+        db.DB_PATH = sys.argv[1]
+    conn = sqlite3.connect(db.DB_PATH)
+    before = current_version(conn)
+    # テーブルの作成からマイグレーションまでアプリ起動時と同じ処理を行う
+    db.init_db(Flask(__name__))
+    print(f"スキーマバージョン: {before} → {current_version(conn)}")
+
+    problems = check_query_plans(conn)
+    for sql, plan in problems:
+        print(f"全件走査: {sql}")
+        for detail in plan:
+            print(f"    {detail}")
+    conn.close()
+    if problems:
+        sys.exit(1)
+    print(f"{len(HOT_QUERIES)}件のクエリはすべてインデックスを使用しています")
@@ -0,0 +1,142 @@
+"""
+Holt-Winters モデルキャッシュ
+
+(user, bread) ごとに推定済みの平滑化パラメータと最終状態（水準・傾き・季節）を保持する。
+キャッシュはワーカープロセスごとのLRUで、各エントリはデータのフィンガープリントを持つ。
+- フィンガープリントが一致: 再計算なしで予測値を返す
+- 既存データの末尾に新しい日が追加された: 状態を1日ずつO(1)で更新
+- 過去データが変更された / 更新回数が HW_REOPTIMIZE_EVERY に達した: 再推定
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# キャッシュするモデル数の上限（LRUで破棄）
+MODEL_CACHE_SIZE = int(os.environ.get("MODEL_CACHE_SIZE", 256))
+
+# 何日分の追加データごとにパラメータを再推定するか
+HW_REOPTIMIZE_EVERY = int(os.environ.get("HW_REOPTIMIZE_EVERY", 7))
+
+
+def fingerprint(values):
+    """販売データのフィンガープリントを計算"""
+    arr = np.ascontiguousarray(values, dtype=np.float64)
+    return hashlib.blake2b(arr.tobytes(), digest_size=16).hexdigest()
+
+
+class HWState:
+    """推定済みHolt-Winters（加法トレンド・加法季節）モデルの状態"""
+
+    __slots__ = (
+        "alpha", "beta", "gamma", "level", "trend", "season", "pos",
+        "n_obs", "fingerprint", "lower", "upper", "updates_since_fit", "start_params"
+    )
+
+    def __init__(self, alpha, beta, gamma, level, trend, season,
+                 n_obs, fingerprint, lower=None, upper=None):
+        self.alpha = float(alpha)
+        self.beta = float(beta)
+        self.gamma = float(gamma)
+        self.level = float(level)
+        self.trend = float(trend)
+        # season[pos] が次の日に使う季節成分（リングバッファ）
+        self.season = [float(s) for s in season]
+        self.pos = 0
+        self.n_obs = n_obs
+        self.fingerprint = fingerprint
+        # 推定時の外れ値境界（この範囲外の値は状態更新に使わない）
+        self.lower = lower
+        self.upper = upper
+        self.updates_since_fit = 0
+        # 推定済みパラメータ一式（再推定時のウォームスタート用）
+        self.start_params = None
+
+    @property
+    def seasonal_periods(self):
+        return len(self.season)
+
+    def forecast(self, steps=1):
+        """steps日先の予測値"""
+        m = len(self.season)
+        return self.level + steps * self.trend + self.season[(self.pos + steps - 1) % m]
+
+    def update(self, y):
+        """新しい観測値1件で状態を更新（O(1)）"""
+        if (self.lower is not None and y < self.lower) or (self.upper is not None and y > self.upper):
+            return
+        m = len(self.season)
+        s_old = self.season[self.pos]
+        level = self.alpha * (y - s_old) + (1 - self.alpha) * (self.level + self.trend)
+        trend = self.beta * (level - self.level) + (1 - self.beta) * self.trend
+        self.season[self.pos] = self.gamma * (y - self.level - self.trend) + (1 - self.gamma) * s_old
+        self.pos = (self.pos + 1) % m
+        self.level = level
+        self.trend = trend
+
+    def copy(self):
+        """状態のコピーを作成"""
+        other = HWState.__new__(HWState)
+        for name in HWState.__slots__:
+            setattr(other, name, getattr(self, name))
+        other.season = list(self.season)
+        return other
+
+    def advance(self, values):
+        """
+        valuesが推定済みデータの末尾に日を追加したものであれば、
+        新しい日の分だけ状態を進めた新しい状態を返す（それ以外はNone）
+        """
+        if len(values) <= self.n_obs:
+            return None
+        if fingerprint(values[:self.n_obs]) != self.fingerprint:
+            return None
+
+        state = self.copy()
+        for y in values[self.n_obs:]:
+            state.update(float(y))
+        state.updates_since_fit += len(values) - self.n_obs
+        state.n_obs = len(values)
+        state.fingerprint = fingerprint(values)
+        return state
+
+
+class ModelCache:
+    """(user, bread) をキーとするHolt-Wintersモデル状態のLRUキャッシュ"""
+
+    def __init__(self, maxsize=MODEL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            state = self._data.get(key)
+            if state is not None:
+                self._data.move_to_end(key)
+            return state
+
+    def put(self, key, state):
+        with self._lock:
+            self._data[key] = state
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user=None):
+        """キャッシュを破棄（userを指定した場合はそのユーザーのみ）"""
+        with self._lock:
+            if user is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if k[0] == user]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ワーカープロセス内で共有するキャッシュ
+MODEL_CACHE = ModelCache()
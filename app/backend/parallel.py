@@ -0,0 +1,99 @@
+"""
+パンごとの予測・バックテスト処理の並列実行
+
+FORECAST_EXECUTION=process の場合、ワーカープロセスごとに1つのプロセスプールを作成し、
+ワーカーが終了するまで使い回す。タスクはDBにアクセスしない純粋な関数として実行される。
+プール障害の場合は同じ関数を直列で実行する。全体の期限までに終わらなかったタスクは打ち切り、
+呼び出し側が渡した代わりの結果（fallback）を使う（遅いときに同じ計算をもう一度行わないため）。
+"""
+import os
+import math
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# 実行モード（serial / process）
+FORECAST_EXECUTION = os.environ.get("FORECAST_EXECUTION", "serial")
+
+# プロセスプールのワーカー数
+FORECAST_WORKERS = int(os.environ.get("FORECAST_WORKERS", min(4, os.cpu_count() or 1)))
+
+# 1タスクあたりのタイムアウト（秒）。run_tasks 全体の期限はワーカー数で割り振った分になる
+FORECAST_TASK_TIMEOUT = float(os.environ.get("FORECAST_TASK_TIMEOUT", 30))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """このプロセス用のプロセスプールを取得（fork後は作り直す）"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # スレッドを持つ親プロセスからforkしないようforkserverを使う
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(
+                max_workers=FORECAST_WORKERS,
+                mp_context=multiprocessing.get_context(method)
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def shutdown_pool():
+    """プロセスプールを停止"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _pool_pid = None
+
+
+atexit.register(shutdown_pool)
+
+
+def run_tasks(func, args_list, mode=None, fallback=None):
+    """
+    func(*args) を args_list の各要素について実行し、結果を同じ順序で返す
+
+    mode: "serial" または "process"（省略時は FORECAST_EXECUTION）
+    fallback: 期限までに終わらなかったタスクの結果を返す関数 fallback(*args)
+              （省略時は func を直列で実行する）
+    """
+    mode = mode or FORECAST_EXECUTION
+    if mode != "process" or len(args_list) <= 1:
+        return [func(*args) for args in args_list]
+
+    try:
+        pool = get_pool()
+        futures = [pool.submit(func, *args) for args in args_list]
+    except (BrokenProcessPool, RuntimeError) as e:
+        logger.error(f"Process pool unavailable, running serially: {e}")
+        shutdown_pool()
+        return [func(*args) for args in args_list]
+
+    # 全タスクで1つの期限（タスクごとに待つと最大でタスク数 × タイムアウトになる）
+    rounds = math.ceil(len(futures) / max(FORECAST_WORKERS, 1))
+    _, not_done = wait(futures, timeout=FORECAST_TASK_TIMEOUT * rounds)
+
+    results = []
+    for future, args in zip(futures, args_list):
+        if future in not_done:
+            future.cancel()
+            logger.error(f"{func.__name__} timed out after {FORECAST_TASK_TIMEOUT * rounds}s, using fallback")
+            results.append((fallback or func)(*args))
+            continue
+        try:
+            results.append(future.result())
+        except BrokenProcessPool as e:
+            logger.error(f"Process pool broken, running serially: {e}")
+            shutdown_pool()
+            results.append(func(*args))
+    return results
@@ -0,0 +1,145 @@
+"""
+本番環境のリクエストのサンプリングプロファイラー
+
+対象のリクエストの処理中、別スレッドが PROFILE_INTERVAL 秒ごとに処理スレッドのスタックを
+sys._current_frames() で読み取り、同じスタックの出現回数を数える。結果は flamegraph.pl や
+speedscope でそのまま読める collapsed 形式（"関数;関数;関数 回数" の行）で PROFILE_DIR に保存し、
+PROFILE_MAX_FILES 件を超えたら古いものから削除する（全ワーカー共通のリングバッファ）。
+
+対象にするリクエスト:
+    - ヘッダー X-Profile に管理者パスワードを指定したもの（アクセスログ・ブラウザの履歴に
+      残らないよう、クエリ文字列では受け付けない）
+    - PROFILE_SAMPLE_RATE の割合でランダムに選んだもの（既定は0で無効）
+どちらにも当たらないリクエストではヘッダーを1つ確認するだけで、スレッドは作らない。
+"""
+import os
+import re
+import sys
+import time
+import random
+import threading
+import tempfile
+from collections import Counter
+
+# ランダムにプロファイルするリクエストの割合（0〜1）
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+
+# スタックを読み取る間隔（秒）
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+
+# プロファイルの保存先と保存件数
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "panzaiko-profiles"))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 50))
+
+PROFILE_SUFFIX = ".collapsed"
+
+# 保存するファイル名: <時刻>_<pid>_<ルート>_<処理時間ms>.collapsed
+_NAME = re.compile(r"^(\d+)_(\d+)_([\w.-]*)_(\d+)\.collapsed$")
+
+
+def requested(request, admin_password):
+    """このリクエストをプロファイルするか"""
+    token = request.headers.get("X-Profile")
+    if token is not None:
+        return token == admin_password
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """1つのスレッドのスタックを一定間隔で読み取る"""
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """collapsed 形式のテキスト"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def save(sampler, route):
+    """プロファイルをリングバッファに保存（保存したファイル名を返す）"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    label = re.sub(r"[^\w.-]+", "-", route).strip("-") or "root"
+    name = f"{time.time_ns()}_{os.getpid()}_{label}_{int(sampler.elapsed * 1000)}{PROFILE_SUFFIX}"
+    path = os.path.join(PROFILE_DIR, name)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(sampler.collapsed())
+    os.replace(tmp, path)
+
+    # 古いものから削除して PROFILE_MAX_FILES 件に保つ
+    names = sorted(n for n in os.listdir(PROFILE_DIR) if _NAME.match(n))
+    for old in names[:max(0, len(names) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, old))
+        except OSError:
+            pass
+    return name
+
+
+def list_profiles():
+    """保存済みのプロファイルの一覧（新しい順）"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        m = _NAME.match(name)
+        if not m:
+            continue
+        try:
+            size = os.path.getsize(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            continue
+        profiles.append({
+            "name": name,
+            "created_at": int(m.group(1)) / 1e9,
+            "pid": int(m.group(2)),
+            "route": m.group(3),
+            "duration_ms": int(m.group(4)),
+            "size": size
+        })
+    return profiles
+
+
+def read_profile(name):
+    """保存済みのプロファイルの内容（ファイル名が不正・存在しない場合はNone）"""
+    if not _NAME.match(name):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
@@ -0,0 +1,106 @@
+"""
+リクエストごとのSQL文の数え上げ（デバッグ・テスト用）
+
+QUERY_COUNT=true の場合、リクエストを処理するスレッドで実行したSQL文を数え、
+応答に X-Query-Count ヘッダーを付ける。同じ形のSQL文が QUERY_DUPLICATE_THRESHOLD 回以上
+実行された場合は、ループ内のクエリ（N+1）の可能性があるとしてログに出す。
+executemany は1文として数え、接続時の PRAGMA は数えない。
+
+関数単位で確認する場合:
+    with query_counter.budget(3):
+        compute_recs(user)
+"""
+import os
+import logging
+import threading
+from collections import Counter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# リクエストごとに数えるか
+QUERY_COUNT_ENABLED = os.environ.get("QUERY_COUNT", "false").lower() == "true"
+
+# 同じ形の文がこの回数以上実行されたらログに出す
+QUERY_DUPLICATE_THRESHOLD = int(os.environ.get("QUERY_DUPLICATE_THRESHOLD", 3))
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """budget() の上限を超えてSQL文を実行した"""
+
+
+def _record(sql):
+    counter = getattr(_local, "counter", None)
+    if counter is None:
+        return
+    shape = metrics.statement_shape(sql)
+    if not shape.upper().startswith("PRAGMA"):
+        counter[shape] += 1
+
+
+def start():
+    """このスレッドで数え始める"""
+    metrics.add_statement_hook(_record)
+    _local.counter = Counter()
+
+
+def stop():
+    """数えるのをやめて、文の形ごとの回数を返す"""
+    counter = getattr(_local, "counter", None)
+    _local.counter = None
+    return counter or Counter()
+
+
+def duplicates(counter, threshold=QUERY_DUPLICATE_THRESHOLD):
+    """threshold 回以上実行された文の形と回数"""
+    return [(shape, n) for shape, n in counter.most_common() if n >= threshold]
+
+
+class budget:
+    """with budget(n): の中でSQL文が n を超えたら QueryBudgetExceeded"""
+
+    def __init__(self, limit):
+        self.limit = limit
+
+    def __enter__(self):
+        self._outer = getattr(_local, "counter", None)
+        start()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.counter = stop()
+        # 外側で数えている場合はその回数にも加える
+        if self._outer is not None:
+            self._outer.update(self.counter)
+            _local.counter = self._outer
+        self.count = sum(self.counter.values())
+        if exc_type is None and self.count > self.limit:
+            detail = "\n".join(f"  {n} × {shape}" for shape, n in self.counter.most_common())
+            raise QueryBudgetExceeded(f"SQL文 {self.count} 件（上限 {self.limit} 件）\n{detail}")
+        return False
+
+
+def install(app):
+    """リクエストごとに数え、X-Query-Count ヘッダーを付ける（接続を作る前に呼ぶ）"""
+    metrics.add_statement_hook(_record)
+
+    @app.before_request
+    def start_query_count():
+        start()
+
+    @app.after_request
+    def add_query_count(response):
+        counter = getattr(_local, "counter", None)
+        if counter is None:
+            return response
+        response.headers["X-Query-Count"] = str(sum(counter.values()))
+        for shape, n in duplicates(counter):
+            logger.warning(f"{n} × same statement in one request (possible N+1): {shape}")
+        return response
+
+    @app.teardown_request
+    def stop_query_count(error=None):
+        stop()
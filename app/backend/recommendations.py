@@ -0,0 +1,147 @@
+"""
+注文推奨量の保存・読み込み
+
+compute_recs の結果を recommendations テーブルに (user, bread, target_date) ごとに保存し、
+/api/dashboard はこれを読むだけにする。データが書き込まれると行を stale にして
+バックグラウンドで再計算し、日付が変わったら日次ジョブで全ユーザー分を計算し直す。
+行がない（または古い）場合だけリクエスト内で同期的に計算する。
+"""
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+
+from db import get_db, get_read_db, get_data_version, bump_data_version, bump_all_data_versions
+from forecast import compute_recs, BREADS
+import scheduler
+import singleflight
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _target_date():
+    """推奨量の対象日（明日）"""
+    return (date.today() + timedelta(days=1)).isoformat()
+
+
+def load_recommendations(user, target_date=None):
+    """保存済みの推奨量を取得（全種類そろっていない・古い場合はNone）"""
+    db = get_read_db()
+    rows = db.execute(
+        """SELECT bread, payload, stale FROM recommendations
+           WHERE user=? AND target_date=?""",
+        (user, target_date or _target_date())
+    ).fetchall()
+
+    recs = {row["bread"]: json.loads(row["payload"]) for row in rows if not row["stale"]}
+    if any(bread not in recs for bread in BREADS):
+        return None
+    return {bread: recs[bread] for bread in BREADS}
+
+
+def store_recommendations(user, recs, data_version, target_date=None):
+    """
+    推奨量を保存
+
+    計算中に新しい書き込みがあった場合（data_versionが古い場合）はstaleとして保存する。
+    """
+    db = get_db()
+    target_date = target_date or _target_date()
+    now = datetime.utcnow().isoformat()
+
+    db.execute("DELETE FROM recommendations WHERE user=? AND target_date<?", (user, target_date))
+    db.executemany(
+        """INSERT OR REPLACE INTO recommendations
+           (user, bread, target_date, payload, data_version, stale, computed_at)
+           VALUES (?, ?, ?, ?, ?,
+                   COALESCE((SELECT version FROM data_versions WHERE user=?), 0) != ?, ?)""",
+        [
+            (user, bread, target_date, json.dumps(rec, ensure_ascii=False),
+             data_version, user, data_version, now)
+            for bread, rec in recs.items()
+        ]
+    )
+    db.commit()
+
+
+def refresh_recommendations(user):
+    """推奨量を計算して保存"""
+    data_version = get_data_version(user)
+    recs = compute_recs(user)
+    store_recommendations(user, recs, data_version)
+    return recs
+
+
+def refresh_once(user):
+    """
+    推奨量を計算して保存（同じデータバージョンの計算が他のワーカーで実行中なら、その結果を待って使う）
+    """
+    key = f"recs:{user}:{get_data_version(user)}:{_target_date()}"
+
+    def load():
+        recs = load_recommendations(user)
+        return recs if recs is not None else singleflight.MISSING
+
+    return singleflight.run(key, lambda: refresh_recommendations(user), load, name="recommendations")
+
+
+def get_recommendations(user):
+    """推奨量を取得（保存済みがなければその場で計算して保存）"""
+    recs = load_recommendations(user)
+    if recs is None:
+        recs = refresh_once(user)
+    return recs
+
+
+def mark_stale(user, commit=True):
+    """書き込み後に呼ぶ: データバージョンを進め、保存済みの推奨量をstaleにする"""
+    db = get_db()
+    bump_data_version(user, commit=False)
+    db.execute("UPDATE recommendations SET stale=1 WHERE user=?", (user,))
+    if commit:
+        db.commit()
+
+
+def _get_executor():
+    """バックグラウンド再計算用のスレッド（ワーカープロセスごと）"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recs-refresh")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _refresh_in_background(app, user):
+    try:
+        with app.app_context():
+            refresh_once(user)
+    except Exception as e:
+        logger.error(f"Background recommendation refresh failed for {user}: {e}")
+
+
+def schedule_refresh(user):
+    """推奨量の再計算をバックグラウンドで実行"""
+    app = current_app._get_current_object()
+    _get_executor().submit(_refresh_in_background, app, user)
+
+
+def refresh_all_users():
+    """全ユーザーの推奨量を計算し直す（日次ジョブ）"""
+    db = get_read_db()
+    users = [row["user"] for row in db.execute("SELECT DISTINCT user FROM records").fetchall()]
+    for user in users:
+        refresh_once(user)
+
+
+# 日付が変わると表示内容（明日の推奨量・バッチの残り日数）が変わるため、先にバージョンを進める
+scheduler.register_daily_job("bump_data_versions", bump_all_data_versions, order=0)
+scheduler.register_daily_job("refresh_recommendations", refresh_all_users)
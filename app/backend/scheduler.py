@@ -0,0 +1,77 @@
+"""
+日次バックグラウンドジョブ
+
+ワーカープロセスごとにスレッドを1つ起動し、日付が変わるたびに登録済みのジョブを実行する。
+job_runs テーブルに (ジョブ名, 日付) を登録できたワーカーだけが実行するため、
+複数のgunicornワーカーがいても各ジョブは1日1回だけ動く。
+"""
+import os
+import time
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+from db import get_db
+
+logger = logging.getLogger(__name__)
+
+# 日付が変わってからジョブを実行するまでの待ち時間（秒）
+DAILY_JOB_DELAY = int(os.environ.get("DAILY_JOB_DELAY", 60))
+
+_jobs = []
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def register_daily_job(name, func, order=100):
+    """
+    日次ジョブを登録（funcはアプリケーションコンテキスト内で引数なしで呼ばれる）
+
+    order: 実行順（小さい順、同じ値なら登録順）
+    """
+    _jobs.append((order, len(_jobs), name, func))
+    _jobs.sort()
+
+
+def _claim(name, day):
+    """このワーカーが (name, day) のジョブを実行する権利を取得"""
+    db = get_db()
+    cur = db.execute(
+        "INSERT OR IGNORE INTO job_runs (name, day, started_at) VALUES (?, ?, ?)",
+        (name, day.isoformat(), datetime.utcnow().isoformat())
+    )
+    db.commit()
+    return cur.rowcount == 1
+
+
+def run_daily_jobs(app, day=None):
+    """まだ実行されていない今日のジョブを実行"""
+    day = day or date.today()
+    for _, _, name, func in _jobs:
+        try:
+            with app.app_context():
+                if _claim(name, day):
+                    func()
+        except Exception as e:
+            logger.error(f"Daily job {name} failed: {e}")
+
+
+def _loop(app):
+    while True:
+        run_daily_jobs(app)
+        now = datetime.now()
+        next_run = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        time.sleep((next_run - now).total_seconds() + DAILY_JOB_DELAY)
+
+
+def ensure_started(app):
+    """このワーカープロセスで日次ジョブのスレッドを起動（fork後の最初のリクエストで呼ぶ）"""
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        thread = threading.Thread(target=_loop, args=(app,), name="daily-jobs", daemon=True)
+        thread.start()
@@ -0,0 +1,127 @@
+"""
+同じ計算の重複実行の防止（シングルフライト、全ワーカー共通）
+
+同じキーの計算が複数のワーカー・スレッドで同時に必要になった場合、singleflight_locks に
+行を登録できた1つだけが計算し、他は結果が保存されるのを待ってそれを使う。
+計算中のワーカーが落ちた場合はロックの期限（SINGLEFLIGHT_LEASE 秒）が切れた後に別のワーカーが取り直し、
+SINGLEFLIGHT_WAIT 秒待っても結果が出なければ待っていた側も自分で計算する。
+
+計算した回数（computed）・他の計算結果を使った回数（coalesced）・待ちきれずに計算した回数（timeout）を
+singleflight_stats に名前ごとに記録する。
+"""
+import os
+import time
+import logging
+import threading
+
+from db import get_db, get_read_db
+
+logger = logging.getLogger(__name__)
+
+# ロックの有効期間（秒）。この間に計算が終わらなければ他のワーカーが取り直す
+SINGLEFLIGHT_LEASE = float(os.environ.get("SINGLEFLIGHT_LEASE", 60))
+
+# 他のワーカーの計算結果を待つ最大時間（秒）
+SINGLEFLIGHT_WAIT = float(os.environ.get("SINGLEFLIGHT_WAIT", 15))
+
+# 結果を確認する間隔（秒）
+SINGLEFLIGHT_POLL = float(os.environ.get("SINGLEFLIGHT_POLL", 0.05))
+
+# load() が「まだ結果がない」ことを表す値
+MISSING = object()
+
+
+def _owner():
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+def _acquire(key, owner):
+    """ロックを取得（他の所有者の有効なロックがあればFalse）"""
+    db = get_db()
+    now = time.time()
+    cur = db.execute(
+        """INSERT INTO singleflight_locks (key, owner, expires_at) VALUES (?, ?, ?)
+           ON CONFLICT(key) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+           WHERE singleflight_locks.expires_at<?""",
+        (key, owner, now + SINGLEFLIGHT_LEASE, now)
+    )
+    db.commit()
+    return cur.rowcount == 1
+
+
+def _release(key, owner):
+    db = get_db()
+    db.execute("DELETE FROM singleflight_locks WHERE key=? AND owner=?", (key, owner))
+    db.commit()
+
+
+def _locked(key):
+    row = get_read_db().execute(
+        "SELECT expires_at FROM singleflight_locks WHERE key=?", (key,)
+    ).fetchone()
+    return row is not None and row["expires_at"] > time.time()
+
+
+def _count(name, outcome):
+    db = get_db()
+    db.execute(
+        """INSERT INTO singleflight_stats (name, outcome, count) VALUES (?, ?, 1)
+           ON CONFLICT(name, outcome) DO UPDATE SET count=count+1""",
+        (name, outcome)
+    )
+    db.commit()
+
+
+def run(key, compute, load, name="default"):
+    """
+    key の計算を全ワーカーで1回だけ行う
+
+    compute: 計算して結果を保存し、結果を返す関数
+    load: 保存済みの結果を返す関数（まだなければ MISSING）
+
+    Returns:
+        計算結果（他のワーカーが計算した場合は load() の結果）
+    """
+    owner = _owner()
+    deadline = time.monotonic() + SINGLEFLIGHT_WAIT
+    while True:
+        if _acquire(key, owner):
+            try:
+                # ロックを取る直前に他のワーカーが計算を終えていれば、その結果を使う
+                value = load()
+                if value is MISSING:
+                    value = compute()
+                    outcome = "computed"
+                else:
+                    outcome = "coalesced"
+            finally:
+                _release(key, owner)
+            _count(name, outcome)
+            return value
+
+        # 他のワーカーが計算中: 結果が保存されるか、ロックが外れるまで待つ
+        while _locked(key) and time.monotonic() < deadline:
+            time.sleep(SINGLEFLIGHT_POLL)
+            value = load()
+            if value is not MISSING:
+                _count(name, "coalesced")
+                return value
+
+        value = load()
+        if value is not MISSING:
+            _count(name, "coalesced")
+            return value
+        if time.monotonic() >= deadline:
+            logger.warning(f"Single-flight wait for {key} timed out, computing locally")
+            value = compute()
+            _count(name, "timeout")
+            return value
+        # 計算が失敗してロックだけ外れた場合は、自分がロックを取って計算する
+
+
+def get_stats():
+    """名前ごとの computed / coalesced / timeout の回数"""
+    stats = {}
+    for row in get_read_db().execute("SELECT name, outcome, count FROM singleflight_stats").fetchall():
+        stats.setdefault(row["name"], {"computed": 0, "coalesced": 0, "timeout": 0})[row["outcome"]] = row["count"]
+    return stats
@@ -0,0 +1,126 @@
+"""
+在庫バッチのFIFO消費と期限切れバッチの退役
+
+販売数を記録すると、前日までに残ったバッチ（賞味期限内のもの）から古い順に販売数を差し引く。
+どのバッチから何個差し引いたかを batch_consumptions に記録しておき、同じ日のデータを
+入力し直した場合は一度元に戻してから差し引き直すため、何度入力しても結果は同じになる。
+パンごとの在庫合計は batches のトリガーが stock_levels に同じトランザクション内で反映する。
+"""
+from datetime import date
+
+from db import get_db
+from forecast import expired_through
+import recommendations
+import scheduler
+
+
+def _placeholders(values):
+    return ",".join("?" * len(values))
+
+
+def record_sales(user, day, sales):
+    """
+    1日分の販売数を在庫に反映（コミットは呼び出し側で行う）
+
+    前回の入力で差し引いた分を戻してから、day より前に追加された賞味期限内のバッチから
+    古い順に販売数を差し引く。全パン分の消費記録・バッチを1回ずつ読み、割り当てはPythonで行い、
+    書き込みは表ごとに1回の executemany で行う（パンの数によらずSQL文の数は一定）。
+    在庫が足りない分は当日焼いたパンの販売とみなす。
+
+    sales: {bread: 販売数}
+
+    Returns:
+        {bread: 実際に差し引いた個数}
+    """
+    breads = list(sales)
+    if not breads:
+        return {}
+    db = get_db()
+
+    # 前回の入力で差し引いた分
+    previous = db.execute(
+        f"""SELECT bread, batch_id, qty FROM batch_consumptions
+            WHERE user=? AND day=? AND bread IN ({_placeholders(breads)})""",
+        (user, day, *breads)
+    ).fetchall()
+    delta = {}
+    for row in previous:
+        delta[row["batch_id"]] = delta.get(row["batch_id"], 0) + row["qty"]
+
+    # 賞味期限内のバッチ（前回の分を戻した後の残数で割り当てる）
+    expired_before = expired_through(date.fromisoformat(day)).isoformat()
+    open_batches = {bread: [] for bread in breads}
+    for row in db.execute(
+        f"""SELECT id, bread, remaining FROM batches
+            WHERE user=? AND bread IN ({_placeholders(breads)}) AND added_date>? AND added_date<?
+            ORDER BY added_date ASC, id ASC""",
+        (user, *breads, expired_before, day)
+    ).fetchall():
+        open_batches[row["bread"]].append((row["id"], row["remaining"] + delta.get(row["id"], 0)))
+
+    consumed = {}
+    taken = []
+    for bread in breads:
+        left = max(sales[bread], 0)
+        for batch_id, remaining in open_batches[bread]:
+            if left <= 0:
+                break
+            n = min(left, remaining)
+            if n <= 0:
+                continue
+            taken.append((user, bread, day, batch_id, n))
+            delta[batch_id] = delta.get(batch_id, 0) - n
+            left -= n
+        consumed[bread] = max(sales[bread], 0) - left
+
+    db.executemany(
+        "UPDATE batches SET remaining=remaining+? WHERE id=?",
+        [(d, batch_id) for batch_id, d in delta.items() if d]
+    )
+    db.executemany(
+        "DELETE FROM batch_consumptions WHERE user=? AND bread=? AND day=?",
+        [(user, bread, day) for bread in {row["bread"] for row in previous}]
+    )
+    db.executemany(
+        "INSERT INTO batch_consumptions (user, bread, day, batch_id, qty) VALUES (?, ?, ?, ?, ?)",
+        taken
+    )
+    return consumed
+
+
+def sync_record(record_id, sold=None):
+    """
+    レコードの更新・削除を在庫に反映（当日のレコードのみ、コミットは呼び出し側で行う）
+
+    sold: 更新後の販売数（削除の場合はNone）
+    """
+    db = get_db()
+    row = db.execute("SELECT user, day, bread FROM records WHERE id=?", (record_id,)).fetchone()
+    if row is None or row["day"] != date.today().isoformat():
+        return
+    record_sales(row["user"], row["day"], {row["bread"]: sold or 0})
+
+
+def expire_batches(today=None):
+    """
+    賞味期限（SHELF_DAYS日）を過ぎたバッチの残数を0にする（日次ジョブ）
+
+    Returns:
+        退役させたバッチのあったユーザーのリスト
+    """
+    db = get_db()
+    cutoff = expired_through(today or date.today()).isoformat()
+    # 残数のあるバッチの部分インデックス（idx_batches_open_date）で対象だけを更新し、ユーザーを受け取る
+    users = sorted({
+        row["user"] for row in db.execute(
+            "UPDATE batches SET remaining=0 WHERE added_date<=? AND remaining > 0 RETURNING user", (cutoff,)
+        ).fetchall()
+    })
+    for user in users:
+        recommendations.mark_stale(user, commit=False)
+    db.commit()
+    return users
+
+
+# 推奨量の再計算より先に実行する
+scheduler.register_daily_job("expire_batches", expire_batches, order=10)
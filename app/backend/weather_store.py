@@ -0,0 +1,176 @@
+"""
+日ごとの天気の記録（予測の説明変数）
+
+過去の天気をCSV/JSONのアーカイブから weather_daily テーブルに取り込み、
+販売データの日付配列に合わせて1回のクエリで引けるようにする。
+バックテストは外部APIを呼ばずに、販売データと同じ長さの配列として天気を使える。
+
+コマンドラインから取り込める:
+    python weather_store.py kobe_2024.csv [--location kobe] [--format csv|json] [--db breads_full.db]
+
+ファイルの列: day（YYYY-MM-DD）, temp_mean, temp_max, temp_min, precipitation, humidity
+（location 列があればその地点、なければ --location の地点として取り込む）
+"""
+import os
+import sys
+import json
+import argparse
+from datetime import date
+
+import numpy as np
+
+from db import get_db, get_read_db
+
+# 既定の地点（販売店の所在地）
+WEATHER_LOCATION = os.environ.get("WEATHER_LOCATION", "kobe")
+
+# weather_daily の値の列
+WEATHER_COLUMNS = ("temp_mean", "temp_max", "temp_min", "precipitation", "humidity")
+
+# 予測・バックテストで説明変数として使う列
+WEATHER_FEATURES = tuple(
+    c.strip() for c in os.environ.get("WEATHER_FEATURES", "temp_mean,precipitation").split(",")
+    if c.strip() in WEATHER_COLUMNS
+)
+
+# 1トランザクションで書き込む行数
+WEATHER_IMPORT_CHUNK_SIZE = 5000
+
+UPSERT_SQL = f"""INSERT INTO weather_daily (location, day, {", ".join(WEATHER_COLUMNS)})
+                 VALUES (?, ?, {", ".join("?" for _ in WEATHER_COLUMNS)})
+                 ON CONFLICT(location, day) DO UPDATE SET
+                 {", ".join(f"{c}=excluded.{c}" for c in WEATHER_COLUMNS)}"""
+
+
+def _value(value, name):
+    """数値の列を変換（空欄はNone）"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{name}が数値ではありません")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name}が数値ではありません")
+
+
+def validate_row(row, location=WEATHER_LOCATION):
+    """
+    1行を検証して (location, day, temp_mean, ...) に変換
+
+    Raises:
+        ValueError: 不正な行
+    """
+    if not isinstance(row, dict):
+        raise ValueError("行の形式が不正です")
+    try:
+        day = date.fromisoformat(str(row.get("day", ""))).isoformat()
+    except ValueError:
+        raise ValueError("日付が不正です")
+    location = row.get("location") or location
+    return (location, day, *(_value(row.get(c), c) for c in WEATHER_COLUMNS))
+
+
+def import_rows(rows, location=WEATHER_LOCATION, chunk_size=WEATHER_IMPORT_CHUNK_SIZE):
+    """
+    天気の行を weather_daily に書き込む（同じ地点・日付は上書き）
+
+    Returns:
+        {"imported": 件数, "rejected": 件数, "errors": [{"row": 行番号, "error": エラー内容}, ...]}
+        （エラーの形式・件数の上限は販売データの取り込み（ingest.py）と同じ）
+    """
+    # ingest は forecast 経由でこのモジュールを読み込むため、ここで読み込む
+    from ingest import reject_row
+
+    db = get_db()
+    result = {"imported": 0, "rejected": 0, "errors": []}
+    chunk = []
+
+    def flush():
+        db.executemany(UPSERT_SQL, chunk)
+        db.commit()
+        result["imported"] += len(chunk)
+        chunk.clear()
+
+    for line, row in enumerate(rows, start=1):
+        try:
+            chunk.append(validate_row(row, location))
+        except ValueError as e:
+            reject_row(result, line, e)
+            continue
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return result
+
+
+def lookup(days, columns=WEATHER_FEATURES, location=WEATHER_LOCATION, db=None):
+    """
+    日付の配列に対応する天気を取得
+
+    days: 日付の配列（datetime64[D]、販売データの配列と同じ並び）
+    db: 使用する接続（省略時はリクエストの読み取り用接続。row_factory は sqlite3.Row）
+
+    Returns:
+        (len(days), len(columns)) の配列（記録のない日はNaN）
+    """
+    columns = [c for c in columns if c in WEATHER_COLUMNS]
+    days = np.asarray(days, dtype="datetime64[D]")
+    values = np.full((len(days), len(columns)), np.nan)
+    if len(days) == 0 or not columns:
+        return values
+
+    rows = (db or get_read_db()).execute(
+        f"""SELECT day, {", ".join(columns)} FROM weather_daily
+            WHERE location=? AND day>=? AND day<=? ORDER BY day ASC""",
+        (location, str(days.min()), str(days.max()))
+    ).fetchall()
+    if not rows:
+        return values
+
+    stored_days = np.array([row["day"] for row in rows], dtype="datetime64[D]")
+    stored = np.array([[row[c] for c in columns] for row in rows], dtype=float)
+
+    # 日付の位置を二分探索で求め、記録のある日だけ値を入れる
+    pos = np.clip(np.searchsorted(stored_days, days), 0, len(stored_days) - 1)
+    found = stored_days[pos] == days
+    values[found] = stored[pos[found]]
+    return values
+
+
+def main():
+    from flask import Flask
+    import db
+    from ingest import read_csv, read_json
+
+    parser = argparse.ArgumentParser(description="天気の記録の取り込み")
+    parser.add_argument("file", help="CSVまたはJSONファイル（-で標準入力）")
+    parser.add_argument("--location", default=WEATHER_LOCATION, help="location列がない行の地点")
+    parser.add_argument("--format", choices=("csv", "json"), help="省略時は拡張子から判断")
+    parser.add_argument("--db", help="データベースファイル（省略時はDB_PATH）")
+    args = parser.parse_args()
+
+    if args.db:
+        db.DB_PATH = args.db
+    fmt = args.format or ("json" if args.file.endswith(".json") else "csv")
+
+    app = Flask(__name__)
+    db.init_db(app)
+    app.teardown_appcontext(db.close_db)
+    stream = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    try:
+        with app.app_context():
+            rows = read_csv(stream) if fmt == "csv" else read_json(json.load(stream))
+            result = import_rows(rows, location=args.location)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if result["rejected"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,12 +9,28 @@ export default function Debug({ user }) {
   const runBacktest = async () => {
     setLoading(true);
     try {
-      const res = await fetch("/api/backtest");
+      // ジョブとして登録し、完了するまで進捗を確認する（同じ条件の結果があればすぐに完了済みのジョブが返る）
+      const res = await fetch("/api/backtest", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({})
+      });
       const data = await res.json();
-      if (data.success) {
-        setBacktestResults(data.results);
-      } else {
+      if (!data.success) {
         alert("バックテストに失敗しました");
+        return;
+      }
+      let job = data.job;
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const jobRes = await fetch(`/api/backtest/${data.job_id}`);
+        job = (await jobRes.json()).job;
+      }
+      if (job.results) {
+        setBacktestResults(job.results);
+      }
+      if (job.status === "failed") {
+        alert(job.error || "バックテストに失敗しました");
       }
     } catch (err) {
       alert("エラーが発生しました");
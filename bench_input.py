@@ -0,0 +1,135 @@
+"""
+/api/input の書き込みベンチマーク
+
+複数のプロセスから同時に /api/input を送り、1リクエストあたりのSQL文の数と
+レイテンシ（p50 / p95 / 最大）、全体のスループットを計測する。
+SQL文の数は各接続の set_trace_callback で数える（接続時のPRAGMAは除く）。
+
+使い方:
+    python bench_input.py [--writers 4] [--requests 200]
+
+DBは一時ディレクトリにコピーしたものを使うため、breads_full.db は変更されない。
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(ROOT, 'app', 'backend')
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def writer(db_path, index, requests, start, out):
+    """1つの書き込みプロセス: 自分のユーザーで requests 回 /api/input を送る"""
+    os.environ['DB_PATH'] = db_path
+    sys.path.insert(0, BACKEND)
+    os.chdir(BACKEND)
+
+    import threading
+    import db
+    statements = []
+    connect = db.connect
+    main_thread = threading.get_ident()
+
+    def record(sql):
+        # 推奨量のバックグラウンド再計算などリクエスト以外のスレッドの文は数えない
+        if threading.get_ident() == main_thread:
+            statements.append(sql)
+
+    def traced(readonly=False):
+        conn = connect(readonly)
+        conn.set_trace_callback(record)
+        return conn
+
+    db.connect = traced
+
+    from app import app
+    client = app.test_client()
+    user = f'bench-writer-{index}'
+    client.post('/api/login', json={'username': user})
+    today = date.today().isoformat()
+    breads = ['細パン', '太パン', 'サンドパン', 'バゲット']
+
+    start.wait()
+    latencies = []
+    counts = Counter()
+    for i in range(requests):
+        payload = {'date': today}
+        for j, bread in enumerate(breads):
+            payload[bread] = {'purchased': 10 + (i + j) % 7, 'leftover': (i + j) % 3}
+        del statements[:]
+        t0 = time.perf_counter()
+        res = client.post('/api/input', json=payload)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if res.status_code != 200:
+            counts['errors'] += 1
+        for sql in statements:
+            if not sql.startswith('PRAGMA'):
+                counts[sql.split()[0].upper()] += 1
+    db.flush_logs()
+    out.put((latencies, counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='/api/input の書き込みベンチマーク')
+    parser.add_argument('--writers', type=int, default=4, help='同時に書き込むプロセス数')
+    parser.add_argument('--requests', type=int, default=200, help='プロセスごとのリクエスト数')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'breads_full.db')
+    shutil.copy(os.path.join(ROOT, 'breads_full.db'), db_path)
+
+    # 書き込みと並行して動く推奨量の再計算を軽くする
+    os.environ.setdefault('FORECAST_ENGINE', 'numpy')
+
+    ctx = multiprocessing.get_context('fork')
+    start = ctx.Event()
+    out = ctx.Queue()
+    procs = [
+        ctx.Process(target=writer, args=(db_path, i, args.requests, start, out))
+        for i in range(args.writers)
+    ]
+    try:
+        for p in procs:
+            p.start()
+        time.sleep(2)
+        t0 = time.perf_counter()
+        start.set()
+        results = [out.get() for _ in procs]
+        elapsed = time.perf_counter() - t0
+        for p in procs:
+            p.join()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    latencies = [ms for lat, _ in results for ms in lat]
+    counts = sum((c for _, c in results), Counter())
+    total = len(latencies)
+    errors = counts.pop('errors', 0)
+
+    print('=' * 60)
+    print(f'/api/input 書き込み: {args.writers}プロセス × {args.requests}リクエスト')
+    print('=' * 60)
+    print(f'1リクエストあたりのSQL文: {sum(counts.values()) / total:.1f}')
+    for kind, n in counts.most_common():
+        print(f'    {kind}: {n / total:.1f}')
+    print(f'レイテンシ: p50 {percentile(latencies, 0.5):.1f} ms / '
+          f'p95 {percentile(latencies, 0.95):.1f} ms / 最大 {max(latencies):.1f} ms')
+    print(f'スループット: {total / elapsed:.0f} req/s')
+    print(f'エラー: {errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+起動時間・メモリ使用量のベンチマーク
+
+1. import時間: アプリ本体と予測モジュール（pandas / statsmodels）の読み込み時間
+2. 軽量ルート（/api/login, /api/records, /api/logs）がstatsmodelsを読み込まないことの確認
+3. gunicornをpreloadあり・なしで起動し、ワーカーごとのRSS / PSS（共有分を按分したメモリ）を比較
+
+使い方:
+    python bench_startup.py [--workers 4] [--requests 20] [--user TestUser]
+
+DBは一時ディレクトリにコピーしたものを使うため、breads_full.db は変更されない。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(ROOT, 'app', 'backend')
+
+IMPORT_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+light = 'statsmodels' in sys.modules
+client = app.app.test_client()
+client.post('/api/login', json={'username': 'bench'})
+client.get('/api/records')
+client.post('/api/logs', json={'password': 'none'})
+after_light_routes = 'statsmodels' in sys.modules
+t2 = time.perf_counter()
+import forecast
+forecast.preload_heavy_modules()
+t3 = time.perf_counter()
+print(json.dumps({
+    'app_import_ms': (t1 - t0) * 1000,
+    'heavy_import_ms': (t3 - t2) * 1000,
+    'statsmodels_after_app_import': light,
+    'statsmodels_after_light_routes': after_light_routes,
+}))
+"""
+
+
+def measure_imports(env):
+    """新しいプロセスでimport時間を計測"""
+    out = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT],
+        cwd=BACKEND, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def worker_pids(master_pid):
+    """gunicornマスターの子プロセス（ワーカー）のPID"""
+    path = f'/proc/{master_pid}/task/{master_pid}/children'
+    with open(path) as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def memory_kb(pid):
+    """RSSとPSS（kB）を /proc/<pid>/smaps_rollup から取得"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:'):
+                values[parts[0][:-1].lower()] = int(parts[1])
+    return values
+
+
+def run_gunicorn(env, workers, requests, preload, user):
+    """gunicornを起動してリクエストを送り、ワーカーごとのメモリを計測"""
+    port = free_port()
+    env = dict(env, GUNICORN_PRELOAD='true' if preload else 'false')
+    tmp = env['BENCH_TMP']
+    proc = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn',
+            '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers),
+            '--access-logfile', '/dev/null',
+            '--error-logfile', os.path.join(tmp, 'error.log'),
+            '--pid', os.path.join(tmp, 'gunicorn.pid'),
+            'wsgi:application'
+        ],
+        cwd=BACKEND, env=env
+    )
+
+    started = time.perf_counter()
+    base = f'http://127.0.0.1:{port}'
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(base + '/', timeout=1).read()
+                break
+            except OSError:
+                if proc.poll() is not None or time.perf_counter() - started > 60:
+                    raise RuntimeError('gunicornの起動に失敗しました')
+                time.sleep(0.1)
+        while len(worker_pids(proc.pid)) < workers:
+            time.sleep(0.1)
+        ready_ms = (time.perf_counter() - started) * 1000
+
+        # ダッシュボードを叩いて予測モジュールを使わせる
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor())
+        login = urllib.request.Request(
+            base + '/api/login', data=json.dumps({'username': user}).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        opener.open(login).read()
+        for _ in range(requests):
+            opener.open(base + '/api/dashboard').read()
+            opener.open(base + '/api/backtest').read()
+
+        pids = worker_pids(proc.pid)
+        mem = [memory_kb(pid) for pid in pids]
+        return {
+            'ready_ms': ready_ms,
+            'master': memory_kb(proc.pid),
+            'workers': mem,
+        }
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='起動時間・ワーカーメモリのベンチマーク')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--user', default='TestUser', help='ダッシュボードを表示するユーザー')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'breads_full.db')
+    shutil.copy(os.path.join(ROOT, 'breads_full.db'), db_path)
+    env = dict(os.environ, DB_PATH=db_path, BENCH_TMP=tmp)
+
+    try:
+        print('=' * 60)
+        print('import時間')
+        print('=' * 60)
+        imports = measure_imports(env)
+        print(f"アプリ本体: {imports['app_import_ms']:.0f} ms")
+        print(f"pandas / statsmodels: {imports['heavy_import_ms']:.0f} ms")
+        print(f"アプリimport後にstatsmodels読み込み済み: {imports['statsmodels_after_app_import']}")
+        print(f"軽量ルート実行後にstatsmodels読み込み済み: {imports['statsmodels_after_light_routes']}")
+
+        for preload in (False, True):
+            result = run_gunicorn(env, args.workers, args.requests, preload, args.user)
+            print('\n' + '=' * 60)
+            print(f"gunicorn preload={'あり' if preload else 'なし'} (workers={args.workers})")
+            print('=' * 60)
+            print(f"起動完了まで: {result['ready_ms']:.0f} ms")
+            print(f"マスター: RSS {result['master']['rss'] / 1024:.1f} MB")
+            for i, mem in enumerate(result['workers']):
+                print(f"ワーカー{i + 1}: RSS {mem['rss'] / 1024:.1f} MB / PSS {mem['pss'] / 1024:.1f} MB")
+            total_pss = sum(m['pss'] for m in result['workers']) + result['master']['pss']
+            print(f"合計PSS: {total_pss / 1024:.1f} MB")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
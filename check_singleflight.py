@@ -0,0 +1,141 @@
+"""
+同じ計算の重複実行の防止（シングルフライト）の動作確認
+
+複数のワーカープロセスから同時に同じユーザーのダッシュボードを要求し、次の点を確認する。
+
+1. 推奨量（compute_recs）の計算は1回だけで、他のワーカーはその結果を使う
+2. 天気情報のキャッシュが空の場合も、APIへのアクセスは1回だけ
+3. 全ワーカーが同じ推奨量を返す
+
+使い方:
+    python check_singleflight.py [--workers 6]
+
+DBは一時ディレクトリにコピーしたものを使うため、breads_full.db は変更されない。
+天気APIの代わりにローカルでスタブサーバーを起動する。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(ROOT, 'app', 'backend')
+
+UPSTREAM_DELAY = 0.5
+
+
+class StubState:
+    hits = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenWeatherMapの応答を返すスタブ"""
+
+    def do_GET(self):
+        StubState.hits += 1
+        time.sleep(UPSTREAM_DELAY)
+        body = json.dumps({
+            'main': {'temp': 20.0, 'feels_like': 20.0, 'humidity': 50},
+            'weather': [{'description': '晴れ', 'icon': '01d', 'main': 'Clear'}]
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def worker(user, start, out):
+    """1つのワーカープロセス: 合図と同時にダッシュボードを要求し、(推奨量, 天気) を返す"""
+    sys.path.insert(0, BACKEND)
+    os.chdir(BACKEND)
+    from app import app
+
+    client = app.test_client()
+    client.post('/api/login', json={'username': user})
+    start.wait()
+    data = client.get('/api/dashboard').get_json()
+    out.put((json.dumps(data['recommendations'], sort_keys=True), data['weather'].get('temp')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='シングルフライトの動作確認')
+    parser.add_argument('--workers', type=int, default=6)
+    parser.add_argument('--user', default='TestUser')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'breads_full.db')
+    shutil.copy(os.path.join(ROOT, 'breads_full.db'), db_path)
+    os.environ.update({
+        'DB_PATH': db_path,
+        'OPENWEATHER_API_URL': f'http://127.0.0.1:{server.server_port}/weather',
+        'DASHBOARD_BUDGET': '30',
+    })
+
+    # 今日の日次ジョブ（データバージョンの更新など）を先に済ませておく
+    sys.path.insert(0, BACKEND)
+    os.chdir(BACKEND)
+    import sqlite3
+    from app import app
+    import scheduler
+    scheduler.run_daily_jobs(app)
+    con = sqlite3.connect(db_path)
+    con.execute("DELETE FROM recommendations")
+    con.execute("DELETE FROM api_cache")
+    con.execute("DELETE FROM singleflight_stats")
+    con.commit()
+
+    failures = []
+
+    def check(name, ok, detail):
+        print(f"[{'OK' if ok else 'NG'}] {name}: {detail}")
+        if not ok:
+            failures.append(name)
+
+    try:
+        ctx = multiprocessing.get_context('fork')
+        start, out = ctx.Event(), ctx.Queue()
+        procs = [ctx.Process(target=worker, args=(args.user, start, out)) for _ in range(args.workers)]
+        for p in procs:
+            p.start()
+        time.sleep(2)
+        start.set()
+        results = [out.get(timeout=120) for _ in procs]
+        for p in procs:
+            p.join()
+
+        stats = {}
+        for name, outcome, count in con.execute("SELECT name, outcome, count FROM singleflight_stats"):
+            stats.setdefault(name, {})[outcome] = count
+        recs = stats.get('recommendations', {})
+        weather = stats.get('api_cache', {})
+
+        check('推奨量の計算', recs.get('computed') == 1,
+              f"計算 {recs.get('computed', 0)}回, 結果の共有 {recs.get('coalesced', 0)}回, 待ち切れ {recs.get('timeout', 0)}回")
+        check('天気APIへのアクセス', StubState.hits == 1,
+              f"APIアクセス {StubState.hits}回, 結果の共有 {weather.get('coalesced', 0)}回")
+        check('同じ結果', len({r[0] for r in results}) == 1 and None not in [r[1] for r in results],
+              f'{args.workers}ワーカーの推奨量の種類 {len({r[0] for r in results})}')
+    finally:
+        con.close()
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
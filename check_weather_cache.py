@@ -0,0 +1,160 @@
+"""
+天気情報キャッシュの動作確認（ローカルのスタブHTTPサーバーを使用）
+
+OpenWeatherMapの代わりにローカルでスタブサーバーを起動し、OPENWEATHER_API_URL を
+向けた状態で複数のワーカープロセスから天気情報を取得して、次の点を確認する。
+
+1. TTL内は何回呼んでもAPIにアクセスしない（全ワーカーで共有）
+2. TTL切れ後は古い値をすぐに返し、更新は1つのワーカーだけがバックグラウンドで行う
+3. APIが失敗した場合は古い値を返し続け、再試行は API_CACHE_NEGATIVE_TTL ごとに1回だけ
+
+使い方:
+    python check_weather_cache.py [--workers 4]
+
+DBは一時ディレクトリにコピーしたものを使うため、breads_full.db は変更されない。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(ROOT, 'app', 'backend')
+
+TTL = 2
+NEGATIVE_TTL = 1
+UPSTREAM_DELAY = 1.0
+
+
+class StubState:
+    hits = 0
+    fail = False
+    temp = 20.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenWeatherMapの応答を返すスタブ"""
+
+    def do_GET(self):
+        StubState.hits += 1
+        time.sleep(UPSTREAM_DELAY)
+        if StubState.fail:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps({
+            'main': {'temp': StubState.temp, 'feels_like': StubState.temp, 'humidity': 50},
+            'weather': [{'description': '晴れ', 'icon': '01d', 'main': 'Clear'}]
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def worker(calls, out):
+    """1つのワーカープロセス: 天気情報を calls 回取得し、(最大レイテンシ, 気温のリスト) を返す"""
+    sys.path.insert(0, BACKEND)
+    os.chdir(BACKEND)
+    from app import app
+    import weather_holiday
+
+    latencies, temps = [], []
+    for _ in range(calls):
+        with app.app_context():
+            t0 = time.perf_counter()
+            weather = weather_holiday.get_kobe_weather()
+            latencies.append(time.perf_counter() - t0)
+            temps.append(weather['temp'] if weather else None)
+        time.sleep(0.05)
+    out.put((max(latencies), temps))
+
+
+def run_workers(n, calls):
+    ctx = multiprocessing.get_context('fork')
+    out = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(calls, out)) for _ in range(n)]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return max(r[0] for r in results), [t for r in results for t in r[1]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='天気情報キャッシュの動作確認')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'breads_full.db')
+    shutil.copy(os.path.join(ROOT, 'breads_full.db'), db_path)
+    os.environ.update({
+        'DB_PATH': db_path,
+        'OPENWEATHER_API_URL': f'http://127.0.0.1:{server.server_port}/weather',
+        'WEATHER_CACHE_TTL': str(TTL),
+        'API_CACHE_NEGATIVE_TTL': str(NEGATIVE_TTL),
+    })
+
+    failures = []
+
+    def check(name, ok, detail):
+        print(f"[{'OK' if ok else 'NG'}] {name}: {detail}")
+        if not ok:
+            failures.append(name)
+
+    try:
+        # 初回: 1つのワーカーが取得して保存する
+        run_workers(1, 1)
+        check('初回取得', StubState.hits == 1, f'APIアクセス {StubState.hits}回')
+
+        # TTL内: 全ワーカーがキャッシュを使う
+        StubState.hits = 0
+        _, temps = run_workers(args.workers, 5)
+        check('TTL内の共有', StubState.hits == 0 and None not in temps,
+              f'{args.workers}ワーカー × 5回でAPIアクセス {StubState.hits}回')
+
+        # TTL切れ: 古い値をすぐ返し、更新は1回だけ
+        time.sleep(TTL + 0.2)
+        StubState.hits = 0
+        StubState.temp = 25.0
+        latency, temps = run_workers(args.workers, 3)
+        check('stale-while-revalidate', StubState.hits == 1 and latency < UPSTREAM_DELAY and temps[0] == 20.0,
+              f'APIアクセス {StubState.hits}回, 最大レイテンシ {latency * 1000:.0f} ms（API応答 {UPSTREAM_DELAY * 1000:.0f} ms）')
+        time.sleep(UPSTREAM_DELAY + 0.2)
+        _, temps = run_workers(1, 1)
+        check('更新後の値', temps == [25.0], f'気温 {temps}')
+
+        # API障害: 古い値を返し続け、再試行は NEGATIVE_TTL ごとに1回
+        time.sleep(TTL + 0.2)
+        StubState.hits = 0
+        StubState.fail = True
+        started = time.time()
+        _, temps = run_workers(args.workers, 20)
+        elapsed = time.time() - started
+        expected = int(elapsed / NEGATIVE_TTL) + 2
+        check('障害時のネガティブキャッシュ', 1 <= StubState.hits <= expected and None not in temps,
+              f'{elapsed:.1f}秒間でAPIアクセス {StubState.hits}回（上限 {expected}回）, 古い値を返した回数 {len(temps)}')
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+pytest の共通フィクスチャ
+
+app:          一時ディレクトリにコピーした breads_full.db と天気APIのスタブで起動したアプリ
+              （QUERY_COUNT=true。breads_full.db は変更されない）
+client:       USER でログインしたテストクライアント
+query_budget: SQL文の数（クエリ予算）の確認
+    query_budget.request(method, path, ...)  応答の X-Query-Count がテストモジュールの
+                                             QUERY_BUDGETS[エンドポイント名] 以内か
+    with query_budget(n): ...                アプリのコンテキスト内で query_counter.budget(n)
+
+使い方:
+    python -m pytest -q
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(ROOT, 'app', 'backend')
+
+USER = 'TestUser'
+ADMIN_PASSWORD = 'check'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenWeatherMapの応答を返すスタブ"""
+
+    def do_GET(self):
+        body = json.dumps({
+            'main': {'temp': 20.0, 'feels_like': 20.0, 'humidity': 50},
+            'weather': [{'description': '晴れ', 'icon': '01d', 'main': 'Clear'}]
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='session')
+def app():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'breads_full.db')
+    shutil.copy(os.path.join(ROOT, 'breads_full.db'), db_path)
+    os.environ.update({
+        'DB_PATH': db_path,
+        'QUERY_COUNT': 'true',
+        'OPENWEATHER_API_URL': f'http://127.0.0.1:{server.server_port}/weather',
+        'DASHBOARD_BUDGET': '30',
+        # 終了時にプロセスプールが残らないよう、バックテストのジョブはスレッド内で実行する
+        'BACKTEST_JOB_EXECUTION': 'serial',
+        'ADMIN_PASSWORD': ADMIN_PASSWORD,
+        'PROFILE_DIR': os.path.join(tmp, 'profiles'),
+    })
+
+    cwd = os.getcwd()
+    sys.path.insert(0, BACKEND)
+    os.chdir(BACKEND)
+    from app import app as flask_app
+    import scheduler
+
+    # 今日の日次ジョブ（データバージョンの更新・推奨量の計算など）を先に済ませておく
+    scheduler.run_daily_jobs(flask_app)
+    flask_app.config['DB_PATH'] = db_path
+    try:
+        yield flask_app
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/api/login', json={'username': USER})
+    return client
+
+
+class QueryBudget:
+    """応答の X-Query-Count・関数単位の query_counter.budget でSQL文の数を確認する"""
+
+    def __init__(self, app, client, budgets):
+        self.app = app
+        self.client = client
+        self.budgets = budgets
+        self.seen = set()
+
+    def request(self, method, path, limit=None, **kwargs):
+        """
+        リクエストを送り、SQL文の数が limit（省略時は QUERY_BUDGETS[エンドポイント名]）以内か確認
+
+        Returns:
+            応答（response.query_count に X-Query-Count の値）
+        """
+        endpoint, _ = self.app.url_map.bind('localhost').match(path.split('?')[0], method)
+        if limit is None:
+            limit = self.budgets[endpoint]
+        self.seen.add(endpoint)
+        response = self.client.open(path, method=method, **kwargs)
+        assert response.status_code < 500, f'{method} {path}: HTTP {response.status_code}'
+        assert 'X-Query-Count' in response.headers, f'{method} {path}: X-Query-Count がない'
+        response.query_count = int(response.headers['X-Query-Count'])
+        assert response.query_count <= limit, \
+            f'{method} {path}: SQL文 {response.query_count} 件（上限 {limit} 件）'
+        return response
+
+    @contextmanager
+    def __call__(self, limit):
+        import query_counter
+
+        with self.app.app_context(), query_counter.budget(limit) as b:
+            yield b
+
+
+_seen_endpoints = set()
+
+
+@pytest.fixture
+def query_budget(request, app, client):
+    budget = QueryBudget(app, client, getattr(request.module, 'QUERY_BUDGETS', {}))
+    yield budget
+    _seen_endpoints.update(budget.seen)
+
+
+@pytest.fixture
+def seen_endpoints():
+    """このセッションで query_budget.request から呼び出したエンドポイント名"""
+    return _seen_endpoints
+
+
+@pytest.fixture
+def db(app):
+    """一時DBへの直接の接続（テストデータの用意・結果の確認用）"""
+    import sqlite3
+
+    con = sqlite3.connect(app.config['DB_PATH'])
+    try:
+        yield con
+    finally:
+        con.close()
+
+
+@pytest.fixture
+def yesterday_batches(db):
+    """/api/input が在庫から差し引けるよう、全パンの前日のバッチを用意する"""
+    from forecast import BREADS
+
+    db.executemany(
+        """INSERT INTO batches (user, bread, qty, added_date, remaining) VALUES (?, ?, 20, ?, 20)
+           ON CONFLICT(user, bread, added_date) DO UPDATE SET qty=20, remaining=20""",
+        [(USER, bread, (date.today() - timedelta(days=1)).isoformat()) for bread in BREADS]
+    )
+    db.commit()
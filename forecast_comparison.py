@@ -8,8 +8,14 @@
 4. Holt法 (Holt's Linear Trend)
 5. Holt-Winters法 (季節性考慮)
 6. 曜日効果を加えた加重移動平均
+7. Holt法 / Holt-Winters法 (NumPyエンジン)
+8. 天気の補正を加えた手法（weather_daily に天気の記録がある場合）
+
+NumPyエンジンのMAEがstatsmodelsより ENGINE_TOLERANCE 以上悪化した場合は終了コード1で終わる。
 """
 
+import os
+import sys
 import sqlite3
 import pandas as pd
 import numpy as np
@@ -18,6 +24,15 @@ from statsmodels.tsa.holtwinters import ExponentialSmoothing, SimpleExpSmoothing
 import warnings
 warnings.filterwarnings('ignore')
 
+# NumPyエンジン（app/backend/hw_numpy.py）を読み込む
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'backend'))
+import hw_numpy
+import weather_store
+from forecast import fit_weather_effect, weather_correction
+
+# NumPyエンジンのMAEがstatsmodelsのMAEから外れてよい割合
+ENGINE_TOLERANCE = 0.15
+
 BREADS = ["細パン", "太パン", "サンドパン", "バゲット"]
 
 # 曜日の重み付け（実データから調整可能）
@@ -49,6 +64,26 @@ def get_sales_data(user, bread):
     df['day'] = pd.to_datetime(df['day'])
     return df['sold'].values, df['day'].values
 
+def get_weather_data(dates):
+    """販売データの日付に対応する天気（weather_daily、1回のクエリで取得）"""
+    db = sqlite3.connect('breads_full.db')
+    db.row_factory = sqlite3.Row
+    try:
+        return weather_store.lookup(np.asarray(dates, dtype='datetime64[D]'), db=db)
+    except sqlite3.OperationalError:
+        # weather_daily がまだ作られていない
+        return np.full((len(dates), len(weather_store.WEATHER_FEATURES)), np.nan)
+    finally:
+        db.close()
+
+def weather_adjusted(method_func):
+    """予測手法に天気の補正（学習データで推定した天気の効果）を加える"""
+    def predict(series, weather_data, **kwargs):
+        train_weather, target_weather = weather_data
+        effect = fit_weather_effect(series, train_weather)
+        return method_func(series, **kwargs) + weather_correction(effect, target_weather[None])[0]
+    return predict
+
 def simple_moving_average(series, window=7):
     """単純移動平均"""
     if len(series) < window:
@@ -105,6 +140,18 @@ def holt_winters_method(series, seasonal_periods=7):
     except:
         return holt_method(series)
 
+def holt_numpy_method(series):
+    """Holt法（NumPyエンジン）"""
+    if len(series) < 3:
+        return np.mean(series) if len(series) > 0 else 0
+    return hw_numpy.forecast_batch([series], seasonal_periods=None)[0]
+
+def holt_winters_numpy_method(series, seasonal_periods=7):
+    """Holt-Winters法（NumPyエンジン）"""
+    if len(series) < 2 * seasonal_periods:
+        return holt_numpy_method(series)
+    return hw_numpy.forecast_batch([series], seasonal_periods=seasonal_periods)[0]
+
 def weekday_weighted_ma(series, dates_data=None, alpha=0.7):
     """曜日効果を考慮した加重移動平均"""
     if len(series) == 0:
@@ -122,7 +169,7 @@ def weekday_weighted_ma(series, dates_data=None, alpha=0.7):
 
     return base_forecast * weekday_factor
 
-def backtest_method(method_func, series, dates, test_days=7, **kwargs):
+def backtest_method(method_func, series, dates, test_days=7, weather=None, **kwargs):
     """
     バックテスト実行
 
@@ -131,6 +178,7 @@ def backtest_method(method_func, series, dates, test_days=7, **kwargs):
         series: 売上データ
         dates: 日付データ
         test_days: テスト日数
+        weather: 売上データと同じ並びの天気（weather_data を受け取る予測関数に渡す）
         **kwargs: 予測関数に渡す追加パラメータ
 
     Returns:
@@ -154,7 +202,9 @@ def backtest_method(method_func, series, dates, test_days=7, **kwargs):
         actual = series[i]
 
         # 予測実行
-        if 'dates_data' in kwargs:
+        if 'weather_data' in kwargs:
+            predicted = method_func(train_series, weather_data=(weather[:i], weather[i]), **{k: v for k, v in kwargs.items() if k != 'weather_data'})
+        elif 'dates_data' in kwargs:
             predicted = method_func(train_series, dates_data=train_dates, **{k: v for k, v in kwargs.items() if k != 'dates_data'})
         else:
             predicted = method_func(train_series, **kwargs)
@@ -206,16 +256,24 @@ def compare_all_methods(user='TestUser'):
             '指数平滑法': (exponential_smoothing, {}),
             'Holt法': (holt_method, {}),
             'Holt-Winters法': (holt_winters_method, {'seasonal_periods': 7}),
+            'Holt法(NumPy)': (holt_numpy_method, {}),
+            'Holt-Winters法(NumPy)': (holt_winters_numpy_method, {'seasonal_periods': 7}),
             '曜日加重移動平均': (weekday_weighted_ma, {'dates_data': True, 'alpha': 0.7})
         }
 
+        # 天気の記録がある場合は天気の補正を加えた手法も比較する
+        weather = get_weather_data(dates)
+        if np.isfinite(weather).all(axis=1).any():
+            methods['Holt-Winters法+天気'] = (weather_adjusted(holt_winters_method), {'weather_data': True, 'seasonal_periods': 7})
+            methods['Holt-Winters法(NumPy)+天気'] = (weather_adjusted(holt_winters_numpy_method), {'weather_data': True, 'seasonal_periods': 7})
+
         bread_results = {}
 
         print(f"\n{'手法':<20} {'MAE':<10} {'RMSE':<10} {'MAPE(%)':<10}")
         print("-" * 60)
 
         for method_name, (method_func, params) in methods.items():
-            result = backtest_method(method_func, series, dates, test_days=7, **params)
+            result = backtest_method(method_func, series, dates, test_days=7, weather=weather, **params)
             bread_results[method_name] = result
 
             if result['mae'] is not None:
@@ -234,6 +292,29 @@ def compare_all_methods(user='TestUser'):
 
     return results
 
+def check_engine_tolerance(results, tolerance=ENGINE_TOLERANCE):
+    """NumPyエンジンのMAEがstatsmodelsより許容範囲以上に悪化していないか確認"""
+    pairs = {
+        'Holt法': 'Holt法(NumPy)',
+        'Holt-Winters法': 'Holt-Winters法(NumPy)'
+    }
+
+    all_ok = True
+    for bread, methods in results.items():
+        for ref_name, numpy_name in pairs.items():
+            ref = methods.get(ref_name, {}).get('mae')
+            val = methods.get(numpy_name, {}).get('mae')
+            if ref is None or val is None:
+                continue
+
+            diff = (val - ref) / ref if ref > 0 else val - ref
+            ok = diff <= tolerance
+            all_ok = all_ok and ok
+            mark = "✓" if ok else "✗"
+            print(f"{mark} {bread} {numpy_name}: MAE {val:.2f} (statsmodels {ref:.2f}, 差 {diff * 100:+.1f}%)")
+
+    return all_ok
+
 def export_results_to_csv(results):
     """結果をCSVにエクスポート"""
     rows = []
@@ -266,6 +347,12 @@ if __name__ == "__main__":
     # 結果をCSVにエクスポート
     df_results = export_results_to_csv(results)
 
+    # NumPyエンジンの精度確認
+    print("\n【NumPyエンジンの精度確認】")
+    engine_ok = check_engine_tolerance(results)
+    if not engine_ok:
+        print(f"⚠️ NumPyエンジンのMAEがstatsmodelsより{ENGINE_TOLERANCE * 100:.0f}%以上悪化しています")
+
     print("\n" + "="*60)
     print("比較完了")
     print("="*60)
@@ -279,3 +366,7 @@ if __name__ == "__main__":
                 best_method = min(valid_results, key=lambda k: valid_results[k]['mae'])
                 best_mae = valid_results[best_method]['mae']
                 print(f"{bread}: {best_method} (MAE: {best_mae:.2f})")
+
+    # 許容範囲を超えた場合はCIで検出できるよう終了コード1で終わる
+    if not engine_ok:
+        sys.exit(1)
@@ -1,9 +1,13 @@
 """
 Gunicorn設定ファイル（本番環境用）
 """
+import gc
 import multiprocessing
 import os
 
+# アプリケーション（app/backend）のパス
+pythonpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'backend')
+
 # サーバーバインド
 bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
 
@@ -14,6 +18,10 @@ worker_connections = 1000
 timeout = 120
 keepalive = 5
 
+# マスタープロセスでアプリと予測モジュールを読み込んでからforkする
+# （各ワーカーはcopy-on-writeでメモリを共有し、起動時のimportも不要になる）
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
 # ログ設定
 accesslog = '/var/log/panzaiko/access.log'
 errorlog = '/var/log/panzaiko/error.log'
@@ -32,3 +40,23 @@ pidfile = '/var/run/panzaiko/panzaiko.pid'
 limit_request_line = 4096
 limit_request_fields = 100
 limit_request_field_size = 8190
+
+def on_starting(server):
+    """前回の起動時の計測値（ワーカーごとのファイル）を削除"""
+    import metrics
+    metrics.reset_dir()
+
+def when_ready(server):
+    """fork前にpandas/statsmodelsを読み込み、共有メモリのページをGC対象から外す"""
+    if not preload_app:
+        return
+    import forecast
+    forecast.preload_heavy_modules()
+    # 読み込み済みオブジェクトをGCの走査対象から外し、GCによる共有ページへの書き込みを防ぐ
+    gc.freeze()
+
+def worker_exit(server, worker):
+    """ワーカー終了時にキューに残っている操作ログを書き込む"""
+    import db
+    if not db.flush_logs():
+        server.log.error("Audit log entries could not be written before worker exit")
@@ -0,0 +1,165 @@
+"""
+ルートごとのSQL文の数（クエリ予算）のテスト
+
+app.py の各ルートを呼び出し、X-Query-Count ヘッダーの値が QUERY_BUDGETS の上限以内かを確認する
+（ループ内のクエリ（N+1）の混入を検出する）。あわせて次の点も確認する。
+1. 在庫から差し引くパンの数・取り込む行数を増やしてもSQL文の数が増えない（/api/input, /api/ingest）
+   （前日のバッチを用意しておき、/api/input で実際にFIFOの差し引きが行われたことも確認する）
+2. ETagが一致するダッシュボードの要求が 304 になる
+3. 推奨量の計算（compute_recs）のSQL文が COMPUTE_RECS_BUDGET 以内
+
+天気の取得は別スレッドで行うため数に含まれない。
+"""
+
+from datetime import date
+
+import pytest
+
+from conftest import ADMIN_PASSWORD, USER
+
+# エンドポイントごとのSQL文の上限（実測値に少し余裕を持たせた値）
+QUERY_BUDGETS = {
+    'index': 0,
+    'dashboard': 0,
+    'api_dashboard': 4,
+    'api_weather': 2,
+    'api_events': 1,
+    'api_records': 3,
+    'api_export_records': 2,
+    'api_input': 11,
+    'api_ingest': 5,
+    'api_update_record': 10,
+    'api_delete_record': 10,
+    'api_backtest': 6,
+    'api_backtest_submit': 6,
+    'api_backtest_job': 2,
+    'prometheus_metrics': 2,
+    'api_profiles': 1,
+    'api_profile': 1,
+    'api_logs': 2,
+    'api_login': 1,
+    'api_logout': 1,
+}
+
+# ETagが一致した（304を返す）ダッシュボードの要求の上限
+DASHBOARD_NOT_MODIFIED_BUDGET = 2
+
+# compute_recs 1回あたりのSQL文の上限（パンの数によらない）
+COMPUTE_RECS_BUDGET = 4
+
+BREADS = ['細パン', '太パン', 'サンドパン', 'バゲット']
+
+ADMIN_HEADERS = {'X-Admin-Password': ADMIN_PASSWORD}
+
+
+def input_payload(breads):
+    # api_input と同じ形（パンごとに purchased / leftover）
+    return {'date': date.today().isoformat(), **{b: {'purchased': 3, 'leftover': 1} for b in breads}}
+
+
+def ingest_rows(n):
+    return [{'day': f'2020-01-{1 + i % 28:02d}', 'bread': BREADS[i % len(BREADS)],
+             'sold': 1, 'leftover': 0, 'user': USER} for i in range(n)]
+
+
+@pytest.fixture
+def record_id(client):
+    """今日の入力を済ませ、最新のレコードのIDを返す"""
+    client.post('/api/input', json=input_payload(BREADS))
+    return client.get('/api/records').get_json()['records'][0]['id']
+
+
+def test_every_route_has_a_budget(app):
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != 'static'}
+    assert endpoints == set(QUERY_BUDGETS)
+
+
+def test_pages(query_budget):
+    query_budget.request('GET', '/')
+    query_budget.request('GET', '/dashboard')
+
+
+def test_login_logout(app, query_budget):
+    query_budget.request('POST', '/api/logout')
+    query_budget.request('POST', '/api/login', json={'username': USER})
+
+
+def test_dashboard_and_not_modified(client, query_budget):
+    # 最初の要求で天気のキャッシュが作られ、ETagに含まれる取得時刻が変わるため1回空打ちする
+    client.get('/api/dashboard')
+    r = query_budget.request('GET', '/api/dashboard')
+    assert r.headers.get('ETag')
+
+    r = query_budget.request('GET', '/api/dashboard', limit=DASHBOARD_NOT_MODIFIED_BUDGET,
+                             headers={'If-None-Match': r.headers['ETag']})
+    assert r.status_code == 304
+
+
+def test_weather_and_events(query_budget):
+    query_budget.request('GET', '/api/weather')
+    query_budget.request('GET', '/api/events')
+
+
+def test_input_consumes_stock_with_constant_queries(query_budget, db, yesterday_batches):
+    one = query_budget.request('POST', '/api/input', json=input_payload(BREADS[:1]))
+    assert one.get_json()['success']
+    every = query_budget.request('POST', '/api/input', json=input_payload(BREADS))
+    assert every.get_json()['success']
+    assert one.query_count == every.query_count
+
+    consumed = db.execute(
+        'SELECT COUNT(DISTINCT bread) FROM batch_consumptions WHERE user=? AND day=?',
+        (USER, date.today().isoformat())
+    ).fetchone()[0]
+    assert consumed == len(BREADS)
+
+
+def test_ingest_with_constant_queries(query_budget):
+    few = query_budget.request('POST', '/api/ingest', json=ingest_rows(10))
+    many = query_budget.request('POST', '/api/ingest', json=ingest_rows(500))
+    assert few.query_count == many.query_count
+
+
+def test_records(query_budget, record_id):
+    query_budget.request('GET', '/api/records')
+    query_budget.request('GET', '/api/records/export')
+
+
+def test_update_and_delete_record(query_budget, record_id):
+    r = query_budget.request('PUT', f'/api/records/{record_id}', json={'sold': 5, 'leftover': 1})
+    assert r.get_json()['success']
+    r = query_budget.request('DELETE', f'/api/records/{record_id}')
+    assert r.get_json()['success']
+
+
+def test_backtest(query_budget):
+    assert query_budget.request('GET', '/api/backtest').get_json()['success']
+    r = query_budget.request('POST', '/api/backtest', json={'days': 7})
+    r = query_budget.request('GET', f"/api/backtest/{r.get_json()['job_id']}")
+    assert r.get_json()['success']
+
+
+def test_metrics_and_logs(query_budget):
+    query_budget.request('GET', '/metrics')
+    r = query_budget.request('POST', '/api/logs', json={'password': ADMIN_PASSWORD})
+    assert r.get_json()['success']
+
+
+def test_profiles(client, query_budget):
+    client.get('/api/events', headers={'X-Profile': ADMIN_PASSWORD})
+    r = query_budget.request('GET', '/api/admin/profiles', headers=ADMIN_HEADERS)
+    name = r.get_json()['profiles'][0]['name']
+    r = query_budget.request('GET', f'/api/admin/profiles/{name}', headers=ADMIN_HEADERS)
+    assert r.status_code == 200
+
+
+def test_compute_recs(query_budget):
+    import forecast
+
+    with query_budget(COMPUTE_RECS_BUDGET):
+        forecast.compute_recs(USER)
+
+
+def test_every_route_exercised(seen_endpoints):
+    # 上のテストで全エンドポイントを呼び出したか（このモジュールの最後に実行する）
+    assert set(QUERY_BUDGETS) <= seen_endpoints